@@ -348,12 +348,22 @@ def info_to_png():
     if error:
         return error
 
+    from services.pdf_to_images import AVIF_DISPONIBLE
+    if opciones.get('formato') == 'avif' and not AVIF_DISPONIBLE:
+        return respuesta_error(
+            'AVIF_NOT_AVAILABLE',
+            'El codificador AVIF no está instalado (Pillow >= 11.3 o pillow-avif-plugin)',
+            503
+        )
+
     try:
         from services.pdf_to_images import obtener_info_conversion
         info = obtener_info_conversion(archivo_id, opciones)
 
         return respuesta_exitosa(info, 'Informacion obtenida')
 
+    except ValueError as e:
+        return respuesta_error('INVALID_PARAMS', str(e), 400)
     except Exception as e:
         logger.error(f"Error obteniendo info png: {e}")
         return respuesta_error('INFO_ERROR', str(e), 500)
@@ -369,6 +379,7 @@ def convertir_to_jpg():
     - opciones:
         - dpi: 72 | 150 | 300 | 600
         - calidad: 60-95 (porcentaje de calidad JPG)
+        - optimizar: true = archivos mas chicos (pasada Huffman extra, mas lento)
         - paginas: 'all' | '1-10' | '1,3,5-10'
 
     Retorna:
@@ -407,6 +418,165 @@ def convertir_to_jpg():
         return respuesta_error('JOB_ERROR', str(e), 500)
 
 
+@bp.route('/to-webp', methods=['POST'])
+def convertir_to_webp():
+    """
+    Convierte PDF a imagenes WebP.
+
+    Espera JSON:
+    - file_id: ID del archivo
+    - opciones:
+        - dpi: 72 | 150 | 300 | 600 (maximo 16383 px por lado)
+        - calidad: 0-100 (default 80; sin perdida es el esfuerzo de compresion)
+        - sin_perdida: true = WebP lossless
+        - paginas: 'all' | '1-10' | '1,3,5-10'
+
+    Retorna:
+    - Info del trabajo creado
+    """
+    datos = request.get_json()
+
+    if not datos:
+        return respuesta_error('NO_DATA', 'No se enviaron datos')
+
+    archivo_id = datos.get('file_id')
+    opciones = datos.get('opciones', {})
+
+    archivo, error = validar_archivo(archivo_id)
+    if error:
+        return error
+
+    # Crear trabajo
+    try:
+        trabajo_id = job_manager.encolar_trabajo(
+            archivo_id=archivo_id,
+            tipo_conversion='to-webp',
+            parametros=opciones
+        )
+
+        trabajo = models.obtener_trabajo(trabajo_id)
+
+        return respuesta_exitosa({
+            'job_id': trabajo_id,
+            'estado': trabajo['estado'],
+            'mensaje': 'Conversion a WebP iniciada'
+        }, 'Trabajo encolado correctamente')
+
+    except Exception as e:
+        logger.error(f"Error creando trabajo to-webp: {e}")
+        return respuesta_error('JOB_ERROR', str(e), 500)
+
+
+@bp.route('/to-avif', methods=['POST'])
+def convertir_to_avif():
+    """
+    Convierte PDF a imagenes AVIF.
+
+    Espera JSON:
+    - file_id: ID del archivo
+    - opciones:
+        - dpi: 72 | 150 | 300 | 600
+        - calidad: 0-100 (default 60)
+        - paginas: 'all' | '1-10' | '1,3,5-10'
+
+    Retorna:
+    - Info del trabajo creado
+    """
+    datos = request.get_json()
+
+    if not datos:
+        return respuesta_error('NO_DATA', 'No se enviaron datos')
+
+    archivo_id = datos.get('file_id')
+    opciones = datos.get('opciones', {})
+
+    archivo, error = validar_archivo(archivo_id)
+    if error:
+        return error
+
+    from services.pdf_to_images import AVIF_DISPONIBLE
+    if not AVIF_DISPONIBLE:
+        return respuesta_error(
+            'AVIF_NOT_AVAILABLE',
+            'El codificador AVIF no está instalado (Pillow >= 11.3 o pillow-avif-plugin)',
+            503
+        )
+
+    # Crear trabajo
+    try:
+        trabajo_id = job_manager.encolar_trabajo(
+            archivo_id=archivo_id,
+            tipo_conversion='to-avif',
+            parametros=opciones
+        )
+
+        trabajo = models.obtener_trabajo(trabajo_id)
+
+        return respuesta_exitosa({
+            'job_id': trabajo_id,
+            'estado': trabajo['estado'],
+            'mensaje': 'Conversion a AVIF iniciada'
+        }, 'Trabajo encolado correctamente')
+
+    except Exception as e:
+        logger.error(f"Error creando trabajo to-avif: {e}")
+        return respuesta_error('JOB_ERROR', str(e), 500)
+
+
+@bp.route('/to-tiff', methods=['POST'])
+def convertir_to_tiff():
+    """
+    Convierte PDF a un unico TIFF multipagina comprimido (G4 para paginas
+    bitonales, deflate para grises y color).
+
+    Espera JSON:
+    - file_id: ID del archivo
+    - opciones:
+        - dpi: 72 | 150 | 300 | 600
+        - modo_color: 'auto' (por pagina) | 'color' | 'gris' | 'bitonal'
+        - paginas: 'all' | '1-10' | '1,3,5-10'
+
+    Retorna:
+    - Info del trabajo creado
+    """
+    datos = request.get_json()
+
+    if not datos:
+        return respuesta_error('NO_DATA', 'No se enviaron datos')
+
+    archivo_id = datos.get('file_id')
+    opciones = datos.get('opciones', {})
+
+    archivo, error = validar_archivo(archivo_id)
+    if error:
+        return error
+
+    from services.pdf_to_images import MODOS_COLOR
+    if opciones.get('modo_color', 'auto') not in MODOS_COLOR:
+        return respuesta_error('INVALID_FORMAT',
+                               f"modo_color debe ser uno de: {', '.join(MODOS_COLOR)}")
+
+    # Crear trabajo
+    try:
+        trabajo_id = job_manager.encolar_trabajo(
+            archivo_id=archivo_id,
+            tipo_conversion='to-tiff',
+            parametros=opciones
+        )
+
+        trabajo = models.obtener_trabajo(trabajo_id)
+
+        return respuesta_exitosa({
+            'job_id': trabajo_id,
+            'estado': trabajo['estado'],
+            'mensaje': 'Conversion a TIFF iniciada'
+        }, 'Trabajo encolado correctamente')
+
+    except Exception as e:
+        logger.error(f"Error creando trabajo to-tiff: {e}")
+        return respuesta_error('JOB_ERROR', str(e), 500)
+
+
 @bp.route('/compress', methods=['POST'])
 def convertir_compress():
     """
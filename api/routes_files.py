@@ -5,7 +5,10 @@ Maneja subida, listado, eliminacion y miniaturas.
 """
 
 import re
-from flask import Blueprint, request, jsonify, send_file
+import json
+import uuid
+import hashlib
+from flask import Blueprint, request, jsonify, Response
 from werkzeug.utils import secure_filename
 import logging
 from pathlib import Path
@@ -13,13 +16,17 @@ from io import BytesIO
 
 import config
 import models
-from utils import file_manager
+from utils import file_manager, thumbnail
+from api.routes_jobs import parametros_listado, respuesta_paginada, proyectar
 
 logger = logging.getLogger(__name__)
 
 # Blueprint para rutas de archivos
 bp = Blueprint('files', __name__, url_prefix='/api/v1')
 
+# Campos de salida de /files
+CAMPOS_ARCHIVO = ('id', 'nombre_original', 'tamano_bytes', 'num_paginas', 'fecha_subida')
+
 
 def respuesta_exitosa(data=None, mensaje="Operacion completada"):
     """Genera respuesta JSON exitosa estandarizada."""
@@ -89,37 +96,149 @@ def subir_archivo():
             }, 'Archivo ya existente en el servidor')
 
     # Guardar archivo
-    resultado = file_manager.guardar_archivo(
-        archivo, nombre_original, fecha_modificacion
-    )
+    try:
+        resultado = file_manager.guardar_archivo(
+            archivo, nombre_original, fecha_modificacion
+        )
+    except file_manager.ContenidoEnConflicto as e:
+        return respuesta_error('HASH_CONFLICT', str(e), 409)
 
     if not resultado:
         return respuesta_error('SAVE_ERROR', 'Error al guardar el archivo', 500)
 
-    resultado['ya_existia'] = False
+    if resultado['ya_existia']:
+        return respuesta_exitosa(resultado, 'Archivo ya existente en el servidor')
+    return respuesta_exitosa(resultado, 'Archivo subido correctamente')
+
+
+@bp.route('/uploads', methods=['POST'])
+def iniciar_subida():
+    """
+    Inicia una subida reanudable por partes.
+
+    Espera JSON:
+    - nombre: Nombre original del archivo
+    - tamano: Tamano total en bytes
+    - fecha_modificacion: Fecha de modificacion ISO (opcional)
+
+    Retorna:
+    - id de la subida y tamano de parte sugerido
+    """
+    data = request.get_json(silent=True) or {}
+    nombre_original = data.get('nombre')
+    tamano = data.get('tamano')
+
+    if not nombre_original or not isinstance(tamano, int):
+        return respuesta_error('MISSING_PARAMS', 'Se requieren nombre y tamano')
+
+    try:
+        subida = file_manager.iniciar_subida(nombre_original, tamano,
+                                             data.get('fecha_modificacion'))
+    except file_manager.ErrorSubida as e:
+        return respuesta_error('INVALID_UPLOAD', str(e))
+
+    return respuesta_exitosa(subida, 'Subida iniciada')
+
+
+@bp.route('/uploads/<subida_id>', methods=['PUT'])
+def subir_parte(subida_id):
+    """
+    Recibe una parte de la subida. El cuerpo es el contenido binario y el
+    parametro offset indica su posicion; las partes pueden enviarse en
+    paralelo y en cualquier orden, y reenviar una parte la sobrescribe.
+    """
+    offset = request.args.get('offset', type=int)
+    longitud = request.content_length
+
+    if offset is None or not longitud:
+        return respuesta_error('MISSING_PARAMS', 'Se requieren offset y Content-Length')
+
+    try:
+        escritos = file_manager.escribir_parte(subida_id, offset, request.stream, longitud)
+    except KeyError:
+        return respuesta_error('NOT_FOUND', 'Subida no encontrada', 404)
+    except file_manager.ErrorSubida as e:
+        return respuesta_error('INVALID_CHUNK', str(e))
+
+    return respuesta_exitosa({'offset': offset, 'tamano': escritos}, 'Parte recibida')
+
+
+@bp.route('/uploads/<subida_id>', methods=['GET'])
+def obtener_subida(subida_id):
+    """Rangos ya recibidos de una subida (para reanudarla)."""
+    estado = file_manager.estado_subida(subida_id)
+    if not estado:
+        return respuesta_error('NOT_FOUND', 'Subida no encontrada', 404)
+    return respuesta_exitosa(estado)
+
+
+@bp.route('/uploads/<subida_id>/finalize', methods=['POST'])
+def finalizar_subida(subida_id):
+    """
+    Completa la subida y registra el archivo.
+
+    Espera JSON (opcional):
+    - hash: Hash del contenido calculado por el cliente, para verificarlo
+
+    Retorna:
+    - Informacion del archivo (como /upload), con ya_existia
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        resultado = file_manager.finalizar_subida(subida_id, data.get('hash'))
+    except KeyError:
+        return respuesta_error('NOT_FOUND', 'Subida no encontrada', 404)
+    except file_manager.ErrorSubida as e:
+        return respuesta_error('INCOMPLETE_UPLOAD', str(e), 409)
+    except file_manager.ContenidoEnConflicto as e:
+        return respuesta_error('HASH_CONFLICT', str(e), 409)
+
+    if resultado['ya_existia']:
+        return respuesta_exitosa(resultado, 'Archivo ya existente en el servidor')
     return respuesta_exitosa(resultado, 'Archivo subido correctamente')
 
 
+@bp.route('/uploads/<subida_id>', methods=['DELETE'])
+def cancelar_subida(subida_id):
+    """Descarta una subida sin finalizar."""
+    if not file_manager.cancelar_subida(subida_id):
+        return respuesta_error('NOT_FOUND', 'Subida no encontrada', 404)
+    return respuesta_exitosa(mensaje='Subida cancelada')
+
+
 @bp.route('/files', methods=['GET'])
 def listar_archivos():
     """
     Lista todos los archivos disponibles (dentro del periodo de retencion).
 
+    Query params:
+    - limite: Maximo de archivos por pagina (sin limite = todos)
+    - cursor: Header X-Siguiente-Cursor de la pagina anterior
+    - campos: Campos a incluir separados por coma (ej: id,nombre_original)
+
     Retorna:
-    - Lista de archivos con su informacion
+    - Lista de archivos con su informacion (mas recientes primero)
     """
-    archivos = models.listar_archivos()
+    try:
+        limite, cursor, campos = parametros_listado(CAMPOS_ARCHIVO)
+        archivos = models.listar_archivos(
+            limite=limite, cursor_paginacion=cursor, campos=campos or list(CAMPOS_ARCHIVO)
+        )
+    except ValueError as e:
+        return respuesta_error('INVALID_PARAMS', str(e))
 
     # Formatear respuesta
-    lista = [{
+    lista = [proyectar({
         'id': a['id'],
-        'nombre_original': a['nombre_original'],
-        'tamano_bytes': a['tamano_bytes'],
-        'num_paginas': a['num_paginas'],
+        'nombre_original': a.get('nombre_original'),
+        'tamano_bytes': a.get('tamano_bytes'),
+        'num_paginas': a.get('num_paginas'),
         'fecha_subida': a['fecha_subida']
-    } for a in archivos]
+    }, campos) for a in archivos]
 
-    return respuesta_exitosa(lista, f'{len(lista)} archivos disponibles')
+    return respuesta_paginada(lista, f'{len(lista)} archivos disponibles',
+                              models.siguiente_cursor(archivos, 'fecha_subida', limite))
 
 
 @bp.route('/files/<archivo_id>', methods=['GET'])
@@ -167,7 +286,7 @@ def eliminar_todos_archivos():
     Retorna:
     - Cantidad de archivos eliminados
     """
-    archivos = models.listar_archivos()
+    archivos = models.listar_archivos(campos=['id'])
     eliminados = 0
 
     for archivo in archivos:
@@ -180,43 +299,146 @@ def eliminar_todos_archivos():
     )
 
 
+def _dpi_miniatura():
+    """DPI pedido en ?dpi= (default THUMBNAIL_DPI), acotado al rango admitido."""
+    dpi = request.args.get('dpi', type=int) or config.THUMBNAIL_DPI
+    return min(max(dpi, thumbnail.DPI_MINIMO), thumbnail.DPI_MAXIMO)
+
+
+def _archivo_para_miniaturas(archivo_id):
+    """Devuelve (archivo, None) o (None, respuesta de error)."""
+    archivo = models.obtener_archivo(archivo_id)
+
+    if not archivo:
+        return None, respuesta_error('NOT_FOUND', 'Archivo no encontrado', 404)
+
+    if not Path(archivo['ruta_archivo']).exists():
+        return None, respuesta_error('FILE_MISSING', 'Archivo fisico no encontrado', 404)
+
+    return archivo, None
+
+
+def _paginas_lote(texto: str, num_paginas: int) -> list:
+    """Parsea "0-19,25" (0-indexed) a paginas validas, ordenadas y sin repetir."""
+    paginas = set()
+    for parte in texto.replace(' ', '').split(','):
+        if not parte:
+            continue
+        inicio, _, fin = parte.partition('-')
+        inicio = int(inicio)
+        fin = int(fin) if fin else inicio
+        paginas.update(range(max(inicio, 0), min(fin, num_paginas - 1) + 1))
+    return sorted(paginas)
+
+
+def _respuesta_cacheable(respuesta, etag: str):
+    """Marca una miniatura como cacheable: su contenido no cambia para un mismo ETag."""
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = f'private, max-age={config.FILE_RETENTION_HOURS * 3600}'
+    return respuesta
+
+
 @bp.route('/files/<archivo_id>/thumbnail/<int:pagina>', methods=['GET'])
 def obtener_miniatura(archivo_id, pagina):
     """
-    Genera y retorna una miniatura de una pagina del PDF.
+    Retorna la miniatura de una pagina del PDF (desde la cache si ya se genero).
 
     Args:
     - archivo_id: ID del archivo
     - pagina: Numero de pagina (0-indexed)
 
+    Query params:
+    - dpi: Resolucion (default THUMBNAIL_DPI)
+
     Retorna:
-    - Imagen PNG de la miniatura
+    - Imagen PNG de la miniatura (con ETag; If-None-Match responde 304)
     """
-    archivo = models.obtener_archivo(archivo_id)
-
-    if not archivo:
-        return respuesta_error('NOT_FOUND', 'Archivo no encontrado', 404)
-
-    ruta = Path(archivo['ruta_archivo'])
-
-    if not ruta.exists():
-        return respuesta_error('FILE_MISSING', 'Archivo fisico no encontrado', 404)
+    archivo, error = _archivo_para_miniaturas(archivo_id)
+    if error:
+        return error
 
     # Validar numero de pagina
     if pagina < 0 or pagina >= archivo['num_paginas']:
         return respuesta_error('INVALID_PAGE', f'Pagina invalida. El documento tiene {archivo["num_paginas"]} paginas')
 
-    # Generar miniatura
-    png_bytes = file_manager.generar_miniatura(ruta, pagina)
+    dpi = _dpi_miniatura()
+    etag = thumbnail.etag_miniatura(archivo, pagina, dpi)
+    if request.if_none_match.contains(etag):
+        return _respuesta_cacheable(Response(status=304), etag)
 
-    if not png_bytes:
+    try:
+        png_bytes = thumbnail.obtener_miniatura(archivo, pagina, dpi)
+    except Exception as e:
+        logger.error(f"Error generando miniatura (pagina={pagina}, archivo={archivo_id}): {e}")
         return respuesta_error('THUMBNAIL_ERROR', 'Error al generar miniatura', 500)
 
-    return send_file(
-        BytesIO(png_bytes),
-        mimetype='image/png',
-        download_name=f'thumbnail_p{pagina}.png'
-    )
+    return _respuesta_cacheable(Response(png_bytes, mimetype='image/png'), etag)
+
+
+@bp.route('/files/<archivo_id>/thumbnails', methods=['GET'])
+def obtener_miniaturas_lote(archivo_id):
+    """
+    Retorna las miniaturas de varias paginas en una sola respuesta.
+
+    Query params:
+    - paginas: Paginas 0-indexed, ej: "0-19" o "0,2,5-9" (default: las primeras 20)
+    - formato: "sprite" (una imagen PNG en grilla, default) o "multipart"
+    - dpi: Resolucion (default THUMBNAIL_DPI)
+
+    Retorna:
+    - sprite: image/png; la cabecera X-Sprite-Layout trae en JSON
+      [[pagina, x, y, ancho, alto], ...] con la posicion de cada miniatura
+    - multipart: multipart/mixed con una parte image/png por pagina
+      (cabecera X-Pagina)
+    """
+    archivo, error = _archivo_para_miniaturas(archivo_id)
+    if error:
+        return error
+
+    formato = request.args.get('formato', 'sprite')
+    if formato not in ('sprite', 'multipart'):
+        return respuesta_error('INVALID_FORMAT', 'formato debe ser "sprite" o "multipart"')
+
+    try:
+        paginas = _paginas_lote(request.args.get('paginas', '0-19'), archivo['num_paginas'])
+    except ValueError:
+        return respuesta_error('INVALID_PAGE', 'Seleccion de paginas invalida')
+    if not paginas:
+        return respuesta_error('INVALID_PAGE', f'Ninguna pagina valida. El documento tiene {archivo["num_paginas"]} paginas')
+    if len(paginas) > thumbnail.MAX_POR_LOTE:
+        return respuesta_error('TOO_MANY_PAGES', f'Maximo {thumbnail.MAX_POR_LOTE} miniaturas por pedido')
+
+    dpi = _dpi_miniatura()
+    etag = '_'.join([thumbnail.etag_miniatura(archivo, paginas[0], dpi), formato,
+                     hashlib.md5(','.join(map(str, paginas)).encode()).hexdigest()[:12]])
+    if request.if_none_match.contains(etag):
+        return _respuesta_cacheable(Response(status=304), etag)
+
+    try:
+        if formato == 'sprite':
+            png_bytes, posiciones = thumbnail.obtener_sprite(archivo, paginas, dpi)
+        else:
+            miniaturas = thumbnail.obtener_miniaturas(archivo, paginas, dpi)
+    except Exception as e:
+        logger.error(f"Error generando miniaturas (archivo={archivo_id}): {e}")
+        return respuesta_error('THUMBNAIL_ERROR', 'Error al generar miniaturas', 500)
+
+    if formato == 'sprite':
+        respuesta = Response(png_bytes, mimetype='image/png')
+        respuesta.headers['X-Sprite-Layout'] = json.dumps(posiciones, separators=(',', ':'))
+        respuesta.headers['Access-Control-Expose-Headers'] = 'X-Sprite-Layout'
+        return _respuesta_cacheable(respuesta, etag)
+
+    separador = uuid.uuid4().hex
+    cuerpo = BytesIO()
+    for pagina in paginas:
+        cuerpo.write(f'--{separador}\r\nContent-Type: image/png\r\n'
+                     f'X-Pagina: {pagina}\r\nContent-Length: {len(miniaturas[pagina])}\r\n\r\n'.encode())
+        cuerpo.write(miniaturas[pagina])
+        cuerpo.write(b'\r\n')
+    cuerpo.write(f'--{separador}--\r\n'.encode())
+    respuesta = Response(cuerpo.getvalue(), mimetype=f'multipart/mixed; boundary={separador}')
+    return _respuesta_cacheable(respuesta, etag)
 
 
 @bp.route('/check-duplicate', methods=['POST'])
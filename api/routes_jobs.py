@@ -9,16 +9,34 @@ import logging
 from pathlib import Path
 import json
 import time
+import unicodedata
+from urllib.parse import quote
 
 import config
 import models
-from utils import job_manager
+from utils import job_manager, file_manager, eventos
 
 logger = logging.getLogger(__name__)
 
 # Blueprint para rutas de trabajos
 bp = Blueprint('jobs', __name__, url_prefix='/api/v1')
 
+# Segundos sin eventos tras los cuales el stream de progreso envia un
+# keepalive y relee el trabajo de la BD
+INTERVALO_KEEPALIVE_SEG = 10
+
+# Stream multiplexado: como maximo un mensaje por intervalo (los cambios
+# intermedios se agrupan) y limite de trabajos por conexion
+INTERVALO_AGRUPACION_SEG = 0.25
+MAX_TRABAJOS_POR_STREAM = 500
+
+# Con cliente=actual, cada cuanto se buscan en la BD los trabajos que el
+# cliente encolo despues de abrir el stream (haya o no eventos)
+INTERVALO_RELECTURA_CLIENTE_SEG = 2
+
+# Maximo de filas por pagina en los listados paginados
+MAX_LIMITE_LISTADO = 1000
+
 
 def respuesta_exitosa(data=None, mensaje="Operacion completada"):
     """Genera respuesta JSON exitosa estandarizada."""
@@ -40,6 +58,50 @@ def respuesta_error(codigo: str, mensaje: str, status_code: int = 400):
     }), status_code
 
 
+def parametros_listado(campos_validos: tuple) -> tuple:
+    """
+    Lee limite, cursor y campos de la query string de un listado.
+
+    Returns:
+        (limite, cursor, campos); campos None = todos
+    Raises:
+        ValueError si limite o campos no son validos
+    """
+    limite = request.args.get('limite', type=int)
+    if limite is not None and not 1 <= limite <= MAX_LIMITE_LISTADO:
+        raise ValueError(f'limite debe estar entre 1 y {MAX_LIMITE_LISTADO}')
+
+    campos = None
+    if request.args.get('campos'):
+        campos = [c.strip() for c in request.args['campos'].split(',') if c.strip()]
+        invalidos = [c for c in campos if c not in campos_validos]
+        if invalidos:
+            raise ValueError(f"Campos no validos: {', '.join(invalidos)}")
+
+    return limite, request.args.get('cursor'), campos
+
+
+def respuesta_paginada(lista: list, mensaje: str, cursor: str):
+    """Respuesta de listado con el cursor de la pagina siguiente en X-Siguiente-Cursor."""
+    respuesta = respuesta_exitosa(lista, mensaje)
+    if cursor:
+        respuesta.headers['X-Siguiente-Cursor'] = cursor
+    return respuesta
+
+
+def proyectar(fila: dict, campos: list) -> dict:
+    """Deja solo los campos pedidos (None = todos)."""
+    return fila if campos is None else {c: fila[c] for c in campos}
+
+
+# Campos de salida de /jobs
+CAMPOS_TRABAJO = ('id', 'archivo_id', 'nombre_archivo', 'tipo_conversion', 'estado',
+                  'progreso', 'mensaje', 'fecha_creacion', 'fecha_fin')
+
+# Campos de salida de /downloads
+CAMPOS_DESCARGA = ('id', 'nombre_archivo', 'tipo_conversion', 'fecha_fin', 'tamano_resultado')
+
+
 @bp.route('/jobs', methods=['GET'])
 def listar_trabajos():
     """
@@ -47,31 +109,38 @@ def listar_trabajos():
 
     Query params:
     - estado: Filtrar por estado (pendiente, procesando, completado, error, cancelado)
+    - limite: Maximo de trabajos por pagina (sin limite = todos)
+    - cursor: Header X-Siguiente-Cursor de la pagina anterior
+    - campos: Campos a incluir separados por coma (ej: id,estado,progreso)
 
     Retorna:
-    - Lista de trabajos con su informacion
+    - Lista de trabajos con su informacion (mas recientes primero)
     """
     estado = request.args.get('estado')
-
-    if estado:
-        trabajos = models.listar_trabajos(estado=estado)
-    else:
-        trabajos = models.listar_trabajos()
+    try:
+        limite, cursor, campos = parametros_listado(CAMPOS_TRABAJO)
+        trabajos = models.listar_trabajos(
+            estado=estado, limite=limite, cursor_paginacion=cursor,
+            campos=campos or list(CAMPOS_TRABAJO)
+        )
+    except ValueError as e:
+        return respuesta_error('INVALID_PARAMS', str(e))
 
     # Formatear respuesta
-    lista = [{
+    lista = [proyectar({
         'id': t['id'],
-        'archivo_id': t['archivo_id'],
-        'nombre_archivo': t['nombre_archivo'],
-        'tipo_conversion': t['tipo_conversion'],
-        'estado': t['estado'],
-        'progreso': t['progreso'],
-        'mensaje': t['mensaje'],
+        'archivo_id': t.get('archivo_id'),
+        'nombre_archivo': t.get('nombre_archivo'),
+        'tipo_conversion': t.get('tipo_conversion'),
+        'estado': t.get('estado'),
+        'progreso': t.get('progreso'),
+        'mensaje': t.get('mensaje'),
         'fecha_creacion': t['fecha_creacion'],
-        'fecha_fin': t['fecha_fin']
-    } for t in trabajos]
+        'fecha_fin': t.get('fecha_fin')
+    }, campos) for t in trabajos]
 
-    return respuesta_exitosa(lista, f'{len(lista)} trabajos encontrados')
+    return respuesta_paginada(lista, f'{len(lista)} trabajos encontrados',
+                              models.siguiente_cursor(trabajos, 'fecha_creacion', limite))
 
 
 @bp.route('/jobs/<trabajo_id>', methods=['GET'])
@@ -102,51 +171,209 @@ def obtener_trabajo(trabajo_id):
     })
 
 
+@bp.route('/jobs/progress', methods=['GET'])
+def obtener_progreso_multiple_sse():
+    """
+    Stream SSE con el progreso de varios trabajos en una sola conexion.
+
+    Query params:
+    - ids: IDs de trabajo separados por coma
+    - cliente: 'actual' para seguir todos los trabajos activos del cliente
+      que hace la peticion (incluidos los que encole despues)
+
+    Cada mensaje trae solo los trabajos que cambiaron, agrupados:
+    data: {"trabajos": {"<id>": {"estado", "progreso", "mensaje"}, ...}}
+    Con ids, el stream termina cuando todos llegan a un estado final.
+    """
+    ids = {i.strip() for i in request.args.get('ids', '').split(',') if i.strip()}
+    cliente = job_manager.cliente_actual() if request.args.get('cliente') == 'actual' else None
+
+    if not ids and not cliente:
+        return respuesta_error('INVALID_PARAMS', 'Indicar ids o cliente=actual')
+    if len(ids) > MAX_TRABAJOS_POR_STREAM:
+        return respuesta_error(
+            'TOO_MANY_JOBS',
+            f'Maximo {MAX_TRABAJOS_POR_STREAM} trabajos por conexion'
+        )
+
+    def generar_eventos():
+        observados = set(ids)
+        lideres = {}
+        ultimos = {}
+        # Modo cliente: trabajos que ya enviaron su evento final
+        terminados = set()
+        suscripcion = None
+
+        def releer():
+            """Lee los trabajos de la BD y rehace la suscripcion si cambio el conjunto."""
+            nonlocal suscripcion
+            if cliente:
+                observados.update(models.listar_ids_trabajos_activos(cliente))
+            filas = models.obtener_trabajos_por_ids(list(observados))
+            encontrados = {f['id'] for f in filas}
+            for trabajo_id in observados - encontrados:
+                ultimos.pop(trabajo_id, None)
+            observados.intersection_update(encontrados)
+
+            nuevos_lideres = {f['id']: f['lider_id'] for f in filas if f['lider_id']}
+            canales = observados | set(nuevos_lideres.values())
+            if suscripcion is None or canales != suscripcion.trabajo_ids:
+                anterior = suscripcion
+                suscripcion = eventos.suscribir(canales)
+                if anterior:
+                    eventos.desuscribir(anterior)
+            lideres.clear()
+            lideres.update(nuevos_lideres)
+            return {f['id']: {'estado': f['estado'], 'progreso': f['progreso'],
+                              'mensaje': f['mensaje']} for f in filas}
+
+        try:
+            cambios = releer()
+            if not observados and not cliente:
+                yield f"data: {json.dumps({'error': 'Trabajos no encontrados'})}\n\n"
+                return
+            proxima_relectura = time.monotonic() + INTERVALO_RELECTURA_CLIENTE_SEG
+            ultimo_envio = time.monotonic()
+            while True:
+                cambios = {i: e for i, e in cambios.items()
+                           if i not in terminados and ultimos.get(i) != e}
+                if cambios:
+                    ultimos.update(cambios)
+                    yield f"data: {json.dumps({'trabajos': cambios})}\n\n"
+                    ultimo_envio = time.monotonic()
+                elif time.monotonic() - ultimo_envio >= INTERVALO_KEEPALIVE_SEG:
+                    yield ": keepalive\n\n"
+                    ultimo_envio = time.monotonic()
+
+                if cliente:
+                    # Los terminados ya enviaron su evento final: dejar de seguirlos
+                    for trabajo_id in [i for i, e in ultimos.items()
+                                       if e['estado'] in eventos.ESTADOS_FINALES]:
+                        observados.discard(trabajo_id)
+                        ultimos.pop(trabajo_id)
+                        lideres.pop(trabajo_id, None)
+                        terminados.add(trabajo_id)
+                elif all(e['estado'] in eventos.ESTADOS_FINALES for e in ultimos.values()):
+                    break
+
+                if cambios:
+                    # Agrupar los cambios que lleguen mientras tanto
+                    time.sleep(INTERVALO_AGRUPACION_SEG)
+
+                if cliente and time.monotonic() >= proxima_relectura:
+                    # Trabajos nuevos del cliente, aunque los observados no paren de publicar
+                    proxima_relectura = time.monotonic() + INTERVALO_RELECTURA_CLIENTE_SEG
+                    cambios = releer()
+                    continue
+
+                espera = INTERVALO_KEEPALIVE_SEG
+                if cliente:
+                    espera = max(0.0, min(espera, proxima_relectura - time.monotonic()))
+                recibidos = suscripcion.recibir(timeout=espera)
+                if not recibidos:
+                    # Sin eventos: la BD tiene el estado (relectura o keepalive arriba)
+                    cambios = {} if cliente else releer()
+                    continue
+
+                cambios = {}
+                hay_que_releer = False
+                for trabajo_id, evento in recibidos.items():
+                    if trabajo_id in observados:
+                        cambios[trabajo_id] = evento
+                    for seguidor, lider_id in lideres.items():
+                        if lider_id != trabajo_id:
+                            continue
+                        if evento['estado'] == 'cancelado':
+                            # El seguidor pudo pasar a ejecutarse por su cuenta
+                            hay_que_releer = True
+                        else:
+                            cambios[seguidor] = evento
+                if hay_que_releer:
+                    cambios.update(releer())
+        finally:
+            if suscripcion:
+                eventos.desuscribir(suscripcion)
+
+    return Response(
+        generar_eventos(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @bp.route('/jobs/<trabajo_id>/progress', methods=['GET'])
 def obtener_progreso_sse(trabajo_id):
     """
     Endpoint de Server-Sent Events para progreso en tiempo real.
     El cliente se conecta y recibe actualizaciones de progreso.
 
+    Los cambios llegan por el pub/sub en memoria (utils.eventos) apenas
+    job_manager los registra; el stream solo vuelve a la BD si pasan
+    INTERVALO_KEEPALIVE_SEG sin novedades.
+
     Retorna:
     - Stream de eventos SSE con progreso del trabajo
     """
     def generar_eventos():
-        ultimo_progreso = -1
-        ultimo_estado = None
-        ciclos_sin_cambio = 0
-
-        while True:
-            trabajo = models.obtener_trabajo(trabajo_id)
-
-            if not trabajo:
-                yield f"data: {json.dumps({'error': 'Trabajo no encontrado'})}\n\n"
-                break
-
-            # Solo enviar si hay cambios
-            if trabajo['progreso'] != ultimo_progreso or trabajo['estado'] != ultimo_estado:
-                ultimo_progreso = trabajo['progreso']
-                ultimo_estado = trabajo['estado']
-                ciclos_sin_cambio = 0
-
-                evento = {
-                    'estado': trabajo['estado'],
-                    'progreso': trabajo['progreso'],
-                    'mensaje': trabajo['mensaje']
-                }
-
-                yield f"data: {json.dumps(evento)}\n\n"
-            else:
-                ciclos_sin_cambio += 1
-                # Keepalive cada 10s sin cambios para mantener conexión viva
-                if ciclos_sin_cambio % 10 == 0:
+        trabajo = models.obtener_trabajo(trabajo_id)
+        if not trabajo:
+            yield f"data: {json.dumps({'error': 'Trabajo no encontrado'})}\n\n"
+            return
+
+        # Suscribirse antes de leer el estado inicial para no perder cambios
+        lider_id = trabajo['lider_id']
+        suscripcion = eventos.suscribir([trabajo_id] + ([lider_id] if lider_id else []))
+        try:
+            trabajo = models.obtener_trabajo(trabajo_id) or trabajo
+            evento = {
+                'estado': trabajo['estado'],
+                'progreso': trabajo['progreso'],
+                'mensaje': trabajo['mensaje']
+            }
+            yield f"data: {json.dumps(evento)}\n\n"
+            ultimo = evento
+
+            while evento['estado'] not in eventos.ESTADOS_FINALES:
+                recibidos = suscripcion.recibir(timeout=INTERVALO_KEEPALIVE_SEG)
+
+                if trabajo_id in recibidos:
+                    evento = recibidos[trabajo_id]
+                elif lider_id in recibidos and \
+                        recibidos[lider_id]['estado'] != 'cancelado':
+                    # Trabajo acoplado: refleja al que se esta ejecutando
+                    evento = recibidos[lider_id]
+                else:
+                    # Sin novedades (o el lider fue cancelado y este trabajo
+                    # pudo pasar a ejecutarse por su cuenta): releer la BD.
+                    # Tambien cubre cambios hechos por workers de otro proceso.
+                    trabajo = models.obtener_trabajo(trabajo_id)
+                    if not trabajo:
+                        yield f"data: {json.dumps({'error': 'Trabajo no encontrado'})}\n\n"
+                        return
+                    if trabajo['lider_id'] != lider_id:
+                        eventos.desuscribir(suscripcion)
+                        lider_id = trabajo['lider_id']
+                        suscripcion = eventos.suscribir(
+                            [trabajo_id] + ([lider_id] if lider_id else []))
+                    evento = {
+                        'estado': trabajo['estado'],
+                        'progreso': trabajo['progreso'],
+                        'mensaje': trabajo['mensaje']
+                    }
+
+                # Solo enviar si hay cambios
+                if evento != ultimo:
+                    ultimo = evento
+                    yield f"data: {json.dumps(evento)}\n\n"
+                elif not recibidos:
+                    # Keepalive sin cambios para mantener la conexion viva
                     yield ": keepalive\n\n"
-
-            # Si el trabajo termino, cerrar conexion
-            if trabajo['estado'] in ('completado', 'error', 'cancelado'):
-                break
-
-            time.sleep(config.JOB_CHECK_INTERVAL)
+        finally:
+            eventos.desuscribir(suscripcion)
 
     return Response(
         generar_eventos(),
@@ -173,23 +400,18 @@ def eliminar_trabajo(trabajo_id):
     if not trabajo:
         return respuesta_error('NOT_FOUND', 'Trabajo no encontrado', 404)
 
-    # Si tiene archivo de resultado, eliminarlo
+    # Si tiene archivo de resultado, eliminarlo (salvo que otro trabajo lo
+    # comparta via la cache de resultados)
     if trabajo['ruta_resultado']:
-        ruta = Path(trabajo['ruta_resultado'])
-        if ruta.exists():
-            try:
-                ruta.unlink()
-                logger.info(f"Archivo de resultado eliminado: {ruta}")
-            except Exception as e:
-                logger.error(f"Error eliminando archivo de resultado: {e}")
+        file_manager.eliminar_resultado(trabajo['ruta_resultado'], trabajo_id)
 
     # Si esta pendiente o procesando, cancelar
     if trabajo['estado'] in ('pendiente', 'procesando'):
         models.cancelar_trabajo(trabajo_id)
+        job_manager.notificar_cambio(trabajo_id)
         return respuesta_exitosa(mensaje='Trabajo cancelado')
 
     # Si ya termino (completado, error, cancelado), eliminar registro
-    from utils import file_manager
     with models.obtener_conexion() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM trabajos WHERE id = ?', (trabajo_id,))
@@ -235,6 +457,7 @@ def descargar_resultado(trabajo_id):
         '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
         '.png': 'image/png',
         '.jpg': 'image/jpeg',
+        '.tif': 'image/tiff',
     }
     mimetype = mimetypes_map.get(extension_real, 'application/octet-stream')
 
@@ -242,12 +465,70 @@ def descargar_resultado(trabajo_id):
     nombre_base = trabajo['nombre_archivo'] or 'resultado'
     nombre_descarga = f"{trabajo['tipo_conversion']}_{nombre_base}{extension_real}"
 
-    return send_file(
+    # ETag (trabajo, tamano y fecha del resultado): permite revalidar (304) y
+    # reanudar con Range + If-Range sin riesgo de mezclar bytes de otro resultado
+    etag = trabajo.get('hash_resultado')
+    if not etag:
+        etag = job_manager.etag_resultado(trabajo['id'], str(ruta))
+        models.registrar_hash_resultado(str(ruta), etag)
+
+    if config.DOWNLOAD_OFFLOAD:
+        respuesta = _descarga_delegada(ruta, mimetype, nombre_descarga, etag)
+        if respuesta is not None:
+            return respuesta
+
+    respuesta = send_file(
         str(ruta),
         mimetype=mimetype,
         as_attachment=True,
-        download_name=nombre_descarga
+        download_name=nombre_descarga,
+        etag=etag,
+        conditional=True
     )
+    respuesta.headers['Accept-Ranges'] = 'bytes'
+    return respuesta
+
+
+def _descarga_delegada(ruta: Path, mimetype: str, nombre_descarga: str, etag: str):
+    """
+    Respuesta vacia con X-Accel-Redirect / X-Sendfile para que el proxy
+    envie el archivo (sin copias en Python; Range lo resuelve el proxy).
+    Retorna None si el archivo no esta en OUTPUT_FOLDER (o, con X-Sendfile,
+    si su ruta no se puede enviar en una cabecera HTTP).
+    """
+    try:
+        relativa = ruta.resolve().relative_to(config.OUTPUT_FOLDER.resolve())
+    except ValueError:
+        return None
+    if config.DOWNLOAD_OFFLOAD == 'x-sendfile':
+        try:
+            str(ruta.resolve()).encode('latin-1')
+        except UnicodeEncodeError:
+            return None
+
+    if request.if_none_match.contains(etag):
+        respuesta = Response(status=304)
+        respuesta.set_etag(etag)
+        return respuesta
+
+    respuesta = Response(mimetype=mimetype)
+    if config.DOWNLOAD_OFFLOAD == 'x-accel':
+        respuesta.headers['X-Accel-Redirect'] = \
+            config.DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(relativa.as_posix())
+    else:
+        respuesta.headers['X-Sendfile'] = str(ruta.resolve())
+
+    # Mismo Content-Disposition que send_file (nombre ASCII + filename* UTF-8)
+    try:
+        nombre_descarga.encode('ascii')
+        nombres = {'filename': nombre_descarga}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', nombre_descarga).encode('ascii', 'ignore').decode('ascii')
+        nombres = {'filename': simple,
+                   'filename*': f"UTF-8''{quote(nombre_descarga, safe='!#$&+^`|~')}"}
+    respuesta.headers.set('Content-Disposition', 'attachment', **nombres)
+    respuesta.set_etag(etag)
+    return respuesta
 
 
 @bp.route('/downloads', methods=['GET'])
@@ -255,26 +536,39 @@ def listar_descargas():
     """
     Lista trabajos completados con descarga disponible.
 
+    Query params:
+    - limite, cursor, campos: como en GET /jobs
+
     Retorna:
     - Lista de trabajos con resultado descargable
     """
-    trabajos = models.listar_trabajos(estado='completado')
+    try:
+        limite, cursor, campos = parametros_listado(CAMPOS_DESCARGA)
+        trabajos = models.listar_trabajos(
+            estado='completado', limite=limite, cursor_paginacion=cursor,
+            campos=['nombre_archivo', 'tipo_conversion', 'fecha_fin', 'ruta_resultado'],
+            solo_con_resultado=True
+        )
+    except ValueError as e:
+        return respuesta_error('INVALID_PARAMS', str(e))
 
-    # Filtrar solo los que tienen resultado
+    # Filtrar solo los que tienen resultado en disco
     disponibles = []
     for t in trabajos:
-        if t['ruta_resultado']:
-            ruta = Path(t['ruta_resultado'])
-            if ruta.exists():
-                disponibles.append({
-                    'id': t['id'],
-                    'nombre_archivo': t['nombre_archivo'],
-                    'tipo_conversion': t['tipo_conversion'],
-                    'fecha_fin': t['fecha_fin'],
-                    'tamano_resultado': ruta.stat().st_size
-                })
-
-    return respuesta_exitosa(disponibles, f'{len(disponibles)} descargas disponibles')
+        try:
+            tamano = Path(t['ruta_resultado']).stat().st_size
+        except OSError:
+            continue
+        disponibles.append(proyectar({
+            'id': t['id'],
+            'nombre_archivo': t['nombre_archivo'],
+            'tipo_conversion': t['tipo_conversion'],
+            'fecha_fin': t['fecha_fin'],
+            'tamano_resultado': tamano
+        }, campos))
+
+    return respuesta_paginada(disponibles, f'{len(disponibles)} descargas disponibles',
+                              models.siguiente_cursor(trabajos, 'fecha_creacion', limite))
 
 
 @bp.route('/status', methods=['GET'])
@@ -282,14 +576,16 @@ def estado_servicio():
     """
     Retorna el estado general del servicio.
 
+    Sirve la instantanea en memoria que refresca el scheduler cada
+    STATUS_REFRESH_SEG: no consulta SQLite en cada peticion.
+
     Retorna:
     - Estadisticas de archivos, trabajos y cola
     """
     estado_cola = job_manager.obtener_estado_cola()
-    archivos = models.listar_archivos()
 
     return respuesta_exitosa({
-        'archivos_disponibles': len(archivos),
+        'archivos_disponibles': job_manager.obtener_instantanea_estado()['archivos_disponibles'],
         'cola': estado_cola,
         'retencion_horas': config.FILE_RETENTION_HOURS,
         'tamano_maximo_mb': config.MAX_CONTENT_LENGTH / (1024 * 1024)
@@ -10,6 +10,7 @@ from threading import Thread
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 import config
 import models
@@ -38,11 +39,22 @@ logger.info(f"  MAX_FILE_SIZE      = {config.MAX_CONTENT_LENGTH // (1024*1024)}
 logger.info(f"  UPLOAD_FOLDER      = {config.UPLOAD_FOLDER}")
 logger.info(f"  OUTPUT_FOLDER      = {config.OUTPUT_FOLDER}")
 logger.info(f"  DATABASE_PATH      = {config.DATABASE_PATH}")
+logger.info(f"  JOB_WORKERS        = {config.JOB_WORKERS}")
+logger.info(f"  JOB_PROCESS_BACKEND = {config.JOB_PROCESS_BACKEND}")
+logger.info(f"  JOB_TIMEOUT_SEG    = {config.JOB_TIMEOUT_SEG} s")
+logger.info(f"  JOB_MAX_RSS_MB     = {config.JOB_MAX_RSS_MB} MB")
+logger.info(f"  RESULT_CACHE_MAX_MB = {config.RESULT_CACHE_MAX_MB} MB")
+logger.info(f"  PROGRESS_CROSS_PROCESS = {config.PROGRESS_CROSS_PROCESS}")
+logger.info(f"  DOWNLOAD_OFFLOAD   = {config.DOWNLOAD_OFFLOAD or '(Flask)'}")
+logger.info(f"  THUMBNAIL_CACHE_MAX_MB = {config.THUMBNAIL_CACHE_MAX_MB} MB")
 logger.info(f"  NLM_INGESTOR_URL   = {config.NLM_INGESTOR_URL or '(deshabilitado)'}")
 logger.info(f"  TIKA_URL           = {config.TIKA_URL or '(deshabilitado)'}")
 # Variables de entorno relevantes (sin exponer secretos)
 _env_vars = ['APP_VERSION', 'HOST', 'PORT', 'DEBUG', 'FILE_RETENTION_HOURS',
-             'MAX_FILE_SIZE', 'NLM_INGESTOR_URL', 'TIKA_URL']
+             'MAX_FILE_SIZE', 'NLM_INGESTOR_URL', 'TIKA_URL', 'JOB_WORKERS',
+             'JOB_PROCESS_BACKEND', 'JOB_TIMEOUT_SEG', 'JOB_MAX_RSS_MB',
+             'RESULT_CACHE_MAX_MB', 'PROGRESS_CROSS_PROCESS', 'DOWNLOAD_OFFLOAD',
+             'THUMBNAIL_CACHE_MAX_MB']
 logger.info("  Variables de entorno activas:")
 for _k in _env_vars:
     _v = _os.environ.get(_k)
@@ -67,6 +79,10 @@ def crear_app():
     app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
     app.config['UPLOAD_FOLDER'] = str(config.UPLOAD_FOLDER)
 
+    # Detras de un proxy de confianza, remote_addr pasa a ser la IP del cliente
+    if config.PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_HOPS)
+
     # Habilitar CORS para todas las rutas
     CORS(app)
 
@@ -80,6 +96,14 @@ def crear_app():
     def index():
         return send_from_directory('.', 'index.html')
 
+    # Healthcheck liviano (Docker HEALTHCHECK): no consulta la base
+    @app.route('/healthz')
+    def healthz():
+        workers = job_manager.workers_activos()
+        if workers == 0:
+            return jsonify({'status': 'error', 'workers': 0}), 503
+        return jsonify({'status': 'ok', 'workers': workers})
+
     # Ruta para servir config.js con la version inyectada
     @app.route('/config.js')
     def config_js():
@@ -156,6 +180,15 @@ def iniciar_scheduler(app):
         name='Limpieza de archivos expirados'
     )
 
+    # Resumen de la cola que sirve /api/v1/status desde memoria
+    scheduler.add_job(
+        func=job_manager.actualizar_instantanea_estado,
+        trigger='interval',
+        seconds=config.STATUS_REFRESH_SEG,
+        id='instantanea_estado',
+        name='Resumen de estado de la cola'
+    )
+
     # Limpieza de notepads sin acceso en 30 días (cada 24h)
     scheduler.add_job(
         func=models.eliminar_notepads_expirados,
@@ -182,12 +215,12 @@ def main():
     # Crear aplicacion
     app = crear_app()
 
-    # Iniciar worker de trabajos
-    job_manager.iniciar_worker()
-
-    # Reencolar trabajos pendientes (por si hubo reinicio)
+    # Recuperar trabajos interrumpidos (por si hubo reinicio) antes de reclamar nuevos
     job_manager.reencolar_trabajos_pendientes()
 
+    # Iniciar pool de workers de trabajos
+    job_manager.iniciar_worker()
+
     # Iniciar scheduler de limpieza
     iniciar_scheduler(app)
 
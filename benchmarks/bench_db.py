@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark de la capa SQLite (models.py).
+
+Mide operaciones por segundo de obtener_trabajo y actualizar_trabajo con la
+conexion persistente por thread (WAL) y con el esquema anterior: una
+conexion nueva por llamada y journal en modo rollback.
+
+Uso:
+    python benchmarks/bench_db.py [--segundos 3] [--threads 1]
+"""
+
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+import models  # noqa: E402
+
+_obtener_conexion_actual = models.obtener_conexion
+
+
+@contextmanager
+def _conexion_por_llamada():
+    """obtener_conexion() original: connect + commit + close en cada llamada."""
+    conexion = sqlite3.connect(str(config.DATABASE_PATH))
+    conexion.row_factory = sqlite3.Row
+    try:
+        yield conexion
+        conexion.commit()
+    except Exception:
+        conexion.rollback()
+        raise
+    finally:
+        conexion.close()
+
+
+def _medir(funcion, segundos: float, threads: int) -> float:
+    """Ejecuta funcion en bucle desde N threads y retorna llamadas por segundo."""
+    contador = [0] * threads
+    fin = time.perf_counter() + segundos
+
+    def bucle(i):
+        n = 0
+        while time.perf_counter() < fin:
+            funcion(n)
+            n += 1
+        contador[i] = n
+
+    hilos = [threading.Thread(target=bucle, args=(i,)) for i in range(threads)]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return sum(contador) / (time.perf_counter() - inicio)
+
+
+def _preparar_base(directorio: Path, wal: bool) -> str:
+    config.DATABASE_PATH = directorio / ('wal.db' if wal else 'rollback.db')
+    models.inicializar_db()
+    if not wal:
+        with sqlite3.connect(str(config.DATABASE_PATH)) as conexion:
+            conexion.execute('PRAGMA journal_mode = DELETE')
+    archivo_id = models.crear_archivo('bench.pdf', 'bench.pdf', 1024, None, '/tmp/bench.pdf',
+                                      'hash', 10)
+    return models.crear_trabajo(archivo_id, 'to-txt')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--segundos', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        resultados = {}
+        for nombre, conexion, wal in (('antes (conexion por llamada, rollback)', _conexion_por_llamada, False),
+                                      ('despues (conexion por thread, WAL)', _obtener_conexion_actual, True)):
+            models.obtener_conexion = conexion
+            trabajo_id = _preparar_base(Path(tmp), wal)
+            lectura = _medir(lambda n: models.obtener_trabajo(trabajo_id), args.segundos, args.threads)
+            escritura = _medir(lambda n: models.actualizar_trabajo(trabajo_id, progreso=n % 100),
+                               args.segundos, args.threads)
+            resultados[nombre] = (lectura, escritura)
+
+        models.obtener_conexion = _obtener_conexion_actual
+        print(f"SQLite {sqlite3.sqlite_version}, {args.threads} thread(s), {args.segundos}s por prueba, "
+              f"synchronous={config.SQLITE_SYNCHRONOUS}")
+        print(f"{'':42} {'obtener_trabajo':>18} {'actualizar_trabajo':>20}")
+        for nombre, (lectura, escritura) in resultados.items():
+            print(f"{nombre:42} {lectura:>14,.0f} op/s {escritura:>16,.0f} op/s")
+
+
+if __name__ == '__main__':
+    main()
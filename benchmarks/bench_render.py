@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark del render de paginas de to-png / to-jpg / to-webp / to-avif (services/pdf_to_images.py).
+
+Genera un PDF sintetico (texto, tablas y graficos vectoriales por pagina) y
+mide convertir_pdf_a_imagenes en serie y con RENDER_PROCESSES procesos, a
+cada DPI pedido, escribiendo en un ZipSalida como el trabajo real.
+
+Uso:
+    python benchmarks/bench_render.py [--paginas 500] [--dpi 150 300 600]
+                                      [--procesos 4] [--formato png] [--lote 4] [--optimizar]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz  # noqa: E402
+
+import config  # noqa: E402
+from services import pdf_to_images  # noqa: E402
+from utils import job_manager  # noqa: E402
+from utils.zip_salida import ZipSalida  # noqa: E402
+
+
+def _crear_pdf(ruta: Path, paginas: int):
+    """PDF A4 con un parrafo, una tabla y figuras de color en cada pagina."""
+    doc = fitz.open()
+    for i in range(paginas):
+        pagina = doc.new_page(width=595, height=842)
+        pagina.insert_textbox(fitz.Rect(50, 50, 545, 300),
+                              f"Pagina {i + 1}. " + "Texto de relleno para el render. " * 40,
+                              fontsize=10)
+        for fila in range(12):
+            for col in range(5):
+                celda = fitz.Rect(50 + col * 99, 320 + fila * 20, 149 + col * 99, 340 + fila * 20)
+                pagina.draw_rect(celda, color=(0, 0, 0), width=0.5)
+                pagina.insert_text(celda.bl + (4, -6), f"{fila * col + i:06d}", fontsize=8)
+        for k in range(6):
+            pagina.draw_circle((100 + k * 75, 700), 30, color=(0, 0, 0),
+                               fill=((k * 40 % 255) / 255, 0.4, 1 - k / 6))
+    doc.save(str(ruta))
+    doc.close()
+
+
+def _convertir(ruta_pdf: Path, directorio: Path, dpi: int, formato: str, procesos: int,
+               optimizar: bool) -> tuple:
+    """(tamano del ZIP, ms de codificacion por pagina)"""
+    config.RENDER_PROCESSES = procesos
+    with ZipSalida(directorio / f'r_{dpi}_{procesos}.zip') as zs:
+        imagenes, ms_por_pagina = pdf_to_images.convertir_pdf_a_imagenes(
+            ruta_pdf, {'dpi': dpi, 'optimizar': optimizar}, 'bench', zs, formato, ruta_pdf.name)
+    tamano = zs.ruta.stat().st_size
+    zs.ruta.unlink()
+    assert len(imagenes) > 0
+    return tamano, ms_por_pagina
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--paginas', type=int, default=500)
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 300, 600])
+    parser.add_argument('--procesos', type=int, default=max(os.cpu_count() or 1, 2))
+    parser.add_argument('--formato', choices=('png', 'jpg', 'webp', 'avif'), default='png')
+    parser.add_argument('--lote', type=int, default=config.RENDER_CHUNK_PAGES)
+    parser.add_argument('--optimizar', action='store_true', help='JPG con optimize (mas chico, mas lento)')
+    args = parser.parse_args()
+    config.RENDER_CHUNK_PAGES = args.lote
+
+    # Sin trabajo real: el progreso no se registra
+    job_manager.actualizar_progreso = lambda *a, **k: None
+
+    print(f"{args.paginas} paginas, {args.formato.upper()}, lotes de {args.lote}, "
+          f"{os.cpu_count()} CPU")
+    print(f"{'':28} {'segundos':>9} {'pag/s':>8} {'ms cod.':>8} {'ZIP MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        directorio = Path(tmp)
+        ruta_pdf = directorio / 'bench.pdf'
+        _crear_pdf(ruta_pdf, args.paginas)
+        for dpi in args.dpi:
+            for procesos in (1, args.procesos):
+                inicio = time.perf_counter()
+                tamano, ms_por_pagina = _convertir(ruta_pdf, directorio, dpi, args.formato,
+                                                   procesos, args.optimizar)
+                segundos = time.perf_counter() - inicio
+                print(f"{f'{dpi} DPI, {procesos} proceso(s)':28} {segundos:>9.2f} "
+                      f"{args.paginas / segundos:>8.1f} {ms_por_pagina:>8.0f} "
+                      f"{tamano / (1024 * 1024):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
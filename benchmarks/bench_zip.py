@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark de los ZIP de resultados (utils/zip_salida.py).
+
+Genera una salida sintetica de muchos miembros (texto comprimible, como
+paginas de to-txt/to-csv o PDFs sin comprimir, e imagenes ya comprimidas)
+y compara el esquema anterior -partes escritas a disco y luego crear_zip
+con zipfile a nivel 9 en un thread- con ZipSalida en serie y con ZIP_THREADS
+threads.
+
+Uso:
+    python benchmarks/bench_zip.py [--miembros 500] [--kb 512] [--threads 4] [--nivel 1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+from utils import zip_salida  # noqa: E402
+
+PALABRAS = ('pagina', 'tabla', 'importe', 'total', 'fecha', 'cliente', 'factura',
+            'descripcion', 'cantidad', 'precio', '2026', '1.234,56', 'ok', 'ref')
+
+
+def _miembros(cantidad: int, kb: int) -> list:
+    """(nombre, datos): 3 de cada 4 texto comprimible, 1 de cada 4 PNG (aleatorio)."""
+    rnd = random.Random(42)
+    miembros = []
+    for i in range(cantidad):
+        if i % 4 == 3:
+            miembros.append((f"pagina {i:05d}.png", os.urandom(kb * 1024)))
+        else:
+            texto = ' '.join(rnd.choice(PALABRAS) for _ in range(kb * 1024 // 7))
+            miembros.append((f"pagina {i:05d}.txt", texto.encode()[:kb * 1024]))
+    return miembros
+
+
+def _antes(miembros: list, directorio: Path) -> Path:
+    """Partes a disco + zipfile nivel 9 en serie (crear_zip original)."""
+    rutas = []
+    for nombre, datos in miembros:
+        ruta = directorio / nombre
+        ruta.write_bytes(datos)
+        rutas.append((ruta, nombre))
+    ruta_zip = directorio / 'antes.zip'
+    with zipfile.ZipFile(str(ruta_zip), 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        for ruta, nombre in rutas:
+            zf.write(ruta, nombre)
+    for ruta, _ in rutas:
+        ruta.unlink()
+    return ruta_zip
+
+
+def _zip_salida(miembros: list, directorio: Path, threads: int) -> Path:
+    config.ZIP_THREADS = threads
+    zip_salida._pool = None
+    with zip_salida.ZipSalida(directorio / f'zs_{threads}.zip') as zs:
+        for nombre, datos in miembros:
+            zs.escribir(nombre, datos)
+    return zs.ruta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--miembros', type=int, default=500)
+    parser.add_argument('--kb', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=max(os.cpu_count() or 1, 2))
+    parser.add_argument('--nivel', type=int, default=config.ZIP_COMPRESSLEVEL)
+    args = parser.parse_args()
+    config.ZIP_COMPRESSLEVEL = args.nivel
+
+    miembros = _miembros(args.miembros, args.kb)
+    total_mb = sum(len(d) for _, d in miembros) / (1024 * 1024)
+
+    pruebas = [('antes (disco + zipfile nivel 9, 1 thread)', lambda d: _antes(miembros, d)),
+               (f'ZipSalida nivel {config.ZIP_COMPRESSLEVEL}, 1 thread',
+                lambda d: _zip_salida(miembros, d, 1)),
+               (f'ZipSalida nivel {config.ZIP_COMPRESSLEVEL}, {args.threads} threads',
+                lambda d: _zip_salida(miembros, d, args.threads))]
+
+    print(f"{args.miembros} miembros de {args.kb} KB ({total_mb:.0f} MB), "
+          f"{os.cpu_count()} CPU")
+    print(f"{'':46} {'segundos':>9} {'MB/s':>8} {'ZIP MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for nombre, funcion in pruebas:
+            inicio = time.perf_counter()
+            ruta_zip = funcion(Path(tmp))
+            segundos = time.perf_counter() - inicio
+            with zipfile.ZipFile(ruta_zip) as zf:
+                assert zf.testzip() is None
+            print(f"{nombre:46} {segundos:>9.2f} {total_mb / segundos:>8.0f} "
+                  f"{ruta_zip.stat().st_size / (1024 * 1024):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,9 @@ BASE_DIR = Path(__file__).parent.absolute()
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('PORT', 5000))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+# Proxies inversos de confianza delante de la app (Nginx = 1). Solo con un valor > 0
+# se usa X-Forwarded-For para obtener la IP real del cliente; 0 = conexion directa.
+PROXY_HOPS = max(0, int(os.getenv('PROXY_HOPS', 0)))
 
 # Configuracion de archivos
 UPLOAD_FOLDER = BASE_DIR / 'uploads'
@@ -30,6 +33,52 @@ DATA_FOLDER = BASE_DIR / 'data'
 # Tamanio maximo de archivo — configurable via variable de entorno MAX_FILE_SIZE (bytes)
 MAX_CONTENT_LENGTH = int(os.getenv('MAX_FILE_SIZE', 1 * 1024 * 1024 * 1024))  # default 1GB
 
+# Hash de contenido de los archivos subidos (duplicados y cache de resultados),
+# calculado mientras se escribe la subida: 'blake2b' (default, resistente a
+# colisiones), 'md5' o 'xxhash' (varias veces mas rapido; requiere el paquete
+# xxhash, si no esta instalado se usa blake2b). Con md5/xxhash los bytes se
+# comparan antes de compartir un contenido ya almacenado. Cambiarlo invalida
+# la cache de resultados.
+UPLOAD_HASH_ALGO = os.getenv('UPLOAD_HASH_ALGO', 'blake2b').lower()
+
+# Tamano de parte sugerido a los clientes en las subidas reanudables (MB)
+UPLOAD_CHUNK_MB = int(os.getenv('UPLOAD_CHUNK_MB', 8))
+
+# Nivel de DEFLATE de los ZIP de resultados (1 = rapido ... 9 = maximo).
+# Imagenes y PDFs ya comprimidos se guardan sin recomprimir.
+ZIP_COMPRESSLEVEL = min(max(int(os.getenv('ZIP_COMPRESSLEVEL', 1)), 1), 9)
+
+# Threads que comprimen en paralelo los miembros de los ZIP de resultados
+# (zlib libera el GIL). 1 = comprimir en el mismo thread del procesador.
+ZIP_THREADS = int(os.getenv('ZIP_THREADS', min(4, os.cpu_count() or 1)))
+
+# Procesos que renderizan paginas en paralelo en las conversiones a imagen (1 = en serie).
+# Cada trabajo usa su propio pool: con varios trabajos de imagenes a la vez
+# conviene que RENDER_PROCESSES * max_concurrentes no supere los CPUs.
+RENDER_PROCESSES = max(1, int(os.getenv('RENDER_PROCESSES', min(4, os.cpu_count() or 1))))
+# Paginas por tarea enviada al pool: lotes mas grandes amortizan el envio,
+# mas chicos reparten mejor la carga y reducen la memoria en vuelo
+RENDER_CHUNK_PAGES = max(1, int(os.getenv('RENDER_CHUNK_PAGES', 4)))
+# Paginas cuyo render supera RENDER_MAX_MEGAPIXELES (planos A0 a 600 DPI, etc.)
+# se renderizan por franjas de hasta RENDER_BANDA_MB, escribiendo la imagen
+# en el ZIP a medida que se codifica, en lugar de un unico pixmap gigante
+RENDER_MAX_MEGAPIXELES = float(os.getenv('RENDER_MAX_MEGAPIXELES', 50))
+RENDER_BANDA_MB = max(1, int(os.getenv('RENDER_BANDA_MB', 32)))
+# Estimacion de tamano y tiempo de las conversiones a imagen: se renderizan
+# franjas (ESTIMATE_SAMPLE_FRACTION del alto) de ESTIMATE_SAMPLE_PAGES paginas
+# repartidas por el documento y se extrapola; se cachea por hash, DPI y formato.
+ESTIMATE_SAMPLE_PAGES = max(1, int(os.getenv('ESTIMATE_SAMPLE_PAGES', 3)))
+ESTIMATE_SAMPLE_FRACTION = min(1.0, float(os.getenv('ESTIMATE_SAMPLE_FRACTION', 0.125)))
+
+# Descargas de resultados servidas por el proxy en lugar de Flask:
+# '' (Flask, con Range/ETag), 'x-accel' (nginx: X-Accel-Redirect hacia
+# DOWNLOAD_ACCEL_PREFIX, una location internal con alias a OUTPUT_FOLDER)
+# o 'x-sendfile' (Apache mod_xsendfile / lighttpd: ruta absoluta)
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+if DOWNLOAD_OFFLOAD not in ('', 'x-accel', 'x-sendfile'):
+    DOWNLOAD_OFFLOAD = ''
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/outputs-internos/')
+
 # Extensiones permitidas
 ALLOWED_EXTENSIONS = {'pdf', 'ndm2', 'json', 'jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'tif', 'webp', 'svg', 'eps', 'xlsx', 'xls', 'epub', 'wav', 'mp3', 'mp4', 'm4a'}
 
@@ -38,13 +87,70 @@ FILE_RETENTION_HOURS = int(os.getenv('FILE_RETENTION_HOURS', 4))
 
 # Base de datos SQLite
 DATABASE_PATH = DATA_FOLDER / 'pdfexport.db'
+# Ajustes de SQLite (modo WAL). synchronous=NORMAL no hace fsync en cada
+# commit: ante un corte de luz se pueden perder las ultimas transacciones,
+# nunca corromper la base. FULL = fsync en cada commit.
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_MB = int(os.getenv('SQLITE_CACHE_MB', 16))
 
 # Configuracion de trabajos
 JOB_CHECK_INTERVAL = 1  # segundos entre verificaciones de progreso
+# Cada cuantos segundos se recalcula el resumen que sirve /api/v1/status
+# (las peticiones leen la copia en memoria, no la base)
+STATUS_REFRESH_SEG = int(os.getenv('STATUS_REFRESH_SEG', 5))
+# El progreso se publica en memoria a los streams SSE del mismo proceso.
+# Con varios procesos/contenedores sobre la misma base, 'true' agrega un
+# sondeo compartido (una consulta por intervalo para todos los observadores).
+PROGRESS_CROSS_PROCESS = os.getenv('PROGRESS_CROSS_PROCESS', 'false').lower() == 'true'
+# El progreso por pagina se acumula en memoria y se escribe en la BD en un
+# solo lote como maximo cada PROGRESS_FLUSH_MS (los streams SSE lo reciben
+# al instante igual). 0 = escribir cada actualizacion.
+PROGRESS_FLUSH_MS = int(os.getenv('PROGRESS_FLUSH_MS', 1000))
+# Cantidad de threads worker que procesan la cola en paralelo.
+# Los limites por tipo de conversion se declaran en registrar_procesador().
+JOB_WORKERS = max(1, int(os.getenv('JOB_WORKERS', 4)))
+# Ejecutar los procesadores CPU-bound (registrados con en_proceso=True) en un
+# proceso hijo: escalan con los nucleos sin el GIL y un crash u OOM del
+# extractor no tumba el servidor web. 'false' = todo en threads del proceso Flask.
+JOB_PROCESS_BACKEND = os.getenv('JOB_PROCESS_BACKEND', 'true').lower() == 'true'
+# Limites duros para trabajos en proceso hijo: al superarlos el proceso (y sus
+# subprocesos) se termina y el trabajo queda en error. 0 = sin limite.
+JOB_TIMEOUT_SEG = int(os.getenv('JOB_TIMEOUT_SEG', 1800))
+JOB_MAX_RSS_MB = int(os.getenv('JOB_MAX_RSS_MB', 2048))
+# Cola persistente en la tabla 'trabajos' (compartible entre procesos/contenedores).
+# Un trabajo cuyo worker no renueva el lease en JOB_LEASE_SEG se reintenta,
+# hasta JOB_MAX_INTENTOS veces, tras JOB_RETRY_DELAY_SEG de espera.
+JOB_LEASE_SEG = int(os.getenv('JOB_LEASE_SEG', 60))
+JOB_MAX_INTENTOS = int(os.getenv('JOB_MAX_INTENTOS', 3))
+JOB_RETRY_DELAY_SEG = int(os.getenv('JOB_RETRY_DELAY_SEG', 5))
+# Cache de resultados: una conversion repetida (mismo contenido, tipo y
+# parametros) devuelve al instante la salida ya generada. Tamanio maximo en MB
+# de los resultados retenidos por la cache (se desalojan los menos usados en la
+# limpieza periodica). 0 = cache desactivada.
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', 2048))
+# Horas sin uso tras las cuales una entrada de la cache se descarta
+RESULT_CACHE_TTL_HOURS = int(os.getenv('RESULT_CACHE_TTL_HOURS', 24))
+JOB_POLL_SEG = float(os.getenv('JOB_POLL_SEG', 1))  # sondeo de la cola sin avisos locales
+# Planificacion: clase de prioridad segun costo (paginas + MB del archivo; en las
+# conversiones a imagen, paginas + MB de salida estimados).
+# Costo <= JOB_COSTO_INTERACTIVO: interactiva; >= JOB_COSTO_MASIVO: masiva.
+# Cada JOB_AGING_SEG de espera un trabajo sube una clase.
+JOB_COSTO_INTERACTIVO = float(os.getenv('JOB_COSTO_INTERACTIVO', 20))
+JOB_COSTO_MASIVO = float(os.getenv('JOB_COSTO_MASIVO', 300))
+JOB_AGING_SEG = int(os.getenv('JOB_AGING_SEG', 120))
 
 # Configuracion de miniaturas
 THUMBNAIL_SIZE = (200, 280)  # ancho x alto en pixeles
 THUMBNAIL_DPI = 72
+# Cache de miniaturas renderizadas: en disco por (hash, pagina, DPI) y una LRU en memoria
+THUMBNAIL_CACHE_FOLDER = DATA_FOLDER / 'miniaturas'
+THUMBNAIL_CACHE_MAX_MB = int(os.getenv('THUMBNAIL_CACHE_MAX_MB', 256))
+THUMBNAIL_MEMORY_MB = int(os.getenv('THUMBNAIL_MEMORY_MB', 32))
+# Paginas cuyas miniaturas se generan en segundo plano al subir un PDF (0 = ninguna)
+THUMBNAIL_PREGENERATE = int(os.getenv('THUMBNAIL_PREGENERATE', 24))
 
 # URL base del servicio nlm-ingestor para extraccion avanzada de tablas de PDF.
 # Dejar vacio ('') para deshabilitar y usar solo PyMuPDF/pdfplumber como fallback.
@@ -81,5 +187,5 @@ TIMEOUT = int(os.getenv('TIMEOUT', 10000))
 RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', 3))
 
 # Crear directorios si no existen
-for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, DATA_FOLDER]:
+for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, DATA_FOLDER, THUMBNAIL_CACHE_FOLDER]:
     folder.mkdir(parents=True, exist_ok=True)
@@ -4,7 +4,9 @@ Modelos de base de datos SQLite para PDFexport.
 Gestiona archivos subidos y trabajos de conversion.
 """
 
+import os
 import sqlite3
+import threading
 import uuid
 import binascii
 from datetime import datetime, timedelta
@@ -21,20 +23,98 @@ def _crc32(texto: str) -> int:
     return binascii.crc32(texto.encode('utf-8')) & 0xFFFFFFFF
 
 
+# Una conexion por thread, reutilizada entre llamadas: evita el connect y
+# la lectura del esquema en cada consulta, y mantiene la cache de sentencias
+# preparadas de sqlite3.
+_local = threading.local()
+
+# Sentencias preparadas que sqlite3 cachea por conexion
+SENTENCIAS_EN_CACHE = 256
+
+
+def _abrir_conexion() -> sqlite3.Connection:
+    """Abre una conexion configurada: WAL, synchronous, busy_timeout y cache."""
+    conexion = sqlite3.connect(
+        str(config.DATABASE_PATH),
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=SENTENCIAS_EN_CACHE
+    )
+    conexion.row_factory = sqlite3.Row
+    # WAL: los lectores no bloquean al escritor ni viceversa, y con
+    # synchronous=NORMAL el commit no hace fsync (solo en los checkpoints)
+    conexion.execute('PRAGMA journal_mode = WAL')
+    conexion.execute(f'PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}')
+    conexion.execute(f'PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT_MS)}')
+    conexion.execute(f'PRAGMA cache_size = -{int(config.SQLITE_CACHE_MB) * 1024}')
+    conexion.execute('PRAGMA temp_store = MEMORY')
+    return conexion
+
+
+def _conexion_del_thread() -> sqlite3.Connection:
+    """
+    Conexion del thread actual. Se abre de nuevo si cambio la ruta de la base
+    o el proceso (un hijo creado con fork no debe usar la del padre).
+    """
+    clave = (os.getpid(), str(config.DATABASE_PATH))
+    if getattr(_local, 'clave', None) != clave:
+        _local.conexion = _abrir_conexion()
+        _local.clave = clave
+        _local.profundidad = 0
+    return _local.conexion
+
+
 @contextmanager
 def obtener_conexion():
-    """Context manager para conexiones a la base de datos."""
-    conexion = sqlite3.connect(str(config.DATABASE_PATH))
-    conexion.row_factory = sqlite3.Row
+    """
+    Context manager para conexiones a la base de datos.
+
+    Usa la conexion persistente del thread. Los bloques anidados comparten
+    la transaccion: solo el mas externo hace commit o rollback.
+    """
+    conexion = _conexion_del_thread()
+    _local.profundidad += 1
     try:
         yield conexion
-        conexion.commit()
+        if _local.profundidad == 1:
+            conexion.commit()
     except Exception as e:
-        conexion.rollback()
+        if _local.profundidad == 1:
+            conexion.rollback()
         logger.error(f"Error en base de datos: {e}")
         raise
     finally:
-        conexion.close()
+        _local.profundidad -= 1
+
+
+@contextmanager
+def transaccion_inmediata():
+    """
+    Bloque que toma el lock de escritura de SQLite al empezar (BEGIN
+    IMMEDIATE): lo serializa frente a los demas threads y procesos que usan
+    la misma base, no solo los de este proceso. Las funciones de este modulo
+    llamadas dentro comparten la transaccion.
+    """
+    with obtener_conexion() as conexion:
+        if not conexion.in_transaction:
+            conexion.execute('BEGIN IMMEDIATE')
+        yield conexion
+
+
+def _agregar_columnas_faltantes(cursor, tabla: str, columnas: dict):
+    """
+    Migracion liviana: agrega a una tabla existente las columnas que le falten.
+
+    Args:
+        cursor: Cursor de una conexion activa
+        tabla: Nombre de la tabla
+        columnas: Dict nombre -> definicion SQL (ej: 'INTEGER DEFAULT 0')
+    """
+    cursor.execute(f'PRAGMA table_info({tabla})')
+    existentes = {row['name'] for row in cursor.fetchall()}
+    for nombre, definicion in columnas.items():
+        if nombre not in existentes:
+            cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN {nombre} {definicion}')
+            logger.info(f"Columna agregada: {tabla}.{nombre}")
 
 
 def inicializar_db():
@@ -75,11 +155,88 @@ def inicializar_db():
             )
         ''')
 
+        # Columnas de la cola persistente (lease + reintentos).
+        # Se agregan por migracion para no romper bases creadas con versiones previas.
+        _agregar_columnas_faltantes(cursor, 'trabajos', {
+            'intentos': 'INTEGER DEFAULT 0',       # veces que un worker reclamo el trabajo
+            'worker_id': 'TEXT',                   # worker que lo tiene reclamado
+            'lease_expira': 'TEXT',                # si vence sin heartbeat, se reintenta
+            'heartbeat': 'TEXT',                   # ultimo latido del worker
+            'disponible_desde': 'TEXT',            # visibilidad diferida para reintentos
+            'prioridad': 'INTEGER DEFAULT 1',      # 0 interactiva, 1 normal, 2 masiva
+            'costo_estimado': 'REAL DEFAULT 0',    # paginas + MB de entrada (o de salida estimados)
+            'cliente': 'TEXT',                     # IP o API key (reparto equitativo)
+            'clave_cache': 'TEXT',                 # hash + tipo + parametros (cache de resultados)
+            'lider_id': 'TEXT',                    # trabajo identico en curso al que se acoplo
+            'hash_resultado': 'TEXT',              # ETag de descarga (trabajo, tamano y fecha de modificacion; no es un hash)
+        })
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_lider ON trabajos(lider_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_clave_cache ON trabajos(clave_cache)')
+
+        # Subidas por partes (reanudables): el archivo se arma en UPLOAD_FOLDER
+        # y cada parte recibida queda registrada por su offset
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subidas (
+                id TEXT PRIMARY KEY,
+                nombre_original TEXT NOT NULL,
+                tamano_bytes INTEGER NOT NULL,
+                fecha_modificacion TEXT,
+                ruta_parcial TEXT NOT NULL,
+                fecha_creacion TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subida_partes (
+                subida_id TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                tamano INTEGER NOT NULL,
+                PRIMARY KEY (subida_id, offset)
+            )
+        ''')
+
+        # Cache de resultados de conversion: mismo contenido + tipo + parametros
+        # reutiliza la salida ya generada en lugar de repetir el trabajo
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_resultados (
+                clave TEXT PRIMARY KEY,
+                hash_archivo TEXT NOT NULL,
+                tipo_conversion TEXT NOT NULL,
+                parametros TEXT,
+                ruta_resultado TEXT NOT NULL,
+                mensaje TEXT,
+                tamano_bytes INTEGER DEFAULT 0,
+                fecha_creacion TEXT NOT NULL,
+                fecha_ultimo_uso TEXT NOT NULL,
+                usos INTEGER DEFAULT 0
+            )
+        ''')
+        _agregar_columnas_faltantes(cursor, 'cache_resultados', {'hash_resultado': 'TEXT'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_uso ON cache_resultados(fecha_ultimo_uso)')
+
+        # Estimaciones de las conversiones a imagen por muestreo: bytes y
+        # segundos por punto cuadrado de pagina (mas segundos fijos por
+        # pagina), por contenido, DPI y formato
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estimaciones_render (
+                hash_archivo TEXT NOT NULL,
+                dpi INTEGER NOT NULL,
+                formato TEXT NOT NULL,
+                bytes_por_pt2 REAL NOT NULL,
+                segundos_por_pt2 REAL NOT NULL,
+                segundos_por_pagina REAL NOT NULL,
+                paginas_muestreadas INTEGER NOT NULL,
+                fecha_creacion TEXT NOT NULL,
+                PRIMARY KEY (hash_archivo, dpi, formato)
+            )
+        ''')
+
         # Indices para mejorar rendimiento
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_archivos_hash ON archivos(hash_archivo)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_archivos_fecha ON archivos(fecha_subida)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_archivos_ruta ON archivos(ruta_archivo)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_fecha ON trabajos(fecha_creacion)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_cola ON trabajos(estado, fecha_creacion)')
 
         # Tabla de notepads compartidos (Etapa 45)
         cursor.execute('''
@@ -163,17 +320,72 @@ def buscar_archivo_existente(nombre: str, tamano: int, fecha_mod: str) -> dict:
         return dict(row) if row else None
 
 
-def listar_archivos() -> list:
-    """Lista todos los archivos disponibles (dentro del periodo de retencion)."""
+def buscar_archivo_por_hash(hash_archivo: str, nombre: str = None) -> dict:
+    """Busca un archivo vigente con el mismo contenido (y nombre, si se indica)."""
     fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+    condicion = 'AND nombre_original = ?' if nombre else ''
+    params = [hash_archivo, fecha_limite] + ([nombre] if nombre else [])
 
     with obtener_conexion() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT * FROM archivos
-            WHERE fecha_subida > ?
-            ORDER BY fecha_subida DESC
-        ''', (fecha_limite,))
+            WHERE hash_archivo = ? AND fecha_subida > ? {condicion}
+            ORDER BY fecha_subida DESC LIMIT 1
+        ''', params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def contar_archivos() -> int:
+    """Cantidad de archivos dentro del periodo de retencion."""
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) AS n FROM archivos WHERE fecha_subida > ?', (fecha_limite,))
+        return cursor.fetchone()['n']
+
+
+def listar_archivos(limite: int = None, cursor_paginacion: str = None,
+                    campos: list = None) -> list:
+    """
+    Lista los archivos disponibles (dentro del periodo de retencion).
+
+    Args:
+        limite: Maximo de filas (None = todas)
+        cursor_paginacion: Cursor devuelto por siguiente_cursor() para la pagina siguiente
+        campos: Columnas a traer (COLUMNAS_ARCHIVO). None = todas.
+                'id' y 'fecha_subida' se incluyen siempre.
+    """
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+
+    if campos:
+        columnas = ['id', 'fecha_subida'] + [
+            c for c in campos if c in COLUMNAS_ARCHIVO and c not in ('id', 'fecha_subida')
+        ]
+    else:
+        columnas = ['*']
+
+    condiciones = ['fecha_subida > ?']
+    params = [fecha_limite]
+    if cursor_paginacion:
+        condicion, valores = _condicion_cursor(cursor_paginacion, 'fecha_subida')
+        condiciones.append(condicion)
+        params += valores
+
+    sql = f'''
+        SELECT {', '.join(columnas)} FROM archivos
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY fecha_subida DESC, id DESC
+    '''
+    if limite:
+        sql += ' LIMIT ?'
+        params.append(int(limite))
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
         return [dict(row) for row in cursor.fetchall()]
 
 
@@ -189,49 +401,93 @@ def eliminar_archivo(archivo_id: str) -> bool:
     return eliminado
 
 
-def eliminar_archivos_expirados() -> int:
+def eliminar_archivos_expirados() -> set:
     """
     Elimina registros de archivos mas antiguos que FILE_RETENTION_HOURS.
-    Retorna la cantidad de registros eliminados.
+    Retorna las rutas que referenciaban (el archivo fisico puede seguir
+    en uso por otros registros con el mismo contenido).
     """
     fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
 
     with obtener_conexion() as conn:
         cursor = conn.cursor()
+        cursor.execute('DELETE FROM archivos WHERE fecha_subida < ? RETURNING ruta_archivo',
+                       (fecha_limite,))
+        rutas = [row['ruta_archivo'] for row in cursor.fetchall()]
 
-        # Primero obtenemos los IDs para logging
-        cursor.execute('SELECT id FROM archivos WHERE fecha_subida < ?', (fecha_limite,))
-        ids_expirados = [row['id'] for row in cursor.fetchall()]
+    if rutas:
+        logger.info(f"Eliminados {len(rutas)} archivos expirados de BD")
 
-        # Eliminamos los registros
-        cursor.execute('DELETE FROM archivos WHERE fecha_subida < ?', (fecha_limite,))
-        cantidad = cursor.rowcount
+    return set(rutas)
 
-    if cantidad > 0:
-        logger.info(f"Eliminados {cantidad} archivos expirados de BD")
 
-    return cantidad
+def contar_referencias_archivo(ruta_archivo: str) -> int:
+    """Cantidad de registros de archivos que comparten un archivo fisico."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM archivos WHERE ruta_archivo = ?', (ruta_archivo,))
+        return cursor.fetchone()[0]
+
+
+def listar_rutas_archivos() -> set:
+    """Rutas fisicas referenciadas por algun registro de archivos."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT ruta_archivo FROM archivos')
+        return {row['ruta_archivo'] for row in cursor.fetchall()}
 
 
 # =============================================================================
 # Funciones para TRABAJOS
 # =============================================================================
 
-def crear_trabajo(archivo_id: str, tipo_conversion: str, parametros: str = None) -> str:
+def crear_trabajo(archivo_id: str, tipo_conversion: str, parametros: str = None,
+                  prioridad: int = 1, costo_estimado: float = 0, cliente: str = None,
+                  clave_cache: str = None, resultado_cache: dict = None) -> str:
     """
     Crea un nuevo trabajo de conversion.
     Retorna el ID del trabajo.
+
+    Con resultado_cache (registro de cache_resultados) el trabajo se crea
+    directamente 'completado' apuntando a la salida existente, en una sola
+    sentencia para que ningun worker llegue a reclamarlo.
+
+    Si hay un trabajo con la misma clave_cache pendiente o en proceso, el
+    nuevo se acopla a el (lider_id): no se ejecuta y refleja su estado,
+    progreso y resultado. La busqueda del lider va dentro del INSERT, asi
+    que dos pedidos simultaneos no generan dos ejecuciones.
     """
     trabajo_id = str(uuid.uuid4())
     fecha_creacion = datetime.now().isoformat()
 
+    if resultado_cache:
+        estado, progreso = 'completado', 100
+        ruta_resultado = resultado_cache['ruta_resultado']
+        hash_resultado = resultado_cache['hash_resultado']
+        mensaje = f"{resultado_cache['mensaje'] or 'Conversion completada'} (resultado en cache)"
+        fecha_inicio = fecha_fin = fecha_creacion
+    else:
+        estado, progreso = 'pendiente', 0
+        ruta_resultado = hash_resultado = mensaje = fecha_inicio = fecha_fin = None
+
     with obtener_conexion() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO trabajos
-            (id, archivo_id, tipo_conversion, estado, progreso, parametros, fecha_creacion)
-            VALUES (?, ?, ?, 'pendiente', 0, ?, ?)
-        ''', (trabajo_id, archivo_id, tipo_conversion, parametros, fecha_creacion))
+            (id, archivo_id, tipo_conversion, estado, progreso, parametros, fecha_creacion,
+             prioridad, costo_estimado, cliente, clave_cache, ruta_resultado, hash_resultado,
+             mensaje, fecha_inicio, fecha_fin, lider_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, (
+                SELECT l.id FROM trabajos l
+                WHERE ? AND l.clave_cache = ? AND l.lider_id IS NULL
+                  AND l.estado IN ('pendiente', 'procesando')
+                ORDER BY l.fecha_creacion LIMIT 1
+            ))
+        ''', (trabajo_id, archivo_id, tipo_conversion, estado, progreso, parametros,
+              fecha_creacion, prioridad, costo_estimado, cliente, clave_cache,
+              ruta_resultado, hash_resultado, mensaje, fecha_inicio, fecha_fin,
+              bool(clave_cache and not resultado_cache), clave_cache))
+        _sincronizar_seguidores(cursor, seguidor_id=trabajo_id)
 
     logger.info(f"Trabajo creado: {tipo_conversion} -> {trabajo_id}")
     return trabajo_id
@@ -251,8 +507,33 @@ def obtener_trabajo(trabajo_id: str) -> dict:
         return dict(row) if row else None
 
 
+def _sincronizar_seguidores(cursor, lider_id: str = None, seguidor_id: str = None):
+    """
+    Copia estado, progreso, mensaje y resultado de cada lider a los trabajos
+    acoplados a el que siguen activos. Sin argumentos sincroniza todos.
+    """
+    condicion = ''
+    params = []
+    if lider_id:
+        condicion = 'AND l.id = ?'
+        params.append(lider_id)
+    if seguidor_id:
+        condicion += ' AND trabajos.id = ?'
+        params.append(seguidor_id)
+    cursor.execute(f'''
+        UPDATE trabajos
+        SET estado = l.estado, progreso = l.progreso, mensaje = l.mensaje,
+            ruta_resultado = l.ruta_resultado, hash_resultado = l.hash_resultado,
+            fecha_inicio = l.fecha_inicio, fecha_fin = l.fecha_fin
+        FROM trabajos AS l
+        WHERE trabajos.lider_id = l.id
+          AND trabajos.estado IN ('pendiente', 'procesando') {condicion}
+    ''', params)
+
+
 def actualizar_trabajo(trabajo_id: str, estado: str = None, progreso: int = None,
-                       mensaje: str = None, ruta_resultado: str = None) -> bool:
+                       mensaje: str = None, ruta_resultado: str = None,
+                       hash_resultado: str = None) -> bool:
     """Actualiza el estado de un trabajo."""
     campos = []
     valores = []
@@ -266,6 +547,8 @@ def actualizar_trabajo(trabajo_id: str, estado: str = None, progreso: int = None
         elif estado in ('completado', 'error'):
             campos.append('fecha_fin = ?')
             valores.append(datetime.now().isoformat())
+            # Estado final: liberar el lease de la cola
+            campos.append('lease_expira = NULL')
 
     if progreso is not None:
         campos.append('progreso = ?')
@@ -279,6 +562,10 @@ def actualizar_trabajo(trabajo_id: str, estado: str = None, progreso: int = None
         campos.append('ruta_resultado = ?')
         valores.append(ruta_resultado)
 
+    if hash_resultado is not None:
+        campos.append('hash_resultado = ?')
+        valores.append(hash_resultado)
+
     if not campos:
         return False
 
@@ -289,38 +576,383 @@ def actualizar_trabajo(trabajo_id: str, estado: str = None, progreso: int = None
         cursor.execute(f'''
             UPDATE trabajos SET {', '.join(campos)} WHERE id = ?
         ''', valores)
+        actualizado = cursor.rowcount > 0
+        if actualizado:
+            _sincronizar_seguidores(cursor, lider_id=trabajo_id)
+        return actualizado
+
+
+def finalizar_trabajo(trabajo_id: str, worker_id: str, estado: str, mensaje: str,
+                      ruta_resultado: str = None, hash_resultado: str = None) -> bool:
+    """
+    Pasa a estado final ('completado' o 'error') un trabajo que el worker
+    sigue teniendo reclamado. Si su lease vencio y el trabajo se reintento
+    en otro worker, o fue cancelado mientras corria, no se modifica.
+
+    Returns:
+        True si el trabajo seguia siendo de worker_id y se actualizo
+    """
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE trabajos
+            SET estado = ?, mensaje = ?, fecha_fin = ?, lease_expira = NULL,
+                progreso = CASE WHEN ? = 'completado' THEN 100 ELSE progreso END,
+                ruta_resultado = COALESCE(?, ruta_resultado),
+                hash_resultado = COALESCE(?, hash_resultado)
+            WHERE id = ? AND worker_id = ? AND estado = 'procesando'
+        ''', (estado, mensaje, datetime.now().isoformat(), estado, ruta_resultado,
+              hash_resultado, trabajo_id, worker_id))
+        actualizado = cursor.rowcount > 0
+        if actualizado:
+            _sincronizar_seguidores(cursor, lider_id=trabajo_id)
+        return actualizado
+
+
+def hay_trabajo_en_curso(clave_cache: str) -> bool:
+    """True si hay un trabajo lider pendiente o en proceso con esa clave de cache."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 1 FROM trabajos
+            WHERE clave_cache = ? AND lider_id IS NULL AND estado IN ('pendiente', 'procesando')
+            LIMIT 1
+        ''', (clave_cache,))
+        return cursor.fetchone() is not None
+
+
+def actualizar_costo_trabajo(trabajo_id: str, prioridad: int, costo_estimado: float) -> bool:
+    """Fija prioridad y costo de un trabajo que todavia esta en la cola."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE trabajos SET prioridad = ?, costo_estimado = ?
+            WHERE id = ? AND estado = 'pendiente'
+        ''', (prioridad, costo_estimado, trabajo_id))
         return cursor.rowcount > 0
 
 
-def listar_trabajos(estado: str = None) -> list:
-    """Lista trabajos, opcionalmente filtrados por estado."""
+def obtener_trabajos_por_ids(trabajo_ids: list) -> list:
+    """Estado, progreso y mensaje de varios trabajos (sin JOIN), en lotes."""
+    resultado = []
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        for i in range(0, len(trabajo_ids), 500):
+            lote = trabajo_ids[i:i + 500]
+            cursor.execute(f'''
+                SELECT id, estado, progreso, mensaje, lider_id FROM trabajos
+                WHERE id IN ({','.join('?' * len(lote))})
+            ''', lote)
+            resultado.extend(dict(row) for row in cursor.fetchall())
+    return resultado
+
+
+def listar_ids_trabajos_activos(cliente: str) -> list:
+    """IDs de los trabajos pendientes o en proceso de un cliente."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id FROM trabajos
+            WHERE cliente = ? AND estado IN ('pendiente', 'procesando')
+        ''', (cliente,))
+        return [row['id'] for row in cursor.fetchall()]
+
+
+def actualizar_progresos(progresos: dict) -> int:
+    """
+    Escribe el progreso de varios trabajos en una sola transaccion.
+    Solo afecta trabajos que siguen 'procesando' (un estado final ya
+    registrado no se pisa con un progreso atrasado).
+
+    Args:
+        progresos: dict trabajo_id -> (progreso, mensaje); mensaje None = sin cambio
+    """
+    if not progresos:
+        return 0
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE trabajos SET progreso = ?, mensaje = COALESCE(?, mensaje)
+            WHERE id = ? AND estado = 'procesando'
+        ''', [(progreso, mensaje, trabajo_id)
+              for trabajo_id, (progreso, mensaje) in progresos.items()])
+        actualizados = cursor.rowcount
+        for trabajo_id in progresos:
+            _sincronizar_seguidores(cursor, lider_id=trabajo_id)
+        return actualizados
+
+
+# Columnas de trabajos que se pueden pedir en los listados (proyeccion)
+COLUMNAS_TRABAJO = (
+    'id', 'archivo_id', 'tipo_conversion', 'estado', 'progreso', 'mensaje',
+    'ruta_resultado', 'parametros', 'fecha_creacion', 'fecha_inicio', 'fecha_fin',
+    'worker_id', 'intentos', 'prioridad', 'cliente', 'lider_id'
+)
+
+# Columnas de archivos que se pueden pedir en los listados (proyeccion)
+COLUMNAS_ARCHIVO = (
+    'id', 'nombre_original', 'nombre_guardado', 'tamano_bytes', 'fecha_subida',
+    'fecha_modificacion', 'ruta_archivo', 'hash_archivo', 'num_paginas'
+)
+
+
+def _condicion_cursor(cursor_paginacion: str, columna_fecha: str, columna_id: str = 'id') -> tuple:
+    """
+    Condicion de paginacion por clave (keyset) para listados ordenados por
+    (fecha DESC, id DESC). El cursor es 'fecha|id' de la ultima fila vista.
+    """
+    fecha, _, ultimo_id = (cursor_paginacion or '').partition('|')
+    if not fecha or not ultimo_id:
+        raise ValueError('Cursor de paginacion invalido')
+    return f'({columna_fecha}, {columna_id}) < (?, ?)', [fecha, ultimo_id]
+
+
+def siguiente_cursor(filas: list, columna_fecha: str, limite: int) -> str:
+    """Cursor para pedir la pagina siguiente, o None si no hay mas filas."""
+    if not limite or len(filas) < limite:
+        return None
+    ultima = filas[-1]
+    return f"{ultima[columna_fecha]}|{ultima['id']}"
+
+
+def contar_trabajos_por_estado() -> dict:
+    """Cantidad de trabajos por estado dentro del periodo de retencion (GROUP BY)."""
     fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
 
     with obtener_conexion() as conn:
         cursor = conn.cursor()
+        cursor.execute('''
+            SELECT estado, COUNT(*) AS cantidad FROM trabajos
+            WHERE fecha_creacion > ?
+            GROUP BY estado
+        ''', (fecha_limite,))
+        return {row['estado']: row['cantidad'] for row in cursor.fetchall()}
 
-        if estado:
-            cursor.execute('''
-                SELECT t.*, a.nombre_original as nombre_archivo
-                FROM trabajos t
-                LEFT JOIN archivos a ON t.archivo_id = a.id
-                WHERE t.estado = ? AND t.fecha_creacion > ?
-                ORDER BY t.fecha_creacion DESC
-            ''', (estado, fecha_limite))
-        else:
-            cursor.execute('''
-                SELECT t.*, a.nombre_original as nombre_archivo
-                FROM trabajos t
-                LEFT JOIN archivos a ON t.archivo_id = a.id
-                WHERE t.fecha_creacion > ?
-                ORDER BY t.fecha_creacion DESC
-            ''', (fecha_limite,))
 
+def resumen_trabajos() -> list:
+    """
+    Conteo de trabajos por (estado, tipo) dentro del periodo de retencion,
+    con la fecha de creacion mas antigua de cada grupo. Una sola consulta.
+    """
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT estado, tipo_conversion, COUNT(*) AS cantidad,
+                   MIN(fecha_creacion) AS mas_antiguo
+            FROM trabajos
+            WHERE fecha_creacion > ?
+            GROUP BY estado, tipo_conversion
+        ''', (fecha_limite,))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def listar_trabajos(estado: str = None, limite: int = None, cursor_paginacion: str = None,
+                    campos: list = None, solo_con_resultado: bool = False) -> list:
+    """
+    Lista trabajos, opcionalmente filtrados por estado.
+
+    Args:
+        estado: Filtrar por estado
+        limite: Maximo de filas (None = todas)
+        cursor_paginacion: Cursor devuelto por siguiente_cursor() para la pagina siguiente
+        campos: Columnas a traer (COLUMNAS_TRABAJO o 'nombre_archivo'). None = todas.
+                'id' y 'fecha_creacion' se incluyen siempre.
+        solo_con_resultado: Solo trabajos con archivo de resultado
+    """
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+
+    if campos:
+        columnas = ['t.id', 't.fecha_creacion'] + [
+            f't.{c}' for c in campos
+            if c in COLUMNAS_TRABAJO and c not in ('id', 'fecha_creacion')
+        ]
+        con_nombre = 'nombre_archivo' in campos
+    else:
+        columnas = ['t.*']
+        con_nombre = True
+    if con_nombre:
+        columnas.append('a.nombre_original as nombre_archivo')
+
+    condiciones = ['t.fecha_creacion > ?']
+    params = [fecha_limite]
+    if estado:
+        condiciones.append('t.estado = ?')
+        params.append(estado)
+    if solo_con_resultado:
+        condiciones.append('t.ruta_resultado IS NOT NULL')
+    if cursor_paginacion:
+        condicion, valores = _condicion_cursor(cursor_paginacion, 't.fecha_creacion', 't.id')
+        condiciones.append(condicion)
+        params += valores
+
+    sql = f'''
+        SELECT {', '.join(columnas)}
+        FROM trabajos t
+        {'LEFT JOIN archivos a ON t.archivo_id = a.id' if con_nombre else ''}
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY t.fecha_creacion DESC, t.id DESC
+    '''
+    if limite:
+        sql += ' LIMIT ?'
+        params.append(int(limite))
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
         return [dict(row) for row in cursor.fetchall()]
 
 
+# =============================================================================
+# Cola persistente de TRABAJOS (lease + heartbeat + reintentos)
+# =============================================================================
+
+def reclamar_trabajo(worker_id: str, lease_seg: int, tipos: list,
+                     excluir_tipos: list = None, envejecimiento_seg: int = 120) -> dict:
+    """
+    Reclama atomicamente el siguiente trabajo pendiente para un worker.
+
+    El UPDATE con subconsulta es una sola sentencia: SQLite serializa las
+    escrituras, asi que dos procesos nunca reclaman el mismo trabajo.
+
+    Orden de seleccion:
+      1. Clase de prioridad efectiva: la clase sube un nivel por cada
+         envejecimiento_seg de espera, para que los trabajos masivos no
+         queden postergados indefinidamente.
+      2. Reparto equitativo: primero el cliente con menos trabajos en proceso.
+      3. Costo estimado ascendente (archivos chicos primero).
+      4. Antiguedad (FIFO).
+
+    Args:
+        worker_id: Identificador del worker (host:pid:arranque)
+        lease_seg: Duracion del lease; si vence sin heartbeat el trabajo se reintenta
+        tipos: Tipos de conversion que este worker sabe procesar
+        excluir_tipos: Tipos a omitir (limite de concurrencia alcanzado)
+        envejecimiento_seg: Segundos de espera que equivalen a subir una clase
+
+    Returns:
+        dict con el trabajo reclamado (ya en estado 'procesando') o None
+    """
+    tipos = [t for t in tipos if t not in (excluir_tipos or [])]
+    if not tipos:
+        return None
+
+    ahora = datetime.now()
+    ahora_iso = ahora.isoformat()
+    marcadores = ','.join('?' * len(tipos))
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE trabajos
+            SET estado = 'procesando', progreso = 0, worker_id = ?,
+                intentos = COALESCE(intentos, 0) + 1,
+                fecha_inicio = ?, heartbeat = ?, lease_expira = ?
+            WHERE id = (
+                SELECT t.id FROM trabajos t
+                WHERE t.estado = 'pendiente' AND t.lider_id IS NULL
+                  AND (t.disponible_desde IS NULL OR t.disponible_desde <= ?)
+                  AND t.tipo_conversion IN ({marcadores})
+                ORDER BY
+                    COALESCE(t.prioridad, 1) - MIN(
+                        COALESCE(t.prioridad, 1),
+                        CAST((julianday(?) - julianday(t.fecha_creacion)) * 86400 / ? AS INTEGER)
+                    ),
+                    (SELECT COUNT(*) FROM trabajos p
+                     WHERE p.estado = 'procesando' AND p.lider_id IS NULL
+                       AND COALESCE(p.cliente, '') = COALESCE(t.cliente, '')),
+                    COALESCE(t.costo_estimado, 0),
+                    t.fecha_creacion
+                LIMIT 1
+            )
+            RETURNING id
+        ''', [worker_id, ahora_iso, ahora_iso,
+              (ahora + timedelta(seconds=lease_seg)).isoformat(), ahora_iso] + tipos +
+             [ahora_iso, max(1, envejecimiento_seg)])
+        row = cursor.fetchone()
+        if row:
+            _sincronizar_seguidores(cursor, lider_id=row['id'])
+
+    return obtener_trabajo(row['id']) if row else None
+
+
+def renovar_leases(worker_id: str, trabajo_ids: list, lease_seg: int) -> int:
+    """Heartbeat: extiende el lease de los trabajos que el worker sigue procesando."""
+    if not trabajo_ids:
+        return 0
+
+    ahora = datetime.now()
+    marcadores = ','.join('?' * len(trabajo_ids))
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE trabajos SET heartbeat = ?, lease_expira = ?
+            WHERE worker_id = ? AND estado = 'procesando' AND id IN ({marcadores})
+        ''', [ahora.isoformat(), (ahora + timedelta(seconds=lease_seg)).isoformat(),
+              worker_id] + list(trabajo_ids))
+        return cursor.rowcount
+
+
+def recuperar_trabajos_vencidos(max_intentos: int, espera_reintento_seg: int = 0,
+                                workers_caidos: list = None) -> dict:
+    """
+    Devuelve a la cola los trabajos 'procesando' cuyo worker dejo de dar heartbeat.
+
+    Los que ya agotaron max_intentos se marcan como error. Los trabajos de
+    workers_caidos (workers que se sabe que murieron) se recuperan de
+    inmediato, sin esperar a que venza el lease.
+
+    Returns:
+        dict con cantidad de 'reintentados' y 'fallidos'
+    """
+    ahora = datetime.now()
+    ahora_iso = ahora.isoformat()
+
+    condicion = "estado = 'procesando' AND lider_id IS NULL AND (lease_expira IS NULL OR lease_expira < ?"
+    params = [ahora_iso]
+    if workers_caidos:
+        condicion += f" OR worker_id IN ({','.join('?' * len(workers_caidos))})"
+        params += list(workers_caidos)
+    condicion += ")"
+
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE trabajos
+            SET estado = 'error', fecha_fin = ?, lease_expira = NULL, worker_id = NULL,
+                mensaje = 'Proceso interrumpido ' || COALESCE(intentos, 0) ||
+                          ' veces. Por favor, intente nuevamente.'
+            WHERE {condicion} AND COALESCE(intentos, 0) >= ?
+        ''', [ahora_iso] + params + [max_intentos])
+        fallidos = cursor.rowcount
+
+        cursor.execute(f'''
+            UPDATE trabajos
+            SET estado = 'pendiente', progreso = 0, lease_expira = NULL, worker_id = NULL,
+                disponible_desde = ?,
+                mensaje = 'Reintentando: el proceso anterior fue interrumpido'
+            WHERE {condicion}
+        ''', [(ahora + timedelta(seconds=espera_reintento_seg)).isoformat()] + params)
+        reintentados = cursor.rowcount
+
+        if fallidos or reintentados:
+            _sincronizar_seguidores(cursor)
+
+    if fallidos or reintentados:
+        logger.warning(f"Trabajos interrumpidos: {reintentados} reintentados, {fallidos} marcados como error")
+
+    return {'reintentados': reintentados, 'fallidos': fallidos}
+
+
 def cancelar_trabajo(trabajo_id: str) -> bool:
-    """Cancela un trabajo pendiente o en proceso."""
+    """
+    Cancela un trabajo pendiente o en proceso.
+
+    Si otros trabajos estaban acoplados a el, el mas antiguo pasa a ser el
+    nuevo lider (vuelve a la cola) y el resto se acopla a ese.
+    """
     with obtener_conexion() as conn:
         cursor = conn.cursor()
         cursor.execute('''
@@ -328,7 +960,29 @@ def cancelar_trabajo(trabajo_id: str) -> bool:
             SET estado = 'cancelado', fecha_fin = ?
             WHERE id = ? AND estado IN ('pendiente', 'procesando')
         ''', (datetime.now().isoformat(), trabajo_id))
-        return cursor.rowcount > 0
+        cancelado = cursor.rowcount > 0
+        if not cancelado:
+            return False
+
+        cursor.execute('''
+            SELECT id FROM trabajos
+            WHERE lider_id = ? AND estado IN ('pendiente', 'procesando')
+            ORDER BY fecha_creacion LIMIT 1
+        ''', (trabajo_id,))
+        nuevo_lider = cursor.fetchone()
+        if nuevo_lider:
+            cursor.execute('''
+                UPDATE trabajos
+                SET lider_id = NULL, estado = 'pendiente', progreso = 0, mensaje = NULL,
+                    fecha_inicio = NULL
+                WHERE id = ?
+            ''', (nuevo_lider['id'],))
+            cursor.execute('''
+                UPDATE trabajos SET lider_id = ?
+                WHERE lider_id = ? AND estado IN ('pendiente', 'procesando')
+            ''', (nuevo_lider['id'], trabajo_id))
+            _sincronizar_seguidores(cursor, lider_id=nuevo_lider['id'])
+        return True
 
 
 def eliminar_trabajos_expirados() -> int:
@@ -346,6 +1000,193 @@ def eliminar_trabajos_expirados() -> int:
     return cantidad
 
 
+# =============================================================================
+# SUBIDAS por partes (reanudables)
+# =============================================================================
+
+def crear_subida(nombre_original: str, tamano_bytes: int, fecha_modificacion: str,
+                 ruta_parcial: str) -> str:
+    """Registra una subida por partes y retorna su ID."""
+    subida_id = str(uuid.uuid4())
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO subidas
+            (id, nombre_original, tamano_bytes, fecha_modificacion, ruta_parcial, fecha_creacion)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (subida_id, nombre_original, tamano_bytes, fecha_modificacion, ruta_parcial,
+              datetime.now().isoformat()))
+    return subida_id
+
+
+def obtener_subida(subida_id: str) -> dict:
+    """Obtiene una subida por partes por su ID."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM subidas WHERE id = ?', (subida_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def registrar_parte_subida(subida_id: str, offset: int, tamano: int):
+    """Registra una parte recibida (reenviar la misma parte la reemplaza)."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO subida_partes (subida_id, offset, tamano) VALUES (?, ?, ?)
+        ''', (subida_id, offset, tamano))
+
+
+def listar_partes_subida(subida_id: str) -> list:
+    """Partes recibidas de una subida como tuplas (offset, tamano), ordenadas."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT offset, tamano FROM subida_partes WHERE subida_id = ? ORDER BY offset
+        ''', (subida_id,))
+        return [(row['offset'], row['tamano']) for row in cursor.fetchall()]
+
+
+def eliminar_subida(subida_id: str) -> bool:
+    """Elimina el registro de una subida y sus partes (no el archivo)."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM subida_partes WHERE subida_id = ?', (subida_id,))
+        cursor.execute('DELETE FROM subidas WHERE id = ?', (subida_id,))
+        return cursor.rowcount > 0
+
+
+def listar_subidas_expiradas() -> list:
+    """Subidas sin finalizar mas antiguas que FILE_RETENTION_HOURS."""
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM subidas WHERE fecha_creacion < ?', (fecha_limite,))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# =============================================================================
+# Cache de RESULTADOS de conversion
+# =============================================================================
+
+def obtener_cache_resultado(clave: str) -> dict:
+    """Obtiene una entrada de la cache de resultados por su clave."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM cache_resultados WHERE clave = ?', (clave,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def guardar_cache_resultado(clave: str, hash_archivo: str, tipo_conversion: str,
+                            parametros: str, ruta_resultado: str, mensaje: str,
+                            tamano_bytes: int, hash_resultado: str = None):
+    """Registra (o reemplaza) el resultado de una conversion en la cache."""
+    ahora = datetime.now().isoformat()
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO cache_resultados
+            (clave, hash_archivo, tipo_conversion, parametros, ruta_resultado, mensaje,
+             tamano_bytes, hash_resultado, fecha_creacion, fecha_ultimo_uso, usos)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (clave, hash_archivo, tipo_conversion, parametros, ruta_resultado, mensaje,
+              tamano_bytes, hash_resultado, ahora, ahora))
+
+
+def registrar_hash_resultado(ruta_resultado: str, hash_resultado: str):
+    """Guarda el ETag (trabajo, tamano y fecha) de un resultado en todos los registros que lo usan."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE trabajos SET hash_resultado = ? WHERE ruta_resultado = ?',
+                       (hash_resultado, ruta_resultado))
+        cursor.execute('UPDATE cache_resultados SET hash_resultado = ? WHERE ruta_resultado = ?',
+                       (hash_resultado, ruta_resultado))
+
+
+def registrar_uso_cache(clave: str):
+    """Marca una entrada de cache como recien usada (orden LRU)."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE cache_resultados SET fecha_ultimo_uso = ?, usos = usos + 1 WHERE clave = ?
+        ''', (datetime.now().isoformat(), clave))
+
+
+def eliminar_cache_resultado(clave: str) -> bool:
+    """Elimina una entrada de la cache (no borra el archivo)."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM cache_resultados WHERE clave = ?', (clave,))
+        return cursor.rowcount > 0
+
+
+def eliminar_cache_por_ruta(ruta_resultado: str) -> int:
+    """Elimina las entradas de cache que apuntan a un archivo de resultado."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM cache_resultados WHERE ruta_resultado = ?', (ruta_resultado,))
+        return cursor.rowcount
+
+
+def listar_cache_resultados() -> list:
+    """Lista las entradas de cache de la menos a la mas recientemente usada."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM cache_resultados ORDER BY fecha_ultimo_uso ASC')
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# =============================================================================
+# ESTIMACIONES de conversion a imagen
+# =============================================================================
+
+def obtener_estimacion_render(hash_archivo: str, dpi: int, formato: str) -> dict:
+    """Obtiene la estimacion cacheada de un contenido, DPI y formato."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM estimaciones_render WHERE hash_archivo = ? AND dpi = ? AND formato = ?
+        ''', (hash_archivo, dpi, formato))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def guardar_estimacion_render(hash_archivo: str, dpi: int, formato: str, bytes_por_pt2: float,
+                              segundos_por_pt2: float, segundos_por_pagina: float,
+                              paginas_muestreadas: int):
+    """Registra (o reemplaza) la estimacion de un contenido, DPI y formato."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO estimaciones_render
+            (hash_archivo, dpi, formato, bytes_por_pt2, segundos_por_pt2,
+             segundos_por_pagina, paginas_muestreadas, fecha_creacion)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (hash_archivo, dpi, formato, bytes_por_pt2, segundos_por_pt2,
+              segundos_por_pagina, paginas_muestreadas, datetime.now().isoformat()))
+
+
+def eliminar_estimaciones_expiradas() -> int:
+    """Elimina estimaciones mas antiguas que FILE_RETENTION_HOURS."""
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).isoformat()
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM estimaciones_render WHERE fecha_creacion < ?', (fecha_limite,))
+        return cursor.rowcount
+
+
+def contar_trabajos_con_resultado(ruta_resultado: str, excluir_trabajo_id: str = None) -> int:
+    """Cuenta los trabajos que apuntan a un archivo de resultado (compartido por la cache)."""
+    with obtener_conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) AS n FROM trabajos
+            WHERE ruta_resultado = ? AND id != ?
+        ''', (ruta_resultado, excluir_trabajo_id or ''))
+        return cursor.fetchone()['n']
+
+
 # =============================================================================
 # Funciones para NOTEPADS (Etapa 45)
 # =============================================================================
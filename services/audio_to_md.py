@@ -130,4 +130,4 @@ def procesar_audio_to_md(trabajo_id: str, archivo_id: str, parametros: dict) ->
     }
 
 
-job_manager.registrar_procesador('audio-to-md', procesar_audio_to_md)
+job_manager.registrar_procesador('audio-to-md', procesar_audio_to_md, max_concurrentes=1)
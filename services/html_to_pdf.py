@@ -303,7 +303,19 @@ def convertir_url_a_pdf(url: str, opciones: Dict, trabajo_id: str) -> Path:
         # WeasyPrint 60+ API: stylesheets van a render(), no a write_pdf()
         html.render(stylesheets=[css]).write_pdf(str(ruta_salida))
 
-    # Ejecutar WeasyPrint en un hilo separado con timeout total.
+    if job_manager.en_proceso_hijo():
+        # Dentro del proceso hijo del trabajo el job_manager impone TIMEOUT_TOTAL
+        # y termina el proceso si se excede: no hace falta un hilo que quede
+        # consumiendo CPU despues del timeout.
+        try:
+            _renderizar()
+        except Exception as e:
+            logger.error(f"Error al convertir HTML a PDF: {e}")
+            raise ValueError(f"Error al generar PDF: {str(e)}")
+        job_manager.actualizar_progreso(trabajo_id, 95, "Finalizando")
+        return ruta_salida
+
+    # Sin backend de procesos: ejecutar WeasyPrint en un hilo separado con timeout total.
     # IMPORTANTE: NO usar "with executor:" porque su __exit__ llama shutdown(wait=True),
     # que bloquea esperando al thread aunque el timeout ya haya expirado.
     # En su lugar, llamar shutdown(wait=False) manualmente para liberar el control.
@@ -414,4 +426,5 @@ def procesar_from_html(trabajo_id: str, archivo_id: str, parametros: dict) -> di
 
 
 # Registrar el procesador en el job_manager
-job_manager.registrar_procesador('from_html', procesar_from_html)
+job_manager.registrar_procesador('from_html', procesar_from_html, en_proceso=True,
+                                 timeout_seg=TIMEOUT_TOTAL)
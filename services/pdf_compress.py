@@ -712,4 +712,4 @@ def procesar_compress(trabajo_id: str, archivo_id: str, parametros: dict) -> dic
     }
 
 
-job_manager.registrar_procesador('compress', procesar_compress)
+job_manager.registrar_procesador('compress', procesar_compress, max_concurrentes=2, en_proceso=True)
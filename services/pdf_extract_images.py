@@ -12,7 +12,7 @@ Metodo de deteccion doble:
 import logging
 import re
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List
 from io import BytesIO
 
 import fitz  # PyMuPDF
@@ -20,7 +20,8 @@ from PIL import Image
 
 import config
 import models
-from utils import file_manager, job_manager
+from utils import job_manager
+from utils.zip_salida import ZipSalida
 
 logger = logging.getLogger(__name__)
 
@@ -140,19 +141,22 @@ def extraer_imagenes_pdf(
     ruta_pdf: Path,
     opciones: Dict,
     trabajo_id: str,
+    zip_salida: ZipSalida,
     nombre_original: str = None
-) -> List[Tuple[Path, str]]:
+) -> List[str]:
     """
     Extrae todas las imagenes de un PDF usando deteccion doble (paginas + xref scan).
+    Cada imagen se escribe directamente en el ZIP de resultado.
 
     Args:
         ruta_pdf: Ruta al archivo PDF
         opciones: {formato_salida, tamano_minimo_px, imagenes_seleccionadas}
         trabajo_id: ID del trabajo para actualizar progreso
+        zip_salida: ZIP de resultado
         nombre_original: Nombre original del archivo (con extension)
 
     Returns:
-        Lista de tuplas (ruta_imagen_guardada, nombre_para_el_zip)
+        Lista de nombres de las imagenes en el ZIP
     """
     formato_salida = opciones.get('formato_salida', 'original')
     tamano_minimo = opciones.get('tamano_minimo_px', 50)
@@ -213,22 +217,21 @@ def extraer_imagenes_pdf(
             padding = len(str(total_candidatos))
             nombre_imagen = str(contador_imagen).zfill(padding)
             nombre_archivo = f"{nombre_base} - imagen {nombre_imagen}.{ext}"
-            ruta_imagen = config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_archivo}"
 
             # Guardar imagen, convirtiendo formato si se solicita
             if formato_salida != 'original' and ext != ext_original:
                 img_pil = Image.open(BytesIO(img_bytes))
                 if ext == 'jpg' and img_pil.mode in ('RGBA', 'LA', 'P'):
                     img_pil = img_pil.convert('RGB')
+                buffer = BytesIO()
                 if ext == 'jpg':
-                    img_pil.save(str(ruta_imagen), 'JPEG', quality=85)
+                    img_pil.save(buffer, 'JPEG', quality=85)
                 else:
-                    img_pil.save(str(ruta_imagen), 'PNG')
-            else:
-                with open(ruta_imagen, 'wb') as f:
-                    f.write(img_bytes)
+                    img_pil.save(buffer, 'PNG')
+                img_bytes = buffer.getvalue()
 
-            imagenes_extraidas.append((ruta_imagen, nombre_archivo))
+            zip_salida.escribir(nombre_archivo, img_bytes)
+            imagenes_extraidas.append(nombre_archivo)
             logger.info(f"Imagen extraida: {nombre_archivo} ({ancho}x{alto}px, {ext_original})")
 
         except Exception as e:
@@ -256,26 +259,17 @@ def procesar_extract_images(trabajo_id: str, archivo_id: str, parametros: dict)
     nombre_original = archivo['nombre_original']
     job_manager.actualizar_progreso(trabajo_id, 2, "Iniciando extraccion de imagenes")
 
-    imagenes = extraer_imagenes_pdf(ruta_pdf, parametros, trabajo_id, nombre_original)
-
-    if not imagenes:
-        raise ValueError("No se encontraron imagenes en el documento (o todas son demasiado pequenas)")
-
-    job_manager.actualizar_progreso(trabajo_id, 92, "Comprimiendo archivos")
-
     nombre_base = Path(archivo['nombre_original']).stem
     nombre_zip = f"{trabajo_id}_{nombre_base}_imagenes.zip"
 
-    archivos_para_zip = [(str(ruta), nombre) for ruta, nombre in imagenes]
-    ruta_zip = file_manager.crear_zip(archivos_para_zip, nombre_zip)
+    with ZipSalida(config.OUTPUT_FOLDER / nombre_zip) as zs:
+        imagenes = extraer_imagenes_pdf(ruta_pdf, parametros, trabajo_id, zs, nombre_original)
 
-    # Limpiar temporales
-    for ruta, _ in imagenes:
-        if ruta.exists():
-            ruta.unlink()
+        if not imagenes:
+            raise ValueError("No se encontraron imagenes en el documento (o todas son demasiado pequenas)")
 
     return {
-        'ruta_resultado': str(ruta_zip),
+        'ruta_resultado': str(zs.ruta),
         'mensaje': f'{len(imagenes)} imagenes extraidas'
     }
 
@@ -327,4 +321,4 @@ def obtener_conteo_imagenes(archivo_id: str) -> dict:
 
 
 # Registrar el procesador en el job_manager
-job_manager.registrar_procesador('extract-images', procesar_extract_images)
+job_manager.registrar_procesador('extract-images', procesar_extract_images, en_proceso=True)
@@ -416,4 +416,4 @@ def procesar_scanned_to_csv(trabajo_id: str, archivo_id: str, parametros: dict)
 
 
 # Registrar procesador
-job_manager.registrar_procesador('to-csv-ocr', procesar_scanned_to_csv)
+job_manager.registrar_procesador('to-csv-ocr', procesar_scanned_to_csv, max_concurrentes=2)
@@ -13,7 +13,8 @@ import fitz  # PyMuPDF
 
 import config
 import models
-from utils import file_manager, job_manager
+from utils import job_manager
+from utils.zip_salida import ZipSalida
 
 logger = logging.getLogger(__name__)
 
@@ -109,9 +110,10 @@ def calcular_cortes_iguales(num_paginas: int, num_partes: int) -> List[Dict]:
 
 
 def ejecutar_corte(ruta_pdf: Path, cortes: List[Dict], trabajo_id: str,
-                   nombre_base: str, num_paginas_total: int) -> List[Path]:
+                   nombre_base: str, num_paginas_total: int,
+                   zip_salida: ZipSalida) -> List[str]:
     """
-    Ejecuta los cortes en el PDF.
+    Ejecuta los cortes en el PDF, escribiendo cada parte en el ZIP de resultado.
 
     Args:
         ruta_pdf: Ruta al archivo PDF original
@@ -119,9 +121,10 @@ def ejecutar_corte(ruta_pdf: Path, cortes: List[Dict], trabajo_id: str,
         trabajo_id: ID del trabajo para reportar progreso
         nombre_base: Nombre base del archivo (sin extension)
         num_paginas_total: Numero total de paginas para calcular padding
+        zip_salida: ZIP de resultado
 
     Returns:
-        Lista de rutas a los PDFs generados
+        Lista de nombres de los PDFs generados
     """
     archivos_generados = []
 
@@ -160,11 +163,10 @@ def ejecutar_corte(ruta_pdf: Path, cortes: List[Dict], trabajo_id: str,
 
             # Nombre formato: "NombreOriginal - pag. 001 - 056.pdf"
             nombre_archivo = f"{nombre_base} - pag. {inicio_str} - {fin_str}.pdf"
-            ruta_salida = config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_archivo}"
-            nuevo_doc.save(str(ruta_salida))
+            zip_salida.escribir(nombre_archivo, nuevo_doc.tobytes())
             nuevo_doc.close()
 
-            archivos_generados.append((ruta_salida, nombre_archivo))
+            archivos_generados.append(nombre_archivo)
             logger.info(f"Corte generado: {nombre_archivo} ({corte['fin'] - corte['inicio'] + 1} paginas)")
 
         doc.close()
@@ -172,10 +174,6 @@ def ejecutar_corte(ruta_pdf: Path, cortes: List[Dict], trabajo_id: str,
 
     except Exception as e:
         logger.error(f"Error ejecutando cortes: {e}")
-        # Limpiar archivos parciales
-        for archivo, _ in archivos_generados:
-            if archivo.exists():
-                archivo.unlink()
         raise
 
 
@@ -220,28 +218,14 @@ def procesar_split(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
 
     job_manager.actualizar_progreso(trabajo_id, 5, f"Preparando {len(cortes)} cortes")
 
-    # Ejecutar cortes (devuelve lista de tuplas: (ruta_archivo, nombre_para_zip))
-    archivos_generados = ejecutar_corte(ruta_pdf, cortes, trabajo_id, nombre_base, num_paginas)
-
-    # Crear ZIP con los resultados
-    job_manager.actualizar_progreso(trabajo_id, 95, "Comprimiendo archivos")
-
+    # Ejecutar cortes escribiendo cada parte directamente en el ZIP
     nombre_zip = f"{trabajo_id}_{nombre_base}_cortes.zip"
 
-    # archivos_generados es lista de tuplas (ruta_fisica, nombre_en_zip)
-    archivos_para_zip = [
-        (str(ruta), nombre) for ruta, nombre in archivos_generados
-    ]
-
-    ruta_zip = file_manager.crear_zip(archivos_para_zip, nombre_zip)
-
-    # Limpiar archivos individuales (solo dejamos el ZIP)
-    for ruta_temp, _ in archivos_generados:
-        if ruta_temp.exists():
-            ruta_temp.unlink()
+    with ZipSalida(config.OUTPUT_FOLDER / nombre_zip) as zs:
+        ejecutar_corte(ruta_pdf, cortes, trabajo_id, nombre_base, num_paginas, zs)
 
     return {
-        'ruta_resultado': str(ruta_zip),
+        'ruta_resultado': str(zs.ruta),
         'mensaje': f'{len(cortes)} cortes generados correctamente'
     }
 
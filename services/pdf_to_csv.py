@@ -253,7 +253,9 @@ def _find_tables_con_timeout(page, timeout_seg: int = TIMEOUT_PAGINA_SEG):
 
     Si la pagina supera el tiempo limite (e.g. paginas con celdas muy complejas
     que disparan O(n^2) en el algoritmo de interseccion), retorna None.
-    El thread interno queda como daemon y se limpia al salir el proceso.
+    El thread interno queda como daemon hasta que termina el proceso hijo del
+    trabajo; el job_manager aplica ademas el limite duro de tiempo y memoria
+    del trabajo completo (JOB_TIMEOUT_SEG / JOB_MAX_RSS_MB).
 
     Returns:
         Objeto TableFinder de fitz, o None si hubo timeout.
@@ -1121,4 +1123,4 @@ def _escribir_csv_temp(
 # ---------------------------------------------------------------------------
 # Registro del procesador en job_manager
 # ---------------------------------------------------------------------------
-job_manager.registrar_procesador('to-csv', procesar_to_csv)
+job_manager.registrar_procesador('to-csv', procesar_to_csv, max_concurrentes=2, en_proceso=True)
@@ -396,4 +396,4 @@ def obtener_preview_docx(archivo_id: str) -> dict:
 
 
 # Registrar el procesador en el job_manager
-job_manager.registrar_procesador('to-docx', procesar_to_docx)
+job_manager.registrar_procesador('to-docx', procesar_to_docx, max_concurrentes=2, en_proceso=True)
@@ -1,20 +1,35 @@
 # -*- coding: utf-8 -*-
 """
-Servicio de conversion de PDF a imagenes (PNG/JPG) para PDFexport.
+Servicio de conversion de PDF a imagenes (PNG/JPG/WebP/AVIF/TIFF) para PDFexport.
 Usa PyMuPDF (fitz) para el rendering — sin dependencia de poppler,
 sin riesgo de cuelgues en paginas problematicas.
+
+PNG, JPG, WebP y AVIF generan un ZIP con una imagen por pagina; TIFF
+genera un unico archivo multipagina donde cada pagina se guarda como
+bitonal G4, grises o color deflate segun su contenido.
 """
 
 import logging
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
 from pathlib import Path
 from typing import Dict, List, Tuple
 
 import fitz  # PyMuPDF
 from PIL import Image as PILImage
+from PIL import ImageChops, TiffImagePlugin
 
 import config
 import models
-from utils import file_manager, job_manager
+from utils import file_manager, job_manager, render_bandas
+from utils.zip_salida import ZipSalida
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +41,45 @@ DPI_OPCIONES = {
     600: 'Muy Alta (600 DPI)'
 }
 
+# Calidad por defecto de los formatos con perdida
+CALIDAD_DEFECTO = {'jpg': 85, 'webp': 80, 'avif': 60}
+
+# Formatos que se renderizan por franjas cuando la pagina es enorme
+FORMATOS_BANDAS = ('png', 'jpg', 'tif')
+
+# Modos de color de to-tiff ('auto' decide por pagina)
+MODOS_COLOR = ('auto', 'color', 'gris', 'bitonal')
+
+# Dimension maxima de un WebP
+MAXIMO_WEBP = 16383
+
+# Formatos de salida de las conversiones a imagen
+FORMATOS = ('png', 'jpg', 'webp', 'avif', 'tif')
+
+# Tamano maximo de lo que se renderiza por pagina muestreada al estimar, y
+# en cuantas franjas se reparte (a distintas alturas, para no sesgar la
+# muestra hacia una zona densa o vacia de la pagina)
+MEGAPIXELES_MUESTRA = 2
+FRANJAS_POR_PAGINA = 4
+
+# Al encolar sin una estimacion cacheada no se muestrea en la peticion: el
+# costo se aproxima con MB de salida por pagina a 150 DPI (escalado por
+# DPI^2) y el muestreo se hace en segundo plano para los siguientes
+MB_POR_PAGINA_150_DPI = 0.5
+_muestreador = ThreadPoolExecutor(max_workers=1, thread_name_prefix='estimaciones')
+_muestreos_pendientes = set()
+_lock_muestreos = threading.Lock()
+
+# AVIF: nativo desde Pillow 11.3; antes lo registra pillow-avif-plugin
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+PILImage.init()
+AVIF_DISPONIBLE = 'AVIF' in PILImage.SAVE
+if not AVIF_DISPONIBLE:
+    logger.info("Codificador AVIF no disponible: la conversion a AVIF no funcionara.")
+
 
 def parsear_paginas(paginas_str: str, total_paginas: int) -> List[int]:
     """
@@ -72,123 +126,390 @@ def parsear_paginas(paginas_str: str, total_paginas: int) -> List[int]:
     return sorted(list(paginas))
 
 
-def estimar_tamano(num_paginas: int, dpi: int, formato: str = 'png') -> int:
-    """
-    Estima el tamano aproximado del resultado.
+def _verificar_avif():
+    """Verifica que Pillow puede codificar AVIF antes de usarlo."""
+    if not AVIF_DISPONIBLE:
+        raise ValueError(
+            "AVIF no esta disponible en este sistema. "
+            "Requiere Pillow >= 11.3 o el paquete pillow-avif-plugin."
+        )
 
-    Args:
-        num_paginas: Numero de paginas a convertir
-        dpi: DPI de salida
-        formato: 'png' o 'jpg'
+
+def _verificar_webp(rect: fitz.Rect, matriz: fitz.Matrix):
+    """Verifica, antes de renderizar, que la pagina entra en el maximo de WebP."""
+    limite = (fitz.Rect(rect) * matriz).irect
+    if max(limite.width, limite.height) > MAXIMO_WEBP:
+        raise ValueError(f"La pagina ({limite.width}x{limite.height} px) supera el maximo de "
+                         f"WebP ({MAXIMO_WEBP} px por lado); use menos DPI")
+
+
+def _es_blanco_o_negro(color: tuple) -> bool:
+    """True para negro o blanco puros en gris, RGB o CMYK."""
+    if len(color) == 4:  # CMYK: negro es K=1, blanco es todo 0
+        return (color[3] == 1 and not any(color[:3])) or not any(color)
+    return all(c == 0 for c in color) or all(c == 1 for c in color)
+
+
+def _contenido_bitonal(pagina: fitz.Page) -> bool:
+    """
+    True si la pagina solo tiene texto y trazos negros o blancos opacos e
+    imagenes de 1 bit (texto, planos de linea, escaneos bitonales). El
+    antialiasing del render llena de grises los bordes, asi que la decision
+    se toma sobre el contenido y no sobre los pixeles.
+    """
+    if pagina.first_annot is not None:
+        return False
+    for imagen in pagina.get_image_info():
+        if imagen['bpc'] != 1 or imagen['colorspace'] > 1:
+            return False
+    for trazo in pagina.get_drawings():
+        for clave in ('color', 'fill'):
+            if trazo.get(clave) is not None and not _es_blanco_o_negro(trazo[clave]):
+                return False
+        if (trazo.get('fill_opacity') or 1) < 1 or (trazo.get('stroke_opacity') or 1) < 1:
+            return False
+    for span in pagina.get_texttrace():
+        if span['opacity'] < 1 or not _es_blanco_o_negro(span['color']):
+            return False
+    return True
+
+
+def _es_gris(img: PILImage.Image) -> bool:
+    """True si todos los pixeles tienen R == G == B."""
+    r, g, b = img.split()
+    return ImageChops.difference(r, g).getbbox() is None and \
+        ImageChops.difference(g, b).getbbox() is None
+
+
+def _modo_tiff(pagina: fitz.Page, img: PILImage.Image, modo_color: str) -> str:
+    """Modo Pillow de la pagina en el TIFF: '1' (G4), 'L' o 'RGB'."""
+    if modo_color == 'auto':
+        if not _es_gris(img):
+            return 'RGB'
+        return '1' if _contenido_bitonal(pagina) else 'L'
+    return {'color': 'RGB', 'gris': 'L', 'bitonal': '1'}[modo_color]
+
+
+def _modo_tiff_bandas(pagina: fitz.Page, zoom: float, modo_color: str) -> str:
+    """
+    _modo_tiff para una pagina que se renderiza por franjas. 'auto' revisa
+    el color en un render reducido a RENDER_MAX_MEGAPIXELES, tambien por
+    franjas: a esa resolucion cualquier trazo de color sigue tinendo pixeles.
+    """
+    if modo_color != 'auto':
+        return _modo_tiff(pagina, None, modo_color)
+    # El contenido bitonal (solo negro y blanco) no puede dar pixeles de color
+    if _contenido_bitonal(pagina):
+        return '1'
+    reduccion = min(1.0, math.sqrt(config.RENDER_MAX_MEGAPIXELES
+                                   / render_bandas.megapixeles(pagina, zoom)))
+    return 'L' if render_bandas.es_gris(pagina, zoom * reduccion) else 'RGB'
+
+
+def _codificar_pagina(pagina: fitz.Page, matriz: fitz.Matrix, formato: str,
+                      codificacion: dict, clip: fitz.Rect = None,
+                      lista: fitz.DisplayList = None) -> Tuple[bytes, float]:
+    """
+    Renderiza una pagina (o solo el area clip, desde su display list si se
+    da) y la codifica en el formato pedido. Para TIFF se genera un TIFF de
+    una pagina que luego se agrega al multipagina.
 
     Returns:
-        Tamano estimado en bytes
+        (bytes de la imagen, segundos de codificacion)
+    """
+    pix = (lista or pagina).get_pixmap(matrix=matriz, alpha=False, clip=clip)
+    inicio = time.perf_counter()
+
+    if formato == 'png':
+        # PNG: codificar directamente con PyMuPDF (mas rapido)
+        return pix.tobytes('png'), time.perf_counter() - inicio
+
+    # Pillow lee el buffer del pixmap sin copiarlo (pix.samples copia la
+    # pagina entera). El encoder de MuPDF (tobytes('jpeg')) es bastante mas
+    # lento que libjpeg-turbo de Pillow, por eso no se usa.
+    img_pil = PILImage.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv,
+                                  "raw", "RGB", pix.stride, 1)
+    buffer = BytesIO()
+    calidad = codificacion['calidad']
+
+    if formato == 'jpg':
+        # optimize: tablas Huffman a medida, archivos mas chicos pero una
+        # pasada extra sobre la imagen; solo si se pide
+        img_pil.save(buffer, 'JPEG', quality=calidad, optimize=codificacion['optimizar'])
+    elif formato == 'webp':
+        # Sin perdida, quality es el esfuerzo de compresion (no la fidelidad)
+        img_pil.save(buffer, 'WEBP', quality=calidad, lossless=codificacion['sin_perdida'])
+    elif formato == 'avif':
+        img_pil.save(buffer, 'AVIF', quality=calidad)
+    else:
+        dpi = round(matriz.a * 72)
+        modo = _modo_tiff(pagina, img_pil, codificacion['modo_color'])
+        if modo == '1':
+            # Umbral fijo al 50%: sin tramado, el texto queda nitido
+            img_pil = img_pil.convert('L').convert('1', dither=PILImage.Dither.NONE)
+            img_pil.save(buffer, 'TIFF', compression='group4', dpi=(dpi, dpi))
+        else:
+            img_pil.convert(modo).save(buffer, 'TIFF', compression='tiff_adobe_deflate',
+                                       dpi=(dpi, dpi))
+
+    return buffer.getvalue(), time.perf_counter() - inicio
+
+
+def _opciones_codificacion(opciones: Dict, formato: str) -> dict:
+    """Parametros del codec tomados de las opciones de conversion."""
+    codificacion = {
+        'calidad': int(opciones.get('calidad', CALIDAD_DEFECTO.get(formato, 0))),
+        'optimizar': bool(opciones.get('optimizar', False)),  # Solo para JPG
+        'sin_perdida': bool(opciones.get('sin_perdida', False)),  # Solo para WebP
+        'modo_color': opciones.get('modo_color', 'auto'),  # Solo para TIFF
+    }
+    if codificacion['modo_color'] not in MODOS_COLOR:
+        raise ValueError(f"modo_color invalido: {codificacion['modo_color']} "
+                         f"(opciones: {', '.join(MODOS_COLOR)})")
+    return codificacion
+
+
+class _TiffMultipagina:
     """
-    # Estimacion basada en tamano promedio de pagina A4
-    # A 150 DPI, una pagina A4 en PNG es aproximadamente 1.5MB
-    base_size_png = 1.5 * 1024 * 1024  # 1.5 MB base a 150 DPI
+    Resultado de to-tiff: cada pagina llega como un TIFF de una pagina ya
+    comprimido y se agrega como un frame mas del archivo, sin recodificar.
+    Misma interfaz que ZipSalida para convertir_pdf_a_imagenes.
+
+    Si el bloque termina con una excepcion el TIFF parcial se elimina.
+    """
+
+    def __init__(self, ruta: Path):
+        self.ruta = Path(ruta)
+        self._archivo = open(self.ruta, 'w+b')
+        self._tiff = TiffImagePlugin.AppendingTiffWriter(self._archivo, new=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        self._tiff.close()
+        if tipo_exc is not None:
+            self.ruta.unlink(missing_ok=True)
+        return False
 
-    # Ajustar por DPI (escala cuadratica)
-    factor_dpi = (dpi / 150) ** 2
+    def escribir(self, nombre: str, datos: bytes):
+        self._tiff.write(datos)
+        self._tiff.newFrame()
 
-    # JPG es aproximadamente 70% mas pequeno
-    factor_formato = 0.3 if formato == 'jpg' else 1.0
+    @contextmanager
+    def abrir(self, nombre: str):
+        """Frame escrito en streaming (render por bandas); se cierra al salir del bloque."""
+        yield self._tiff
+        self._tiff.newFrame()
 
-    tamano_por_pagina = base_size_png * factor_dpi * factor_formato
 
-    return int(tamano_por_pagina * num_paginas)
+# Documento abierto por cada proceso del pool de render (uno por proceso,
+# reutilizado por todos los lotes que ese proceso recibe)
+_doc_proceso = None
+
+
+def _iniciar_proceso_render(ruta_pdf: str):
+    global _doc_proceso
+    _doc_proceso = fitz.open(ruta_pdf)
+
+
+def _renderizar(doc: fitz.Document, num_pagina: int, matriz: fitz.Matrix, formato: str,
+                codificacion: dict) -> tuple:
+    """
+    (num_pagina, bytes, error, segundos de codificacion). Las paginas que
+    requieren render por bandas vuelven sin bytes ni error: las escribe por
+    franjas el proceso que tiene el ZIP.
+    """
+    try:
+        pagina = doc.load_page(num_pagina - 1)
+        if formato == 'webp':
+            _verificar_webp(pagina.rect, matriz)
+        if render_bandas.requiere_bandas(pagina, matriz.a):
+            if formato in FORMATOS_BANDAS:
+                return num_pagina, None, None, 0.0
+            # WebP y AVIF no tienen escritor por franjas: el pixmap entero
+            # ocuparia varios GB, se rechaza antes de renderizarlo
+            raise ValueError(
+                f"La pagina ({render_bandas.megapixeles(pagina, matriz.a):.0f} megapixeles) "
+                f"supera RENDER_MAX_MEGAPIXELES y {formato.upper()} no se renderiza por "
+                f"franjas; use menos DPI u otro formato")
+        datos, segundos = _codificar_pagina(pagina, matriz, formato, codificacion)
+        return num_pagina, datos, None, segundos
+    except Exception as e:
+        return num_pagina, None, str(e), 0.0
+
+
+def _renderizar_lote(paginas: List[int], dpi: int, formato: str, codificacion: dict) -> list:
+    """Tarea del pool: renderiza un lote de paginas con el documento del proceso."""
+    matriz = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    return [_renderizar(_doc_proceso, num_pagina, matriz, formato, codificacion)
+            for num_pagina in paginas]
+
+
+def _paginas_en_serie(ruta_pdf: Path, paginas: List[int], dpi: int, formato: str,
+                      codificacion: dict):
+    """Genera (num_pagina, bytes, error, segundos) renderizando en este proceso."""
+    matriz = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    doc = fitz.open(str(ruta_pdf))
+    try:
+        for num_pagina in paginas:
+            yield _renderizar(doc, num_pagina, matriz, formato, codificacion)
+    finally:
+        doc.close()
+
+
+def _paginas_en_paralelo(ruta_pdf: Path, paginas: List[int], dpi: int, formato: str,
+                         codificacion: dict, procesos: int):
+    """
+    Genera (num_pagina, bytes, error, segundos) en el orden de paginas, renderizando
+    lotes de RENDER_CHUNK_PAGES en un pool de procesos. Solo hay 2 lotes
+    por proceso en vuelo, asi la memoria no crece con el largo del documento.
+    """
+    lotes = [paginas[i:i + config.RENDER_CHUNK_PAGES]
+             for i in range(0, len(paginas), config.RENDER_CHUNK_PAGES)]
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+    with ProcessPoolExecutor(max_workers=procesos,
+                             mp_context=multiprocessing.get_context(metodo),
+                             initializer=_iniciar_proceso_render,
+                             initargs=(str(ruta_pdf),)) as pool:
+        pendientes = deque()
+        siguientes = iter(lotes)
+        for lote in siguientes:
+            pendientes.append(pool.submit(_renderizar_lote, lote, dpi, formato, codificacion))
+            if len(pendientes) >= procesos * 2:
+                break
+        while pendientes:
+            yield from pendientes.popleft().result()
+            lote = next(siguientes, None)
+            if lote is not None:
+                pendientes.append(pool.submit(_renderizar_lote, lote, dpi, formato, codificacion))
+
+
+def _procesos_render(num_paginas: int) -> int:
+    """Procesos de render para un documento (<= 1: en serie)."""
+    # Un pool solo compensa su arranque si cada proceso recibe al menos un lote
+    return min(config.RENDER_PROCESSES, num_paginas // config.RENDER_CHUNK_PAGES)
 
 
 def convertir_pdf_a_imagenes(
     ruta_pdf: Path,
     opciones: Dict,
     trabajo_id: str,
+    salida: ZipSalida,
     formato: str = 'png',
     nombre_original: str = None
-) -> List[Tuple[Path, str]]:
+) -> Tuple[List[str], float]:
     """
     Convierte un PDF a imagenes usando PyMuPDF (sin poppler).
+    Cada imagen se escribe directamente en el resultado (ZIP, o TIFF
+    multipagina), en orden de pagina. Con RENDER_PROCESSES > 1 las paginas se renderizan en
+    paralelo en un pool de procesos, cada uno con su propio documento.
 
     Args:
         ruta_pdf: Ruta al archivo PDF
-        opciones: Opciones de conversion (dpi, paginas, calidad_jpg)
+        opciones: Opciones de conversion (dpi, paginas, calidad, optimizar,
+                  sin_perdida, modo_color)
         trabajo_id: ID del trabajo para progreso
-        formato: 'png' o 'jpg'
+        salida: ZipSalida (o _TiffMultipagina para 'tif') donde se escriben las imagenes
+        formato: 'png', 'jpg', 'webp', 'avif' o 'tif'
         nombre_original: Nombre original del archivo (con extension)
 
     Returns:
-        Lista de tuplas (ruta_imagen, nombre_archivo)
+        (nombres de las imagenes generadas, ms promedio de codificacion por pagina)
     """
     dpi = opciones.get('dpi', 150)
     paginas_str = opciones.get('paginas', 'all')
-    calidad_jpg = opciones.get('calidad', 85)  # Solo para JPG
-
-    # PyMuPDF usa una matriz de escala; 72 pt = 1 unidad PDF
-    # factor = dpi / 72 convierte a la resolucion deseada
-    factor = dpi / 72.0
-    matriz = fitz.Matrix(factor, factor)
+    codificacion = _opciones_codificacion(opciones, formato)
 
     doc = fitz.open(str(ruta_pdf))
     total_paginas = len(doc)
+    doc.close()
 
     # Parsear paginas a convertir
     paginas = parsear_paginas(paginas_str, total_paginas)
     num_paginas = len(paginas)
 
+    procesos = _procesos_render(num_paginas)
+
     job_manager.actualizar_progreso(
         trabajo_id, 5,
         f"Preparando conversion de {num_paginas} paginas a {formato.upper()} ({dpi} DPI)"
+        + (f" en {procesos} procesos" if procesos > 1 else "")
     )
 
+    if procesos > 1:
+        renderizadas = _paginas_en_paralelo(ruta_pdf, paginas, dpi, formato, codificacion,
+                                            procesos)
+    else:
+        renderizadas = _paginas_en_serie(ruta_pdf, paginas, dpi, formato, codificacion)
+
     imagenes_generadas = []
     nombre_base = nombre_original if nombre_original else ruta_pdf.name
     padding = len(str(total_paginas))
 
-    for i, num_pagina in enumerate(paginas):
-        progreso = 10 + int((i / num_paginas) * 80)
+    segundos_codificacion = 0.0
+    doc_bandas = None
+
+    for i, (num_pagina, datos, error, segundos) in enumerate(renderizadas):
+        if error is not None:
+            # Continuar con las demas paginas
+            logger.error(f"Error convirtiendo pagina {num_pagina}: {error}")
+            continue
+
+        # Nombre de salida con padding
+        nombre_pagina = str(num_pagina).zfill(padding)
+        nombre_archivo = f"{nombre_base} - pagina {nombre_pagina}.{formato}"
+
+        if datos is None:
+            # Pagina enorme: se renderiza por franjas directo al ZIP. Un error
+            # a mitad de la imagen deja el miembro incompleto: falla el trabajo.
+            if doc_bandas is None:
+                doc_bandas = fitz.open(str(ruta_pdf))
+            pagina = doc_bandas.load_page(num_pagina - 1)
+            zoom = dpi / 72.0
+            logger.info(f"Pagina {num_pagina}: {render_bandas.megapixeles(pagina, zoom):.0f} "
+                        f"megapixeles, render por franjas")
+            inicio = time.perf_counter()
+            with salida.abrir(nombre_archivo) as destino:
+                if formato == 'jpg':
+                    # Las franjas comparten las tablas Huffman estandar: sin optimize
+                    if codificacion['optimizar']:
+                        logger.info(f"Pagina {num_pagina}: 'optimizar' no aplica al JPEG "
+                                    f"por franjas, se usan las tablas estandar")
+                    render_bandas.escribir_jpeg(pagina, zoom, destino, codificacion['calidad'])
+                elif formato == 'tif':
+                    modo = _modo_tiff_bandas(pagina, zoom, codificacion['modo_color'])
+                    render_bandas.escribir_tiff(pagina, zoom, destino, modo)
+                else:
+                    render_bandas.escribir_png(pagina, zoom, destino)
+            segundos = time.perf_counter() - inicio
+        else:
+            salida.escribir(nombre_archivo, datos)
+        imagenes_generadas.append(nombre_archivo)
+        segundos_codificacion += segundos
+        logger.debug(f"Pagina {num_pagina} convertida: {nombre_archivo} "
+                     f"(codificacion {segundos * 1000:.0f} ms)")
+
+        progreso = 10 + int(((i + 1) / num_paginas) * 80)
         job_manager.actualizar_progreso(
             trabajo_id, progreso,
-            f"Convirtiendo pagina {num_pagina} de {total_paginas}"
+            f"Convirtiendo pagina {num_pagina} de {total_paginas} "
+            f"(codificacion {segundos * 1000:.0f} ms)"
         )
 
-        try:
-            # Renderizar pagina con PyMuPDF (0-indexed)
-            pagina = doc.load_page(num_pagina - 1)
-            pix = pagina.get_pixmap(matrix=matriz, alpha=False)
-
-            # Nombre de salida con padding
-            nombre_pagina = str(num_pagina).zfill(padding)
-            nombre_archivo = f"{nombre_base} - pagina {nombre_pagina}.{formato}"
-            ruta_imagen = config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_archivo}"
-
-            if formato == 'jpg':
-                # Convertir pixmap a Pillow para guardar como JPEG con calidad
-                img_pil = PILImage.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                img_pil.save(str(ruta_imagen), 'JPEG', quality=calidad_jpg, optimize=True)
-            else:
-                # PNG: guardar directamente con PyMuPDF (mas rapido)
-                pix.save(str(ruta_imagen))
-
-            imagenes_generadas.append((ruta_imagen, nombre_archivo))
-            logger.debug(f"Pagina {num_pagina} convertida: {nombre_archivo}")
+    if doc_bandas is not None:
+        doc_bandas.close()
 
-        except Exception as e:
-            logger.error(f"Error convirtiendo pagina {num_pagina}: {e}")
-            # Continuar con las demas paginas
+    ms_por_pagina = segundos_codificacion * 1000 / max(len(imagenes_generadas), 1)
+    return imagenes_generadas, ms_por_pagina
 
-    doc.close()
-    return imagenes_generadas
 
-
-def procesar_to_png(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+def _procesar_a_imagenes(trabajo_id: str, archivo_id: str, parametros: dict,
+                         formato: str) -> dict:
     """
-    Procesador principal de conversion PDF a PNG.
-    Esta funcion es llamada por el job_manager.
-
-    Args:
-        trabajo_id: ID del trabajo
-        archivo_id: ID del archivo a procesar
-        parametros: Opciones de conversion
+    Convierte el PDF de un trabajo a imagenes del formato dado: un ZIP con
+    una imagen por pagina, o un unico TIFF multipagina para 'tif'.
 
     Returns:
         dict con ruta_resultado y mensaje
@@ -203,37 +524,35 @@ def procesar_to_png(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
         raise ValueError("Archivo fisico no encontrado")
 
     nombre_original = archivo['nombre_original']
-    job_manager.actualizar_progreso(trabajo_id, 2, "Iniciando conversion a PNG")
-
-    # Convertir
-    imagenes = convertir_pdf_a_imagenes(ruta_pdf, parametros, trabajo_id, 'png', nombre_original)
-
-    if not imagenes:
-        raise ValueError("No se generaron imagenes")
-
-    job_manager.actualizar_progreso(trabajo_id, 92, "Comprimiendo archivos")
+    etiqueta = {'tif': 'TIFF', 'webp': 'WebP'}.get(formato, formato.upper())
+    job_manager.actualizar_progreso(trabajo_id, 2, f"Iniciando conversion a {etiqueta}")
 
-    # Crear ZIP
+    # Convertir escribiendo cada pagina directamente en el resultado
     nombre_base = Path(archivo['nombre_original']).stem
-    nombre_zip = f"{trabajo_id}_{nombre_base}_png.zip"
-
-    archivos_para_zip = [(str(ruta), nombre) for ruta, nombre in imagenes]
-    ruta_zip = file_manager.crear_zip(archivos_para_zip, nombre_zip)
-
-    # Limpiar archivos temporales
-    for ruta, _ in imagenes:
-        if ruta.exists():
-            ruta.unlink()
-
+    if formato == 'tif':
+        salida = _TiffMultipagina(config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_base}.tif")
+    else:
+        salida = ZipSalida(config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_base}_{formato}.zip")
+
+    with salida:
+        imagenes, ms_por_pagina = convertir_pdf_a_imagenes(ruta_pdf, parametros, trabajo_id, salida,
+                                                           formato, nombre_original)
+        if not imagenes:
+            raise ValueError("No se generaron imagenes")
+
+    if formato == 'tif':
+        mensaje = f'TIFF de {len(imagenes)} paginas generado'
+    else:
+        mensaje = f'{len(imagenes)} imagenes {etiqueta} generadas'
     return {
-        'ruta_resultado': str(ruta_zip),
-        'mensaje': f'{len(imagenes)} imagenes PNG generadas'
+        'ruta_resultado': str(salida.ruta),
+        'mensaje': f'{mensaje} (codificacion {ms_por_pagina:.0f} ms/pagina)'
     }
 
 
-def procesar_to_jpg(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+def procesar_to_png(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
     """
-    Procesador principal de conversion PDF a JPG.
+    Procesador principal de conversion PDF a PNG.
     Esta funcion es llamada por el job_manager.
 
     Args:
@@ -244,54 +563,271 @@ def procesar_to_jpg(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
     Returns:
         dict con ruta_resultado y mensaje
     """
-    # Obtener archivo
-    archivo = models.obtener_archivo(archivo_id)
-    if not archivo:
-        raise ValueError("Archivo no encontrado")
+    return _procesar_a_imagenes(trabajo_id, archivo_id, parametros, 'png')
 
-    ruta_pdf = Path(archivo['ruta_archivo'])
-    if not ruta_pdf.exists():
-        raise ValueError("Archivo fisico no encontrado")
 
-    nombre_original = archivo['nombre_original']
-    job_manager.actualizar_progreso(trabajo_id, 2, "Iniciando conversion a JPG")
+def procesar_to_jpg(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+    """
+    Procesador principal de conversion PDF a JPG.
+    Esta funcion es llamada por el job_manager.
+    """
+    return _procesar_a_imagenes(trabajo_id, archivo_id, parametros, 'jpg')
 
-    # Convertir
-    imagenes = convertir_pdf_a_imagenes(ruta_pdf, parametros, trabajo_id, 'jpg', nombre_original)
 
-    if not imagenes:
-        raise ValueError("No se generaron imagenes")
+def procesar_to_webp(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+    """
+    Procesador de conversion PDF a WebP (con perdida, o sin_perdida).
+    Esta funcion es llamada por el job_manager.
+    """
+    return _procesar_a_imagenes(trabajo_id, archivo_id, parametros, 'webp')
 
-    job_manager.actualizar_progreso(trabajo_id, 92, "Comprimiendo archivos")
 
-    # Crear ZIP
-    nombre_base = Path(archivo['nombre_original']).stem
-    nombre_zip = f"{trabajo_id}_{nombre_base}_jpg.zip"
+def procesar_to_avif(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+    """
+    Procesador de conversion PDF a AVIF.
+    Esta funcion es llamada por el job_manager.
+    """
+    _verificar_avif()
+    return _procesar_a_imagenes(trabajo_id, archivo_id, parametros, 'avif')
+
+
+def procesar_to_tiff(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
+    """
+    Procesador de conversion PDF a un TIFF multipagina comprimido.
+    Esta funcion es llamada por el job_manager.
+    """
+    return _procesar_a_imagenes(trabajo_id, archivo_id, parametros, 'tif')
+
+
+# =============================================================================
+# Estimacion de tamano y tiempo
+# =============================================================================
+
+def _variante_formato(formato: str, codificacion: dict) -> str:
+    """Formato con los parametros del codec que cambian el tamano de salida."""
+    if formato == 'jpg':
+        return f"jpg-q{codificacion['calidad']}" + ('-opt' if codificacion['optimizar'] else '')
+    if formato == 'webp':
+        return 'webp-lossless' if codificacion['sin_perdida'] else f"webp-q{codificacion['calidad']}"
+    if formato == 'avif':
+        return f"avif-q{codificacion['calidad']}"
+    if formato == 'tif':
+        return f"tif-{codificacion['modo_color']}"
+    return formato
 
-    archivos_para_zip = [(str(ruta), nombre) for ruta, nombre in imagenes]
-    ruta_zip = file_manager.crear_zip(archivos_para_zip, nombre_zip)
 
-    # Limpiar archivos temporales
-    for ruta, _ in imagenes:
-        if ruta.exists():
-            ruta.unlink()
+def _modo_tiff_muestra(pagina: fitz.Page, lista: fitz.DisplayList) -> Tuple[str, float]:
+    """
+    modo_color que 'auto' elegiria para la pagina entera, con un render a
+    36 DPI, y los segundos que tomo decidirlo (sin el render).
+    """
+    pix = lista.get_pixmap(matrix=fitz.Matrix(0.5, 0.5), alpha=False)
+    img = PILImage.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv,
+                              "raw", "RGB", pix.stride, 1)
+    inicio = time.perf_counter()
+    modo = _modo_tiff(pagina, img, 'auto')
+    return {'1': 'bitonal', 'L': 'gris', 'RGB': 'color'}[modo], time.perf_counter() - inicio
+
+
+def _muestrear(ruta_pdf: Path, dpi: int, formato: str, codificacion: dict) -> dict:
+    """
+    Renderiza y codifica FRANJAS_POR_PAGINA franjas horizontales (en total
+    ESTIMATE_SAMPLE_FRACTION del alto) de ESTIMATE_SAMPLE_PAGES paginas
+    repartidas por el documento, al DPI y formato reales: la compresion
+    depende del contenido y de la resolucion, por eso no se escala un
+    render de baja resolucion.
+
+    El tiempo se separa en una parte fija por pagina y otra proporcional al
+    area. La fija es interpretar el contenido (armar la display list) mas
+    renderizar la ultima fila, que obliga a decodificar las imagenes
+    enteras: MuPDF no las conserva entre renders con clip, y cada franja
+    vuelve a decodificarlas hasta su altura. Por eso de cada franja solo
+    cuenta como area el render que excede esa sonda, mas la codificacion.
 
+    Returns:
+        dict con bytes_por_pt2, segundos_por_pt2, segundos_por_pagina y paginas_muestreadas
+    """
+    zoom = dpi / 72.0
+    matriz = fitz.Matrix(zoom, zoom)
+    doc = fitz.open(str(ruta_pdf))
+    try:
+        total = len(doc)
+        muestras = min(config.ESTIMATE_SAMPLE_PAGES, total)
+        bytes_muestra = segundos_area = segundos_fijos = area_muestra = 0.0
+
+        for k in range(muestras):
+            pagina = doc.load_page(int((k + 0.5) * total / muestras))
+            rect = pagina.rect
+
+            inicio = time.perf_counter()
+            lista = pagina.get_displaylist()
+            lista.get_pixmap(matrix=matriz, alpha=False,
+                             clip=fitz.Rect(rect.x0, rect.y1 - 1 / zoom, rect.x1, rect.y1))
+            sonda = time.perf_counter() - inicio
+            segundos_fijos += sonda
+
+            codificacion_pagina = codificacion
+            if formato == 'tif' and codificacion['modo_color'] == 'auto':
+                # El modo depende de la pagina entera, no de cada franja. La
+                # deteccion real recorre la pagina al DPI pedido: escalar su costo
+                modo_color, deteccion_seg = _modo_tiff_muestra(pagina, lista)
+                codificacion_pagina = dict(codificacion, modo_color=modo_color)
+                segundos_fijos += deteccion_seg * (zoom / 0.5) ** 2
+
+            # Muestra acotada en pixeles: en un plano A0 sigue siendo barata
+            fraccion = min(config.ESTIMATE_SAMPLE_FRACTION,
+                           MEGAPIXELES_MUESTRA / max(render_bandas.megapixeles(pagina, zoom), 1e-6))
+            alto = min(rect.height, max(rect.height * fraccion / FRANJAS_POR_PAGINA, 16 / zoom))
+            # Una pagina muestreada puede ser mas ancha que el maximo de WebP
+            # aunque no este entre las pedidas: la tasa por area no cambia
+            x1 = min(rect.x1, rect.x0 + MAXIMO_WEBP / zoom) if formato == 'webp' else rect.x1
+            for j in range(FRANJAS_POR_PAGINA):
+                # Cada pagina muestreada desplaza sus franjas: juntas cubren mas alturas
+                centro = rect.y0 + rect.height * (j + (k + 0.5) / muestras) / FRANJAS_POR_PAGINA
+                y0 = min(max(centro - alto / 2, rect.y0), rect.y1 - alto)
+                clip = fitz.Rect(rect.x0, y0, x1, y0 + alto)
+
+                inicio = time.perf_counter()
+                datos, codificacion_seg = _codificar_pagina(pagina, matriz, formato,
+                                                            codificacion_pagina, clip, lista)
+                render_seg = time.perf_counter() - inicio - codificacion_seg
+                segundos_area += max(render_seg - sonda, 0.0) + codificacion_seg
+                bytes_muestra += len(datos)
+                area_muestra += abs(clip)
+    finally:
+        doc.close()
+
+    area_muestra = area_muestra or 1.0
     return {
-        'ruta_resultado': str(ruta_zip),
-        'mensaje': f'{len(imagenes)} imagenes JPG generadas'
+        'bytes_por_pt2': bytes_muestra / area_muestra,
+        'segundos_por_pt2': segundos_area / area_muestra,
+        'segundos_por_pagina': segundos_fijos / max(muestras, 1),
+        'paginas_muestreadas': muestras,
     }
 
 
+def estimar_conversion(archivo: dict, paginas: List[int], dpi: int, formato: str,
+                       opciones: dict = None, muestrear: bool = True) -> dict:
+    """
+    Estima el tamano de salida y el tiempo de render de convertir paginas
+    de un PDF a imagenes. Las tasas por area salen de muestrear el
+    documento (ver _muestrear) y se cachean por (hash, DPI, formato);
+    luego se escalan al area de las paginas pedidas.
+
+    Args:
+        archivo: Registro del archivo (ruta_archivo, hash_archivo)
+        paginas: Paginas a convertir (1-indexed)
+        dpi: DPI de salida
+        formato: 'png', 'jpg', 'webp', 'avif' o 'tif'
+        opciones: Opciones de conversion (calidad, optimizar, sin_perdida, modo_color)
+        muestrear: Si es False y las tasas no estan cacheadas retorna None
+                   en lugar de renderizar
+
+    Returns:
+        dict con bytes, segundos (con RENDER_PROCESSES procesos),
+        paginas_muestreadas y desde_cache
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato invalido: {formato} (opciones: {', '.join(FORMATOS)})")
+    if formato == 'avif':
+        _verificar_avif()
+
+    codificacion = _opciones_codificacion(opciones or {}, formato)
+    variante = _variante_formato(formato, codificacion)
+    hash_archivo = archivo.get('hash_archivo')
+
+    estimacion = models.obtener_estimacion_render(hash_archivo, dpi, variante) \
+        if hash_archivo else None
+    desde_cache = estimacion is not None
+    if not desde_cache and not muestrear:
+        return None
+
+    # El area de cada pagina sale del cropbox, sin cargar las paginas
+    doc = fitz.open(archivo['ruta_archivo'])
+    try:
+        cajas = [doc.page_cropbox(num_pagina - 1) for num_pagina in paginas]
+    finally:
+        doc.close()
+    if formato == 'webp':
+        matriz = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+        for caja in cajas:
+            _verificar_webp(caja, matriz)
+    area = sum(abs(caja) for caja in cajas)
+
+    if not desde_cache:
+        inicio = time.perf_counter()
+        estimacion = _muestrear(Path(archivo['ruta_archivo']), dpi, formato, codificacion)
+        if hash_archivo:
+            models.guardar_estimacion_render(hash_archivo, dpi, variante, **estimacion)
+        logger.debug(f"Estimacion {variante} a {dpi} DPI de {archivo.get('id')}: "
+                     f"{estimacion['paginas_muestreadas']} paginas muestreadas "
+                     f"en {time.perf_counter() - inicio:.2f} s")
+
+    segundos = (area * estimacion['segundos_por_pt2']
+                + len(paginas) * estimacion['segundos_por_pagina']) \
+        / max(_procesos_render(len(paginas)), 1)
+    return {
+        'bytes': int(area * estimacion['bytes_por_pt2']),
+        'segundos': round(segundos, 2),
+        'paginas_muestreadas': estimacion['paginas_muestreadas'],
+        'desde_cache': desde_cache,
+    }
+
+
+def _programar_muestreo(archivo: dict, paginas: List[int], dpi: int, formato: str,
+                        opciones: dict):
+    """Muestrea en segundo plano y cachea las tasas (una vez por hash, DPI y variante)."""
+    variante = _variante_formato(formato, _opciones_codificacion(opciones, formato))
+    clave = (archivo['hash_archivo'], dpi, variante)
+    with _lock_muestreos:
+        if clave in _muestreos_pendientes:
+            return
+        _muestreos_pendientes.add(clave)
+
+    def tarea():
+        try:
+            estimar_conversion(archivo, paginas, dpi, formato, opciones)
+        except Exception as e:
+            logger.warning(f"No se pudo muestrear {variante} a {dpi} DPI de {archivo['id']}: {e}")
+        finally:
+            with _lock_muestreos:
+                _muestreos_pendientes.discard(clave)
+
+    _muestreador.submit(tarea)
+
+
+def costo_conversion(archivo: dict, parametros: dict, formato: str) -> float:
+    """
+    Costo de un trabajo de conversion a imagen para la planificacion del
+    job_manager: paginas + MB de salida estimados (en lugar de MB de entrada).
+    Se calcula al encolar, en la peticion: sin tasas cacheadas usa
+    MB_POR_PAGINA_150_DPI y programa el muestreo en segundo plano.
+    """
+    parametros = parametros or {}
+    paginas = parsear_paginas(parametros.get('paginas', 'all'), archivo['num_paginas'] or 0)
+    dpi = parametros.get('dpi', 150)
+    estimacion = estimar_conversion(archivo, paginas, dpi, formato, parametros, muestrear=False)
+    if estimacion is None:
+        if archivo.get('hash_archivo'):
+            _programar_muestreo(archivo, paginas, dpi, formato, parametros)
+        return len(paginas) * (1 + MB_POR_PAGINA_150_DPI * (dpi / 150) ** 2)
+    return len(paginas) + estimacion['bytes'] / (1024 * 1024)
+
+
 def obtener_info_conversion(archivo_id: str, opciones: dict) -> dict:
     """
     Obtiene informacion para preview de la conversion.
 
     Args:
         archivo_id: ID del archivo
-        opciones: Opciones de conversion
+        opciones: Opciones de conversion (formato: el pedido; comparar: estimar
+                  tambien PNG y JPG, por defecto solo si el pedido es uno de ellos)
 
     Returns:
         dict con informacion de la conversion
+
+    Raises:
+        ValueError: opciones invalidas o formato pedido que no se puede generar
     """
     archivo = models.obtener_archivo(archivo_id)
     if not archivo:
@@ -312,23 +848,45 @@ def obtener_info_conversion(archivo_id: str, opciones: dict) -> dict:
 
     dpi = opciones.get('dpi', 150)
     formato = opciones.get('formato', 'png')
-    calidad = opciones.get('calidad', 85)
 
-    # Estimar tamano
-    tamano_png = estimar_tamano(len(paginas), dpi, 'png')
-    tamano_jpg = estimar_tamano(len(paginas), dpi, 'jpg')
+    # Estimar tamano y tiempo por muestreo: cada formato es un muestreo aparte
+    pedida = estimar_conversion(archivo, paginas, dpi, formato, opciones)
 
-    return {
+    info = {
         'total_paginas': total_paginas,
         'paginas_seleccionadas': len(paginas),
         'dpi': dpi,
-        'tamano_estimado_png': tamano_png,
-        'tamano_estimado_jpg': tamano_jpg,
-        'tamano_estimado_png_texto': file_manager.formatear_tamano(tamano_png),
-        'tamano_estimado_jpg_texto': file_manager.formatear_tamano(tamano_jpg)
+        'formato': formato,
+        'tamano_estimado': pedida['bytes'],
+        'tamano_estimado_texto': file_manager.formatear_tamano(pedida['bytes']),
+        'segundos_estimados': pedida['segundos'],
+        'paginas_muestreadas': pedida['paginas_muestreadas'],
     }
 
+    # Comparacion con PNG y JPG: un formato que no se puede estimar se omite
+    if opciones.get('comparar', formato in ('png', 'jpg')):
+        for comparado in ('png', 'jpg'):
+            try:
+                estimacion = pedida if comparado == formato else \
+                    estimar_conversion(archivo, paginas, dpi, comparado, opciones)
+            except ValueError as e:
+                logger.warning(f"Sin estimacion {comparado} para {archivo_id}: {e}")
+                continue
+            info[f'tamano_estimado_{comparado}'] = estimacion['bytes']
+            info[f'tamano_estimado_{comparado}_texto'] = \
+                file_manager.formatear_tamano(estimacion['bytes'])
+
+    return info
+
 
 # Registrar los procesadores en el job_manager
-job_manager.registrar_procesador('to-png', procesar_to_png)
-job_manager.registrar_procesador('to-jpg', procesar_to_jpg)
+job_manager.registrar_procesador('to-png', procesar_to_png, max_concurrentes=2, en_proceso=True,
+                                 estimador_costo=partial(costo_conversion, formato='png'))
+job_manager.registrar_procesador('to-jpg', procesar_to_jpg, max_concurrentes=2, en_proceso=True,
+                                 estimador_costo=partial(costo_conversion, formato='jpg'))
+job_manager.registrar_procesador('to-webp', procesar_to_webp, max_concurrentes=2, en_proceso=True,
+                                 estimador_costo=partial(costo_conversion, formato='webp'))
+job_manager.registrar_procesador('to-avif', procesar_to_avif, max_concurrentes=2, en_proceso=True,
+                                 estimador_costo=partial(costo_conversion, formato='avif'))
+job_manager.registrar_procesador('to-tiff', procesar_to_tiff, max_concurrentes=2, en_proceso=True,
+                                 estimador_costo=partial(costo_conversion, formato='tif'))
@@ -241,4 +241,4 @@ def procesar_to_md(trabajo_id: str, archivo_id: str, parametros: dict) -> dict:
     }
 
 
-job_manager.registrar_procesador('to-md', procesar_to_md)
+job_manager.registrar_procesador('to-md', procesar_to_md, en_proceso=True)
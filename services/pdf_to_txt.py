@@ -339,4 +339,4 @@ def obtener_preview_texto(archivo_id: str, opciones: dict, max_lineas: int = 500
 
 
 # Registrar el procesador en el job_manager
-job_manager.registrar_procesador('to-txt', procesar_to_txt)
+job_manager.registrar_procesador('to-txt', procesar_to_txt, en_proceso=True)
@@ -14,7 +14,8 @@ import pandas as pd
 
 import config
 import models
-from utils import file_manager, job_manager
+from utils import job_manager
+from utils.zip_salida import ZipSalida
 
 logger = logging.getLogger(__name__)
 
@@ -87,44 +88,38 @@ def procesar_xlsx_to_csv(trabajo_id: str, archivo_id: str, parametros: dict) ->
 
     job_manager.actualizar_progreso(trabajo_id, 30, f"Convirtiendo {num_hojas} hoja(s)")
 
-    archivos_generados = []
     padding = len(str(num_hojas))
 
-    for i, nombre_hoja in enumerate(nombres_hojas):
-        df = hojas_df[nombre_hoja]
+    def nombre_csv(i: int, nombre_hoja: str) -> str:
         n_str = str(i + 1).zfill(padding)
-        hoja_safe = _sanitizar_nombre(nombre_hoja)
-        nombre_csv = f"{nombre_base} - hoja {n_str} {hoja_safe}.csv"
-        ruta_csv = config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_csv}"
-
-        df.to_csv(str(ruta_csv), index=False, sep=separador, encoding=codificacion)
-        archivos_generados.append((ruta_csv, nombre_csv))
-
-        progreso = int(30 + ((i + 1) / num_hojas) * 55)
-        job_manager.actualizar_progreso(trabajo_id, progreso, f"Hoja {i+1}/{num_hojas}: {nombre_hoja}")
+        return f"{nombre_base} - hoja {n_str} {_sanitizar_nombre(nombre_hoja)}.csv"
 
     # Una sola hoja: CSV directo (sin ZIP)
     if num_hojas == 1:
-        ruta_csv, _ = archivos_generados[0]
-        filas = len(hojas_df[nombres_hojas[0]])
+        nombre_hoja = nombres_hojas[0]
+        ruta_csv = config.OUTPUT_FOLDER / f"{trabajo_id}_{nombre_csv(0, nombre_hoja)}"
+        hojas_df[nombre_hoja].to_csv(str(ruta_csv), index=False, sep=separador,
+                                     encoding=codificacion)
+        filas = len(hojas_df[nombre_hoja])
         return {
             'ruta_resultado': str(ruta_csv),
-            'mensaje': f'1 hoja convertida: {nombres_hojas[0]} ({filas} filas)'
+            'mensaje': f'1 hoja convertida: {nombre_hoja} ({filas} filas)'
         }
 
-    job_manager.actualizar_progreso(trabajo_id, 88, "Comprimiendo CSVs")
-
+    # Varias hojas: cada CSV se escribe directamente en el ZIP
     nombre_zip = f"{trabajo_id}_{nombre_base}_csv.zip"
-    archivos_para_zip = [(str(ruta), nombre) for ruta, nombre in archivos_generados]
-    ruta_zip = file_manager.crear_zip(archivos_para_zip, nombre_zip)
 
-    for ruta_temp, _ in archivos_generados:
-        if ruta_temp.exists():
-            ruta_temp.unlink()
+    with ZipSalida(config.OUTPUT_FOLDER / nombre_zip) as zs:
+        for i, nombre_hoja in enumerate(nombres_hojas):
+            with zs.abrir(nombre_csv(i, nombre_hoja), encoding=codificacion) as f:
+                hojas_df[nombre_hoja].to_csv(f, index=False, sep=separador)
+
+            progreso = int(30 + ((i + 1) / num_hojas) * 60)
+            job_manager.actualizar_progreso(trabajo_id, progreso, f"Hoja {i+1}/{num_hojas}: {nombre_hoja}")
 
     total_filas = sum(len(df) for df in hojas_df.values())
     return {
-        'ruta_resultado': str(ruta_zip),
+        'ruta_resultado': str(zs.ruta),
         'mensaje': f'{num_hojas} hojas convertidas ({total_filas} filas en total)'
     }
 
@@ -250,6 +250,43 @@ async function obtenerMiniatura(archivoId, pagina = 0) {
     }
 }
 
+/**
+ * Obtiene las miniaturas de varias paginas en un solo pedido (sprite) y
+ * las recorta en el navegador.
+ * @param {string} archivoId - ID del archivo
+ * @param {number[]} paginas - Paginas 0-indexed (maximo 200)
+ * @returns {Promise<Object>} - pagina -> URL (data:) de su miniatura; {} si falla
+ */
+async function obtenerMiniaturasLote(archivoId, paginas) {
+    const url = `${window.AppConfig.API_BASE_URL}/files/${archivoId}/thumbnails` +
+        `?formato=sprite&paginas=${paginas.join(',')}`;
+
+    try {
+        const respuesta = await fetch(url);
+
+        if (!respuesta.ok) {
+            throw new Error('Error obteniendo miniaturas');
+        }
+
+        const posiciones = JSON.parse(respuesta.headers.get('X-Sprite-Layout') || '[]');
+        const sprite = await createImageBitmap(await respuesta.blob());
+        const canvas = document.createElement('canvas');
+        const context = canvas.getContext('2d');
+        const miniaturas = {};
+
+        for (const [pagina, x, y, ancho, alto] of posiciones) {
+            canvas.width = ancho;
+            canvas.height = alto;
+            context.drawImage(sprite, x, y, ancho, alto, 0, 0, ancho, alto);
+            miniaturas[pagina] = canvas.toDataURL('image/png');
+        }
+        return miniaturas;
+    } catch (error) {
+        console.error('Error obteniendo miniaturas:', error);
+        return {};
+    }
+}
+
 /**
  * Inicia un trabajo de conversion.
  * @param {string} archivoId - ID del archivo
@@ -318,6 +355,48 @@ function monitorearProgreso(trabajoId, onProgress, onComplete, onError) {
     return eventSource;
 }
 
+/**
+ * Monitorea varios trabajos con una sola conexion SSE.
+ * @param {string[]} trabajoIds - IDs de los trabajos
+ * @param {Function} onProgress - Callback (trabajoId, progreso, mensaje, estado) por cada cambio
+ * @param {Function} onFin - Callback cuando todos los trabajos terminaron
+ */
+function monitorearProgresoMultiple(trabajoIds, onProgress, onFin) {
+    const eventSource = new EventSource(
+        `${window.AppConfig.API_BASE_URL}/jobs/progress?ids=${trabajoIds.map(encodeURIComponent).join(',')}`
+    );
+    const pendientes = new Set(trabajoIds);
+
+    eventSource.addEventListener('message', (event) => {
+        const datos = JSON.parse(event.data);
+
+        if (datos.error) {
+            eventSource.close();
+            onFin(datos.error);
+            return;
+        }
+
+        for (const [id, trabajo] of Object.entries(datos.trabajos)) {
+            onProgress(id, trabajo.progreso, trabajo.mensaje, trabajo.estado);
+            if (['completado', 'error', 'cancelado'].includes(trabajo.estado)) {
+                pendientes.delete(id);
+            }
+        }
+
+        if (pendientes.size === 0) {
+            eventSource.close();
+            onFin(null);
+        }
+    });
+
+    eventSource.addEventListener('error', () => {
+        eventSource.close();
+        onFin('Error de conexion con el servidor');
+    });
+
+    return eventSource;
+}
+
 /**
  * Descarga el resultado de un trabajo.
  */
@@ -401,8 +480,10 @@ window.PDFExport = {
     DropZone,
     generarMiniaturaLocal,
     obtenerMiniatura,
+    obtenerMiniaturasLote,
     iniciarConversion,
     monitorearProgreso,
+    monitorearProgresoMultiple,
     descargarResultado,
     formatearTamano,
     formatearFecha,
@@ -191,11 +191,9 @@ function renderizarMiniaturas(paginas) {
         thumbnail.className = `page-thumbnail ${tieneRotacion ? 'rotated' : ''}`;
         thumbnail.dataset.pagina = pagina.numero;
 
-        const urlMiniatura = `${window.AppConfig.API_BASE_URL}/files/${estado.archivoId}/thumbnail/${pagina.numero - 1}`;
-
         thumbnail.innerHTML = `
             <div class="thumbnail-image-container">
-                <img class="thumbnail-image" src="${urlMiniatura}"
+                <img class="thumbnail-image"
                      alt="Pagina ${pagina.numero}"
                      style="transform: rotate(${rotacionActual}deg)"
                      onerror="this.src='data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 140%22><rect fill=%22%23f0f0f0%22 width=%22100%22 height=%22140%22/><text x=%2250%22 y=%2275%22 text-anchor=%22middle%22 fill=%22%23999%22 font-size=%2212%22>Pag ${pagina.numero}</text></svg>'">
@@ -211,6 +209,33 @@ function renderizarMiniaturas(paginas) {
 
         elementos.thumbnailsGrid.appendChild(thumbnail);
     });
+
+    cargarImagenesMiniaturas(paginas.map(pagina => pagina.numero));
+}
+
+/**
+ * Carga las imagenes de la grilla en lotes (un pedido por cada 100 paginas);
+ * las que no lleguen en el lote se piden una por una.
+ */
+async function cargarImagenesMiniaturas(numeros) {
+    const archivoId = estado.archivoId;
+
+    for (let i = 0; i < numeros.length; i += 100) {
+        const lote = numeros.slice(i, i + 100);
+        const miniaturas = await window.PDFExport.obtenerMiniaturasLote(
+            archivoId, lote.map(numero => numero - 1));
+
+        // El usuario pudo cargar otro archivo mientras tanto
+        if (estado.archivoId !== archivoId) return;
+
+        lote.forEach(numero => {
+            const img = elementos.thumbnailsGrid.querySelector(`[data-pagina="${numero}"] .thumbnail-image`);
+            if (img) {
+                img.src = miniaturas[numero - 1] ||
+                    `${window.AppConfig.API_BASE_URL}/files/${archivoId}/thumbnail/${numero - 1}`;
+            }
+        });
+    }
 }
 
 /**
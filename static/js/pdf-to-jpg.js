@@ -112,6 +112,7 @@ function obtenerOpciones() {
     return {
         dpi: parseInt(dpiSeleccionado?.value || 150),
         calidad: calidad,
+        optimizar: document.getElementById('opt-optimizar')?.checked || false,
         paginas: paginas
     };
 }
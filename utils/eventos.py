@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Pub/sub en memoria del progreso de trabajos para PDFexport.
+
+job_manager publica cada cambio de estado o progreso y los streams SSE
+esperan bloqueados en su suscripcion, sin consultar la base de datos.
+Cada suscripcion conserva solo el ultimo evento de cada trabajo: un
+cliente lento recibe el estado mas reciente, no una cola de atrasados.
+
+Con PROGRESS_CROSS_PROCESS un unico thread por proceso sondea la base por
+todos los trabajos observados, para ver los cambios que registran workers
+de otros procesos o contenedores.
+"""
+
+import threading
+import time
+import logging
+from typing import Dict, Iterable, List
+
+import config
+import models
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_FINALES = ('completado', 'error', 'cancelado')
+
+# Suscripciones activas por trabajo_id
+_suscripciones: Dict[str, set] = {}
+_lock = threading.Lock()
+
+# Ultimo evento publicado por trabajo (evita republicar lo que ya se vio)
+_ultimo_evento: Dict[str, dict] = {}
+
+_thread_sondeo = None
+
+
+class Suscripcion:
+    """Buzon de eventos de uno o varios trabajos."""
+
+    def __init__(self, trabajo_ids: Iterable[str]):
+        self.trabajo_ids = set(trabajo_ids)
+        self._eventos: Dict[str, dict] = {}
+        self._condicion = threading.Condition()
+
+    def entregar(self, trabajo_id: str, evento: dict):
+        with self._condicion:
+            self._eventos[trabajo_id] = evento
+            self._condicion.notify()
+
+    def recibir(self, timeout: float = None) -> Dict[str, dict]:
+        """
+        Espera hasta que haya eventos (o venza timeout) y los devuelve.
+
+        Returns:
+            dict trabajo_id -> ultimo evento (vacio si vencio el timeout)
+        """
+        with self._condicion:
+            if not self._eventos:
+                self._condicion.wait(timeout)
+            eventos, self._eventos = self._eventos, {}
+            return eventos
+
+
+def suscribir(trabajo_ids: Iterable[str]) -> Suscripcion:
+    """Crea una suscripcion a los eventos de los trabajos indicados."""
+    suscripcion = Suscripcion(trabajo_ids)
+    with _lock:
+        for trabajo_id in suscripcion.trabajo_ids:
+            _suscripciones.setdefault(trabajo_id, set()).add(suscripcion)
+    if config.PROGRESS_CROSS_PROCESS:
+        _iniciar_sondeo()
+    return suscripcion
+
+
+def desuscribir(suscripcion: Suscripcion):
+    """Da de baja una suscripcion (al cerrarse el stream del cliente)."""
+    with _lock:
+        for trabajo_id in suscripcion.trabajo_ids:
+            suscriptores = _suscripciones.get(trabajo_id)
+            if suscriptores is None:
+                continue
+            suscriptores.discard(suscripcion)
+            if not suscriptores:
+                del _suscripciones[trabajo_id]
+                _ultimo_evento.pop(trabajo_id, None)
+
+
+def observado(trabajo_id: str) -> bool:
+    """Indica si algun cliente esta suscrito al trabajo en este proceso."""
+    return trabajo_id in _suscripciones
+
+
+def publicar(trabajo_id: str, estado: str, progreso: int, mensaje: str = None):
+    """
+    Entrega un cambio de estado/progreso a los suscriptores del trabajo.
+    mensaje=None conserva el ultimo mensaje publicado (como en la BD).
+    """
+    with _lock:
+        suscriptores = _suscripciones.get(trabajo_id)
+        if not suscriptores:
+            return
+        if mensaje is None and trabajo_id in _ultimo_evento:
+            mensaje = _ultimo_evento[trabajo_id]['mensaje']
+        evento = {'estado': estado, 'progreso': progreso, 'mensaje': mensaje}
+        _ultimo_evento[trabajo_id] = evento
+        suscriptores = list(suscriptores)
+    for suscripcion in suscriptores:
+        suscripcion.entregar(trabajo_id, evento)
+
+
+def publicar_trabajo(trabajo: dict):
+    """Publica el estado actual de un registro de trabajo."""
+    if trabajo:
+        publicar(trabajo['id'], trabajo['estado'], trabajo['progreso'], trabajo['mensaje'])
+
+
+# =============================================================================
+# Canal entre procesos: sondeo compartido de la base
+# =============================================================================
+
+def _iniciar_sondeo():
+    global _thread_sondeo
+    with _lock:
+        if _thread_sondeo is not None and _thread_sondeo.is_alive():
+            return
+        _thread_sondeo = threading.Thread(target=_sondear_cambios, daemon=True,
+                                          name="sondeo-progreso")
+        _thread_sondeo.start()
+
+
+def _sondear_cambios():
+    """Una consulta por intervalo para todos los trabajos observados del proceso."""
+    while True:
+        with _lock:
+            trabajo_ids: List[str] = list(_suscripciones)
+        try:
+            for trabajo in models.obtener_trabajos_por_ids(trabajo_ids):
+                evento = {'estado': trabajo['estado'], 'progreso': trabajo['progreso'],
+                          'mensaje': trabajo['mensaje']}
+                if _ultimo_evento.get(trabajo['id']) != evento:
+                    publicar_trabajo(trabajo)
+        except Exception as e:
+            logger.error(f"Error en sondeo de progreso: {e}")
+        time.sleep(config.JOB_CHECK_INTERVAL)
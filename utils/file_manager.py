@@ -5,10 +5,10 @@ Maneja subida, almacenamiento y limpieza de archivos.
 """
 
 import os
+import filecmp
 import hashlib
 import uuid
 import shutil
-import zipfile
 import logging
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -18,9 +18,29 @@ import fitz  # PyMuPDF
 
 import config
 import models
+from utils import thumbnail
+from utils.zip_salida import ZipSalida
 
 logger = logging.getLogger(__name__)
 
+# xxhash es opcional: mucho mas rapido que blake2b/md5 en archivos grandes
+try:
+    import xxhash
+    XXHASH_DISPONIBLE = True
+except ImportError:
+    XXHASH_DISPONIBLE = False
+
+# Bloque de lectura/escritura al guardar y hashear archivos
+TAMANO_BLOQUE = 1024 * 1024
+
+
+class ArchivoDemasiadoGrande(Exception):
+    """La subida supero MAX_CONTENT_LENGTH mientras se escribia."""
+
+
+class ContenidoEnConflicto(Exception):
+    """Una subida tiene el mismo hash que un contenido almacenado, pero otros bytes."""
+
 
 def extension_permitida(nombre_archivo: str) -> bool:
     """Verifica si la extension del archivo esta permitida."""
@@ -39,13 +59,50 @@ def sanitizar_nombre(nombre: str) -> str:
     return nombre_seguro
 
 
+def crear_hasher():
+    """Hash incremental segun config.UPLOAD_HASH_ALGO (128 bits, 32 caracteres hex)."""
+    if config.UPLOAD_HASH_ALGO == 'md5':
+        return hashlib.md5()
+    if config.UPLOAD_HASH_ALGO == 'xxhash' and XXHASH_DISPONIBLE:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
 def generar_hash_archivo(ruta: Path) -> str:
-    """Genera hash MD5 del archivo para detectar duplicados."""
-    hash_md5 = hashlib.md5()
+    """Genera el hash de contenido de un archivo ya guardado (detectar duplicados)."""
+    hasher = crear_hasher()
     with open(ruta, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        for chunk in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def escribir_stream(origen, ruta_destino: Path, limite_bytes: int = None) -> tuple:
+    """
+    Copia un stream a disco en bloques grandes calculando el hash en la
+    misma pasada. Si se supera limite_bytes corta la copia, borra lo escrito
+    y lanza ArchivoDemasiadoGrande.
+
+    Returns:
+        (tamano_bytes, hash hex)
+    """
+    hasher = crear_hasher()
+    tamano = 0
+    try:
+        with open(ruta_destino, 'wb') as destino:
+            while True:
+                bloque = origen.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                tamano += len(bloque)
+                if limite_bytes and tamano > limite_bytes:
+                    raise ArchivoDemasiadoGrande(f"El archivo supera {limite_bytes} bytes")
+                hasher.update(bloque)
+                destino.write(bloque)
+    except BaseException:
+        ruta_destino.unlink(missing_ok=True)
+        raise
+    return tamano, hasher.hexdigest()
 
 
 def obtener_info_pdf(ruta: Path) -> dict:
@@ -77,66 +134,298 @@ def guardar_archivo(archivo, nombre_original: str, fecha_modificacion: str = Non
         fecha_modificacion: Fecha de modificacion del archivo (ISO format)
 
     Returns:
-        dict con informacion del archivo guardado o None si hay error
+        dict con informacion del archivo guardado (con 'ya_existia') o None si hay error
+
+    Raises:
+        ContenidoEnConflicto: el hash coincide con otro contenido almacenado distinto
     """
-    # Sanitizar nombre
-    nombre_seguro = sanitizar_nombre(nombre_original)
+    # El contenido se escribe a un temporal; al conocer su hash pasa a su ruta definitiva
+    ruta_temporal = config.UPLOAD_FOLDER / f"{uuid.uuid4()}.part"
 
-    # Generar nombre unico para almacenamiento
-    archivo_id = str(uuid.uuid4())
+    try:
+        # Una sola pasada: escribir, medir y hashear mientras llega el stream
+        try:
+            tamano_bytes, hash_archivo = escribir_stream(
+                archivo.stream, ruta_temporal, config.MAX_CONTENT_LENGTH
+            )
+        except ArchivoDemasiadoGrande:
+            logger.warning(f"Archivo muy grande: supera {config.MAX_CONTENT_LENGTH} bytes")
+            return None
+
+        return _registrar_archivo(ruta_temporal, nombre_original, fecha_modificacion,
+                                  tamano_bytes, hash_archivo)
+
+    except ContenidoEnConflicto:
+        raise
+    except Exception as e:
+        logger.error(f"Error al guardar archivo: {e}")
+        ruta_temporal.unlink(missing_ok=True)
+        return None
+
+
+# =============================================================================
+# Almacenamiento por contenido
+# =============================================================================
+#
+# Cada contenido se guarda una sola vez en UPLOAD_FOLDER/<hash>.<extension>,
+# con la extension (en minusculas) con que llego por primera vez, y todos
+# los registros de archivos con ese contenido apuntan a la misma ruta,
+# aunque se hayan subido con otro nombre o extension: el nombre original
+# solo vive en el registro. Las referencias son los propios registros: el archivo fisico se
+# borra recien cuando no queda ninguno que lo use.
+
+def _ruta_contenido(hash_archivo: str, nombre_original: str) -> Path:
+    """Ruta fisica de un contenido: hash + extension del nombre original."""
+    nombre_seguro = sanitizar_nombre(nombre_original)
     extension = nombre_seguro.rsplit('.', 1)[1].lower() if '.' in nombre_seguro else 'pdf'
-    nombre_guardado = f"{archivo_id}.{extension}"
-    ruta_destino = config.UPLOAD_FOLDER / nombre_guardado
+    return config.UPLOAD_FOLDER / f"{hash_archivo}.{extension}"
 
-    try:
-        # Guardar archivo temporalmente
-        archivo.save(str(ruta_destino))
 
-        # Obtener tamanio
-        tamano_bytes = ruta_destino.stat().st_size
+def _info_archivo(archivo: dict, ya_existia: bool) -> dict:
+    return {
+        'id': archivo['id'],
+        'nombre_original': archivo['nombre_original'],
+        'tamano_bytes': archivo['tamano_bytes'],
+        'num_paginas': archivo['num_paginas'],
+        'ya_existia': ya_existia
+    }
 
-        # Verificar tamanio maximo
-        if tamano_bytes > config.MAX_CONTENT_LENGTH:
-            ruta_destino.unlink()
-            logger.warning(f"Archivo muy grande: {tamano_bytes} bytes")
-            return None
 
-        # Obtener info del PDF (solo para archivos PDF)
-        if extension == 'pdf':
-            info_pdf = obtener_info_pdf(ruta_destino)
-        else:
-            info_pdf = {'num_paginas': 0, 'metadata': {}, 'es_encriptado': False}
+def _verificar_mismo_contenido(ruta_temporal: Path, ruta_almacenada: Path):
+    """
+    Compara tamano y bytes antes de compartir un contenido almacenado: con
+    un hash no resistente a colisiones (md5, xxhash) dos archivos distintos
+    podrian coincidir, y el segundo pasaria a ver el primero. Ante una
+    colision descarta el temporal y lanza ContenidoEnConflicto.
+    """
+    if ruta_temporal.stat().st_size == ruta_almacenada.stat().st_size \
+            and filecmp.cmp(ruta_temporal, ruta_almacenada, shallow=False):
+        return
+    ruta_temporal.unlink(missing_ok=True)
+    logger.error(f"Colision de hash con {ruta_almacenada.name}: subida rechazada")
+    raise ContenidoEnConflicto("El hash del archivo coincide con otro contenido distinto")
 
-        # Generar hash para detectar duplicados
-        hash_archivo = generar_hash_archivo(ruta_destino)
 
-        # Registrar en base de datos
+def _registrar_archivo(ruta_temporal: Path, nombre_original: str, fecha_modificacion: str,
+                       tamano_bytes: int, hash_archivo: str) -> dict:
+    """
+    Registra un archivo recien escrito en ruta_temporal. Si su contenido ya
+    esta almacenado (mismo hash y mismos bytes) el temporal se descarta y el
+    registro nuevo comparte el archivo fisico; si ademas coincide el nombre
+    se devuelve el existente.
+    """
+    # La comparacion de bytes va antes de tomar el lock de escritura de la BD
+    verificada = None
+    existente = models.buscar_archivo_por_hash(hash_archivo)
+    if existente and Path(existente['ruta_archivo']).exists():
+        try:
+            _verificar_mismo_contenido(ruta_temporal, Path(existente['ruta_archivo']))
+            verificada = Path(existente['ruta_archivo'])
+        except FileNotFoundError:
+            pass  # Liberado mientras tanto: se vuelve a colocar abajo
+
+    mismo_nombre = models.buscar_archivo_por_hash(hash_archivo, nombre_original)
+    if mismo_nombre and Path(mismo_nombre['ruta_archivo']).exists():
+        ruta_temporal.unlink(missing_ok=True)
+        logger.info(f"Archivo duplicado por contenido: {nombre_original}")
+        return _info_archivo(mismo_nombre, ya_existia=True)
+
+    existente = mismo_nombre or models.buscar_archivo_por_hash(hash_archivo)
+    # El archivo fisico depende solo del hash: si el contenido ya esta, se comparte
+    ruta_destino = Path(existente['ruta_archivo']) if existente \
+        else _ruta_contenido(hash_archivo, nombre_original)
+
+    # Las paginas se leen solo la primera vez que llega este contenido
+    if existente:
+        num_paginas = existente['num_paginas']
+    elif ruta_destino.suffix == '.pdf':
+        num_paginas = obtener_info_pdf(ruta_temporal)['num_paginas']
+    else:
+        num_paginas = 0
+
+    # "Colocar contenido + registrar" en la misma transaccion de escritura que
+    # "contar referencias + borrar" (_liberar_contenido): ningun otro thread o
+    # proceso borra el archivo mientras se le agrega una referencia
+    with models.transaccion_inmediata():
+        if ruta_destino.exists():
+            if ruta_destino != verificada:
+                _verificar_mismo_contenido(ruta_temporal, ruta_destino)
+            ruta_temporal.unlink(missing_ok=True)
+        else:
+            os.replace(ruta_temporal, ruta_destino)
+
         nuevo_id = models.crear_archivo(
             nombre_original=nombre_original,
-            nombre_guardado=nombre_guardado,
+            nombre_guardado=ruta_destino.name,
             tamano_bytes=tamano_bytes,
             fecha_modificacion=fecha_modificacion or datetime.now().isoformat(),
             ruta_archivo=str(ruta_destino),
             hash_archivo=hash_archivo,
-            num_paginas=info_pdf['num_paginas']
+            num_paginas=num_paginas
         )
 
-        logger.info(f"Archivo guardado: {nombre_original} ({tamano_bytes} bytes, {info_pdf['num_paginas']} paginas)")
+    logger.info(f"Archivo guardado: {nombre_original} ({tamano_bytes} bytes, {num_paginas} paginas)")
 
-        return {
-            'id': nuevo_id,
-            'nombre_original': nombre_original,
-            'nombre_guardado': nombre_guardado,
-            'tamano_bytes': tamano_bytes,
-            'num_paginas': info_pdf['num_paginas'],
-            'ruta': str(ruta_destino)
-        }
+    # Contenido nuevo: adelantar las miniaturas que pedira la grilla de paginas
+    if not existente and num_paginas:
+        thumbnail.pregenerar({'id': nuevo_id, 'ruta_archivo': str(ruta_destino),
+                              'hash_archivo': hash_archivo, 'num_paginas': num_paginas})
 
-    except Exception as e:
-        logger.error(f"Error al guardar archivo: {e}")
-        if ruta_destino.exists():
-            ruta_destino.unlink()
+    return {
+        'id': nuevo_id,
+        'nombre_original': nombre_original,
+        'nombre_guardado': ruta_destino.name,
+        'tamano_bytes': tamano_bytes,
+        'num_paginas': num_paginas,
+        'ruta': str(ruta_destino),
+        'ya_existia': False
+    }
+
+
+def _liberar_contenido(ruta_archivo: str) -> bool:
+    """Borra el archivo fisico si ya ningun registro lo referencia."""
+    with models.transaccion_inmediata():
+        if models.contar_referencias_archivo(ruta_archivo):
+            return False
+        ruta = Path(ruta_archivo)
+        if not ruta.exists():
+            return False
+        try:
+            ruta.unlink()
+            logger.info(f"Archivo fisico eliminado: {ruta}")
+            return True
+        except Exception as e:
+            logger.error(f"Error eliminando {ruta}: {e}")
+            return False
+
+
+# =============================================================================
+# Subidas por partes (reanudables)
+# =============================================================================
+
+class ErrorSubida(Exception):
+    """Parte o finalizacion invalida en una subida por partes."""
+
+
+def iniciar_subida(nombre_original: str, tamano_bytes: int, fecha_modificacion: str = None) -> dict:
+    """
+    Crea una subida por partes. El archivo parcial se reserva con su tamano
+    final en UPLOAD_FOLDER, asi cada parte se escribe en su offset sin copias
+    intermedias y las partes pueden llegar en paralelo y en cualquier orden.
+    """
+    if not extension_permitida(nombre_original):
+        raise ErrorSubida('Tipo de archivo no permitido')
+    if tamano_bytes <= 0 or tamano_bytes > config.MAX_CONTENT_LENGTH:
+        raise ErrorSubida(f'Tamano invalido (maximo {formatear_tamano(config.MAX_CONTENT_LENGTH)})')
+
+    ruta_parcial = config.UPLOAD_FOLDER / f"{uuid.uuid4()}.part"
+    with open(ruta_parcial, 'wb') as f:
+        f.truncate(tamano_bytes)
+
+    subida_id = models.crear_subida(nombre_original, tamano_bytes,
+                                    fecha_modificacion or datetime.now().isoformat(),
+                                    str(ruta_parcial))
+    return {'id': subida_id, 'tamano_bytes': tamano_bytes,
+            'tamano_parte': config.UPLOAD_CHUNK_MB * 1024 * 1024}
+
+
+def escribir_parte(subida_id: str, offset: int, origen, longitud: int) -> int:
+    """
+    Escribe una parte de la subida en su offset del archivo parcial.
+
+    Args:
+        subida_id: ID de la subida
+        offset: Posicion del primer byte de la parte
+        origen: Stream con el contenido (request.stream)
+        longitud: Bytes que trae la parte (Content-Length)
+
+    Returns:
+        Bytes escritos
+    """
+    subida = models.obtener_subida(subida_id)
+    if not subida:
+        raise KeyError(subida_id)
+    if offset < 0 or longitud <= 0 or offset + longitud > subida['tamano_bytes']:
+        raise ErrorSubida('La parte excede el tamano declarado de la subida')
+
+    escritos = 0
+    with open(subida['ruta_parcial'], 'r+b') as f:
+        f.seek(offset)
+        while escritos < longitud:
+            bloque = origen.read(min(TAMANO_BLOQUE, longitud - escritos))
+            if not bloque:
+                break
+            f.write(bloque)
+            escritos += len(bloque)
+
+    if escritos != longitud:
+        # Conexion cortada: la parte no se registra y el cliente la reenvia
+        raise ErrorSubida(f'Parte incompleta: {escritos} de {longitud} bytes')
+
+    models.registrar_parte_subida(subida_id, offset, escritos)
+    return escritos
+
+
+def _rangos_recibidos(partes: list) -> list:
+    """Une las partes (offset, tamano) en rangos contiguos [inicio, fin)."""
+    rangos = []
+    for offset, tamano in partes:
+        if rangos and offset <= rangos[-1][1]:
+            rangos[-1][1] = max(rangos[-1][1], offset + tamano)
+        else:
+            rangos.append([offset, offset + tamano])
+    return rangos
+
+
+def estado_subida(subida_id: str) -> dict:
+    """Rangos recibidos de una subida, para que el cliente reanude lo que falta."""
+    subida = models.obtener_subida(subida_id)
+    if not subida:
         return None
+    rangos = _rangos_recibidos(models.listar_partes_subida(subida_id))
+    return {
+        'id': subida_id,
+        'nombre_original': subida['nombre_original'],
+        'tamano_bytes': subida['tamano_bytes'],
+        'bytes_recibidos': sum(fin - inicio for inicio, fin in rangos),
+        'rangos_recibidos': rangos,
+    }
+
+
+def finalizar_subida(subida_id: str, hash_cliente: str = None) -> dict:
+    """
+    Completa una subida por partes: verifica que se recibieron todos los
+    bytes, calcula el hash (y lo compara con el del cliente, si lo envio) y
+    registra el archivo como cualquier otra subida.
+
+    Returns:
+        dict como guardar_archivo, con 'ya_existia'
+    """
+    subida = models.obtener_subida(subida_id)
+    if not subida:
+        raise KeyError(subida_id)
+
+    rangos = _rangos_recibidos(models.listar_partes_subida(subida_id))
+    if rangos != [[0, subida['tamano_bytes']]]:
+        raise ErrorSubida('Faltan partes por recibir')
+
+    ruta_parcial = Path(subida['ruta_parcial'])
+    hash_archivo = generar_hash_archivo(ruta_parcial)
+    if hash_cliente and hash_cliente.lower() != hash_archivo:
+        raise ErrorSubida('El hash no coincide con el contenido recibido')
+
+    models.eliminar_subida(subida_id)
+    return _registrar_archivo(ruta_parcial, subida['nombre_original'], subida['fecha_modificacion'],
+                              subida['tamano_bytes'], hash_archivo)
+
+
+def cancelar_subida(subida_id: str) -> bool:
+    """Descarta una subida por partes y su archivo parcial."""
+    subida = models.obtener_subida(subida_id)
+    if not subida:
+        return False
+    Path(subida['ruta_parcial']).unlink(missing_ok=True)
+    return models.eliminar_subida(subida_id)
 
 
 def buscar_archivo_duplicado(nombre: str, tamano: int, fecha_mod: str) -> dict:
@@ -167,14 +456,10 @@ def eliminar_archivo_fisico(archivo_id: str) -> bool:
     if not archivo:
         return False
 
-    ruta = Path(archivo['ruta_archivo'])
-
     try:
-        if ruta.exists():
-            ruta.unlink()
-            logger.info(f"Archivo fisico eliminado: {ruta}")
-
+        # El archivo fisico puede estar compartido con otros registros
         models.eliminar_archivo(archivo_id)
+        _liberar_contenido(archivo['ruta_archivo'])
         return True
 
     except Exception as e:
@@ -184,7 +469,9 @@ def eliminar_archivo_fisico(archivo_id: str) -> bool:
 
 def crear_zip(archivos: list, nombre_zip: str) -> Path:
     """
-    Crea un archivo ZIP con maxima compresion.
+    Crea un archivo ZIP a partir de archivos ya escritos en disco.
+    Los procesadores que generan sus partes en memoria deben escribirlas
+    directamente con utils.zip_salida.ZipSalida.
 
     Args:
         archivos: Lista de tuplas (ruta_archivo, nombre_en_zip)
@@ -193,15 +480,74 @@ def crear_zip(archivos: list, nombre_zip: str) -> Path:
     Returns:
         Path al archivo ZIP creado
     """
-    ruta_zip = config.OUTPUT_FOLDER / nombre_zip
-
-    with zipfile.ZipFile(str(ruta_zip), 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+    with ZipSalida(config.OUTPUT_FOLDER / nombre_zip) as zs:
         for ruta_archivo, nombre_en_zip in archivos:
             if Path(ruta_archivo).exists():
-                zf.write(ruta_archivo, nombre_en_zip)
+                zs.agregar_archivo(Path(ruta_archivo), nombre_en_zip)
+    return zs.ruta
+
+
+def eliminar_resultado(ruta_resultado: str, trabajo_id: str) -> bool:
+    """
+    Elimina el archivo de resultado de un trabajo y sus entradas de cache.
+    Si otro trabajo comparte el mismo resultado (resuelto desde la cache)
+    el archivo se conserva.
+
+    Returns:
+        True si el archivo fue eliminado
+    """
+    models.eliminar_cache_por_ruta(ruta_resultado)
+    if models.contar_trabajos_con_resultado(ruta_resultado, excluir_trabajo_id=trabajo_id):
+        return False
 
-    logger.info(f"ZIP creado: {ruta_zip} ({ruta_zip.stat().st_size} bytes)")
-    return ruta_zip
+    ruta = Path(ruta_resultado)
+    if ruta.exists():
+        try:
+            ruta.unlink()
+            logger.info(f"Archivo de resultado eliminado: {ruta}")
+            return True
+        except Exception as e:
+            logger.error(f"Error eliminando archivo de resultado: {e}")
+    return False
+
+
+def desalojar_cache_resultados() -> int:
+    """
+    Aplica los limites de la cache de resultados: descarta las entradas sin
+    uso en RESULT_CACHE_TTL_HOURS y, de la menos a la mas recientemente
+    usada, las que excedan RESULT_CACHE_MAX_MB. El archivo solo se borra si
+    ningun trabajo vigente lo referencia (si no, lo borra la limpieza de
+    huerfanos cuando expiren esos trabajos).
+
+    Returns:
+        Cantidad de entradas desalojadas
+    """
+    entradas = models.listar_cache_resultados()
+    limite_bytes = config.RESULT_CACHE_MAX_MB * 1024 * 1024
+    fecha_limite = datetime.now() - timedelta(hours=config.RESULT_CACHE_TTL_HOURS)
+    total_bytes = sum(e['tamano_bytes'] or 0 for e in entradas)
+    desalojadas = 0
+
+    for entrada in entradas:
+        ruta = Path(entrada['ruta_resultado'])
+        vencida = datetime.fromisoformat(entrada['fecha_ultimo_uso']) < fecha_limite
+        if ruta.exists() and not vencida and total_bytes <= limite_bytes:
+            continue
+
+        models.eliminar_cache_resultado(entrada['clave'])
+        total_bytes -= entrada['tamano_bytes'] or 0
+        desalojadas += 1
+
+        if ruta.exists() and not models.contar_trabajos_con_resultado(str(ruta)):
+            try:
+                ruta.unlink()
+            except Exception as e:
+                logger.error(f"Error eliminando resultado en cache {ruta}: {e}")
+
+    if desalojadas:
+        logger.info(f"Cache de resultados: {desalojadas} entradas desalojadas "
+                    f"({formatear_tamano(max(total_bytes, 0))} retenidos)")
+    return desalojadas
 
 
 def limpiar_archivos_expirados() -> dict:
@@ -212,31 +558,30 @@ def limpiar_archivos_expirados() -> dict:
     Returns:
         dict con cantidad de archivos y trabajos eliminados
     """
-    fecha_limite = datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)
     archivos_eliminados = 0
     trabajos_eliminados = 0
 
-    # Obtener archivos expirados de la BD
-    archivos = models.listar_archivos()
+    # Registros expirados; su archivo fisico se borra solo si nadie mas lo usa
+    for ruta in models.eliminar_archivos_expirados():
+        if _liberar_contenido(ruta):
+            archivos_eliminados += 1
 
-    for archivo in archivos:
-        fecha_subida = datetime.fromisoformat(archivo['fecha_subida'])
-        if fecha_subida < fecha_limite:
-            ruta = Path(archivo['ruta_archivo'])
-            if ruta.exists():
-                try:
-                    ruta.unlink()
-                    archivos_eliminados += 1
-                except Exception as e:
-                    logger.error(f"Error eliminando {ruta}: {e}")
+    # Subidas por partes abandonadas (el parcial cae con los huerfanos)
+    for subida in models.listar_subidas_expiradas():
+        models.eliminar_subida(subida['id'])
 
-    # Limpiar registros de la BD
-    models.eliminar_archivos_expirados()
     trabajos_eliminados = models.eliminar_trabajos_expirados()
+    models.eliminar_estimaciones_expiradas()
 
-    # Limpiar archivos huerfanos en uploads/
+    # Cache de resultados: sus archivos sobreviven a la retencion normal
+    desalojar_cache_resultados()
+    en_cache = {Path(e['ruta_resultado']) for e in models.listar_cache_resultados()}
+    referenciados = {Path(r) for r in models.listar_rutas_archivos()}
+
+    # Limpiar archivos huerfanos en uploads/ (un contenido antiguo puede
+    # seguir referenciado por una subida reciente del mismo archivo)
     for archivo in config.UPLOAD_FOLDER.iterdir():
-        if archivo.is_file():
+        if archivo.is_file() and archivo not in referenciados:
             edad = datetime.now() - datetime.fromtimestamp(archivo.stat().st_mtime)
             if edad > timedelta(hours=config.FILE_RETENTION_HOURS):
                 try:
@@ -247,7 +592,7 @@ def limpiar_archivos_expirados() -> dict:
 
     # Limpiar archivos huerfanos en outputs/
     for archivo in config.OUTPUT_FOLDER.iterdir():
-        if archivo.is_file():
+        if archivo.is_file() and archivo not in en_cache:
             edad = datetime.now() - datetime.fromtimestamp(archivo.stat().st_mtime)
             if edad > timedelta(hours=config.FILE_RETENTION_HOURS):
                 try:
@@ -256,6 +601,8 @@ def limpiar_archivos_expirados() -> dict:
                 except Exception as e:
                     logger.error(f"Error eliminando huerfano {archivo}: {e}")
 
+    thumbnail.limpiar_cache()
+
     if archivos_eliminados > 0 or trabajos_eliminados > 0:
         logger.info(f"Limpieza: {archivos_eliminados} archivos, {trabajos_eliminados} trabajos eliminados")
 
@@ -265,48 +612,6 @@ def limpiar_archivos_expirados() -> dict:
     }
 
 
-def generar_miniatura(ruta_pdf: Path, pagina: int = 0) -> bytes:
-    """
-    Genera una miniatura PNG de una pagina del PDF.
-
-    Args:
-        ruta_pdf: Ruta al archivo PDF
-        pagina: Numero de pagina (0-indexed)
-
-    Returns:
-        Bytes de la imagen PNG
-    """
-    try:
-        doc = fitz.open(str(ruta_pdf))
-
-        if pagina >= len(doc):
-            pagina = len(doc) - 1
-
-        pag = doc[pagina]
-
-        # Calcular zoom para el tamanio deseado
-        zoom = config.THUMBNAIL_DPI / 72
-        matriz = fitz.Matrix(zoom, zoom)
-
-        # Renderizar pagina
-        pix = pag.get_pixmap(matrix=matriz)
-
-        # Convertir a RGB si el espacio de color no es compatible con PNG
-        # (CMYK, alpha extra, etc.) — frecuente en PDFs de imprenta en Linux
-        if pix.n > 4 or (pix.n == 4 and not pix.alpha):
-            pix = fitz.Pixmap(fitz.csRGB, pix)
-
-        # Convertir a PNG
-        png_bytes = pix.tobytes("png")
-
-        doc.close()
-        return png_bytes
-
-    except Exception as e:
-        logger.error(f"Error generando miniatura (pagina={pagina}, ruta={ruta_pdf}): {e}")
-        return None
-
-
 def obtener_ruta_archivo(archivo_id: str) -> Path:
     """Obtiene la ruta fisica de un archivo por su ID."""
     archivo = models.obtener_archivo(archivo_id)
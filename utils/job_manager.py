@@ -2,19 +2,36 @@
 """
 Gestor de trabajos de conversion para PDFexport.
 Maneja la cola de trabajos y ejecucion en segundo plano.
+
+La cola es la propia tabla 'trabajos' de SQLite: los workers reclaman
+trabajos con un lease que renuevan por heartbeat. Varios procesos o
+contenedores pueden compartir la misma base, y los trabajos cuyo worker
+murio se reintentan automaticamente al vencer el lease.
 """
 
+import atexit
 import ctypes
 import gc
+import hashlib
+import multiprocessing
+import os
+import signal
+import socket
 import threading
+import time
 import queue
 import json
 import logging
+import uuid
 from datetime import datetime
-from typing import Callable, Dict, Any
+from pathlib import Path
+from typing import Callable, Dict, Any, List
+
+from flask import has_request_context, request
 
 import models
 import config
+from utils import eventos, file_manager
 
 logger = logging.getLogger(__name__)
 
@@ -35,29 +52,260 @@ def liberar_memoria():
     except Exception:
         pass  # Windows o sistema sin glibc: gc.collect() igual libera objetos
 
-# Cola global de trabajos
-cola_trabajos = queue.Queue()
+# Identificador de este proceso como worker de la cola: host + pid + arranque.
+# El sufijo aleatorio distingue reinicios (en Docker el pid suele ser siempre 1).
+PREFIJO_WORKER = f"{socket.gethostname()}:"
+WORKER_ID = f"{PREFIJO_WORKER}{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Clases de prioridad (menor = antes). Los trabajos en espera suben una
+# clase cada config.JOB_AGING_SEG segundos para no postergar a los masivos.
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_NORMAL = 1
+PRIORIDAD_MASIVA = 2
+
+# Avisa a los workers de este proceso que hay un trabajo nuevo (evita esperar el polling)
+_hay_trabajo = threading.Event()
+
+# Trabajos que este proceso esta ejecutando (para renovar sus leases)
+_trabajos_en_curso: set = set()
 
 # Diccionario de procesadores por tipo de conversion
 procesadores: Dict[str, Callable] = {}
 
+# Maximo de trabajos simultaneos por tipo (tipos sin entrada no tienen limite)
+limites_concurrencia: Dict[str, int] = {}
+
+# Tipos que se ejecutan en un proceso hijo (ver config.JOB_PROCESS_BACKEND)
+tipos_en_proceso: set = set()
+
+# Estimadores de costo propios de un tipo: (archivo, parametros) -> costo
+estimadores_costo: Dict[str, Callable] = {}
+
+# Tiempo limite propio por tipo (sobrescribe config.JOB_TIMEOUT_SEG)
+timeouts_por_tipo: Dict[str, int] = {}
+
+# Cada cuanto se verifican limites y cancelacion de un proceso hijo (segundos)
+INTERVALO_CONTROL_SEG = 2
+
+# Procesos hijo en ejecucion (trabajo_id -> Process), para terminarlos al salir
+procesos_activos: Dict[str, multiprocessing.Process] = {}
+_lock_procesos = threading.Lock()
+_contexto_mp = None
+
+# Canal hacia el proceso padre. Solo se asigna dentro de un proceso hijo:
+# actualizar_progreso() lo usa en lugar de escribir en la BD.
+_canal_progreso = None
+
+# Trabajos en ejecucion por tipo en este proceso (limites de concurrencia)
+_en_ejecucion: Dict[str, int] = {}
+_lock_concurrencia = threading.Lock()
+
+# Progreso pendiente de escribir en la BD (trabajo_id -> (progreso, mensaje)).
+# Lo vuelca en lotes el thread flush-progreso cada config.PROGRESS_FLUSH_MS.
+_progreso_pendiente: Dict[str, tuple] = {}
+_lock_progreso = threading.Lock()
+_thread_flush = None
+
+# Resumen de la cola para /status, recalculado periodicamente
+# (ver actualizar_instantanea_estado)
+_instantanea_estado = None
+
+# Threads worker activos
+threads_worker: List[threading.Thread] = []
+
 # Flag para detener el worker
 detener_worker = threading.Event()
 
 
-def registrar_procesador(tipo: str, funcion: Callable):
+class TrabajoCancelado(Exception):
+    """El trabajo fue cancelado por el usuario mientras se ejecutaba."""
+
+
+def registrar_procesador(tipo: str, funcion: Callable, max_concurrentes: int = None,
+                         en_proceso: bool = False, timeout_seg: int = None,
+                         estimador_costo: Callable = None):
     """
     Registra una funcion procesadora para un tipo de conversion.
 
     Args:
         tipo: Tipo de conversion (ej: 'to-txt', 'to-png')
         funcion: Funcion que procesa el trabajo
+        max_concurrentes: Maximo de trabajos de este tipo ejecutandose a la vez.
+                          None = sin limite propio (solo el de JOB_WORKERS).
+        en_proceso: Ejecutar en un proceso hijo (procesadores CPU-bound en
+                    Python puro). La funcion debe ser de nivel de modulo.
+        timeout_seg: Tiempo limite propio del tipo (solo para en_proceso).
+                     None = config.JOB_TIMEOUT_SEG.
+        estimador_costo: Funcion (archivo, parametros) -> costo, en las mismas
+                         unidades que _estimar_costo. None = paginas + MB de entrada.
     """
     procesadores[tipo] = funcion
-    logger.info(f"Procesador registrado: {tipo}")
+    if en_proceso:
+        tipos_en_proceso.add(tipo)
+    if timeout_seg:
+        timeouts_por_tipo[tipo] = timeout_seg
+    if estimador_costo:
+        estimadores_costo[tipo] = estimador_costo
+    if max_concurrentes:
+        limites_concurrencia[tipo] = max_concurrentes
+        logger.info(f"Procesador registrado: {tipo} (max {max_concurrentes} simultaneos)")
+    else:
+        logger.info(f"Procesador registrado: {tipo}")
+
+
+def _reclamar_siguiente():
+    """
+    Reclama de la BD el siguiente trabajo que este proceso puede ejecutar.
+
+    Los tipos que alcanzaron su limite de concurrencia se excluyen del reclamo,
+    asi el trabajo sigue en la cola para otro worker/proceso. El reclamo y la
+    reserva del cupo se hacen bajo el mismo lock para no exceder el limite.
+    """
+    with _lock_concurrencia:
+        saturados = [
+            tipo for tipo, limite in limites_concurrencia.items()
+            if _en_ejecucion.get(tipo, 0) >= limite
+        ]
+        trabajo = models.reclamar_trabajo(
+            WORKER_ID, config.JOB_LEASE_SEG, list(procesadores.keys()), saturados,
+            envejecimiento_seg=config.JOB_AGING_SEG
+        )
+        if trabajo:
+            tipo = trabajo['tipo_conversion']
+            _en_ejecucion[tipo] = _en_ejecucion.get(tipo, 0) + 1
+            _trabajos_en_curso.add(trabajo['id'])
+        return trabajo
+
+
+def _liberar_cupo(trabajo_id: str, tipo: str):
+    """Libera el cupo del tipo y despierta a los workers por si habia trabajos esperandolo."""
+    with _lock_concurrencia:
+        _en_ejecucion[tipo] = max(0, _en_ejecucion.get(tipo, 0) - 1)
+        _trabajos_en_curso.discard(trabajo_id)
+    _hay_trabajo.set()
+
+
+def cliente_actual() -> str:
+    """
+    Identifica al cliente de la peticion HTTP en curso para el reparto equitativo.
+
+    Usa la API key (header X-API-Key, guardada como hash) o, si no hay, la IP
+    de la conexion. X-Forwarded-For no se lee aqui: cualquiera puede enviarlo;
+    con PROXY_HOPS > 0 ProxyFix ya dejo en remote_addr la IP que vio el proxy.
+    Fuera de una peticion retorna None.
+    """
+    if not has_request_context():
+        return None
+
+    api_key = request.headers.get('X-API-Key', '').strip()
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    return 'ip:' + (request.remote_addr or '0.0.0.0')
+
+
+def _estimar_costo(archivo: dict, tipo_conversion: str = None, parametros: dict = None) -> float:
+    """
+    Costo relativo de un trabajo: paginas + MB del archivo de entrada, o lo
+    que devuelva el estimador registrado para el tipo (si falla, se usa el
+    de paginas + MB). Los trabajos sin archivo (URLs, merges) cuentan como
+    costo minimo.
+    """
+    if not archivo:
+        return 1.0
+    estimador = estimadores_costo.get(tipo_conversion)
+    if estimador:
+        try:
+            return estimador(archivo, parametros)
+        except Exception as e:
+            logger.warning(f"No se pudo estimar el costo de {tipo_conversion} "
+                           f"sobre {archivo['id']}: {e}")
+    return (archivo['num_paginas'] or 1) + archivo['tamano_bytes'] / (1024 * 1024)
+
+
+def clasificar_prioridad(costo: float) -> int:
+    """Clase de prioridad segun el costo: 0 interactiva, 1 normal, 2 masiva."""
+    if costo <= config.JOB_COSTO_INTERACTIVO:
+        return PRIORIDAD_INTERACTIVA
+    if costo >= config.JOB_COSTO_MASIVO:
+        return PRIORIDAD_MASIVA
+    return PRIORIDAD_NORMAL
+
+
+def clave_cache(hash_archivo: str, tipo_conversion: str, parametros: dict = None) -> str:
+    """
+    Clave de la cache de resultados: hash del contenido + tipo + parametros
+    canonicos (claves ordenadas, sin espacios), para que el mismo pedido con
+    los parametros en otro orden reutilice el mismo resultado.
+    """
+    canonicos = json.dumps(parametros or {}, sort_keys=True, separators=(',', ':'),
+                           ensure_ascii=False)
+    return hashlib.sha256(f"{hash_archivo}|{tipo_conversion}|{canonicos}".encode('utf-8')).hexdigest()
+
+
+def _buscar_en_cache(clave: str) -> dict:
+    """
+    Devuelve la entrada de cache si su archivo de resultado sigue en disco.
+    Las entradas cuyo archivo desaparecio se descartan.
+    """
+    entrada = models.obtener_cache_resultado(clave)
+    if not entrada:
+        return None
+
+    ruta = Path(entrada['ruta_resultado'])
+    if not ruta.exists():
+        models.eliminar_cache_resultado(clave)
+        return None
+
+    # Renovar mtime para que la limpieza de huerfanos no lo borre mientras
+    # el nuevo trabajo siga vigente
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+    models.registrar_uso_cache(clave)
+    return entrada
 
 
-def encolar_trabajo(archivo_id: str, tipo_conversion: str, parametros: dict = None) -> str:
+def etag_resultado(trabajo_id: str, ruta: str) -> str:
+    """
+    ETag del archivo de resultado, o None si no hay archivo. Un resultado no
+    se modifica despues de escrito: el trabajo que lo genero, el tamano y la
+    fecha de modificacion lo identifican sin leer el contenido (hashear
+    cientos de MB en el worker demoraba la finalizacion de cada trabajo).
+    """
+    try:
+        stat = Path(ruta).stat() if ruta else None
+    except OSError:
+        return None
+    return f"{trabajo_id}-{stat.st_size:x}-{stat.st_mtime_ns:x}" if stat else None
+
+
+def _guardar_en_cache(trabajo: dict, resultado: dict, parametros: dict):
+    """Registra en la cache el resultado de un trabajo completado."""
+    ruta = resultado.get('ruta_resultado')
+    if not trabajo.get('clave_cache') or not ruta or not Path(ruta).is_file():
+        return
+    archivo = models.obtener_archivo(trabajo['archivo_id'])
+    if not archivo or not archivo.get('hash_archivo'):
+        return
+    try:
+        models.guardar_cache_resultado(
+            clave=trabajo['clave_cache'],
+            hash_archivo=archivo['hash_archivo'],
+            tipo_conversion=trabajo['tipo_conversion'],
+            parametros=trabajo['parametros'],
+            ruta_resultado=str(ruta),
+            mensaje=resultado.get('mensaje'),
+            tamano_bytes=Path(ruta).stat().st_size,
+            hash_resultado=resultado.get('hash_resultado')
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo guardar en cache el resultado de {trabajo['id']}: {e}")
+
+
+def encolar_trabajo(archivo_id: str, tipo_conversion: str, parametros: dict = None,
+                    prioridad: int = None, cliente: str = None) -> str:
     """
     Crea un trabajo y lo agrega a la cola de procesamiento.
 
@@ -65,197 +313,684 @@ def encolar_trabajo(archivo_id: str, tipo_conversion: str, parametros: dict = No
         archivo_id: ID del archivo a procesar
         tipo_conversion: Tipo de conversion a realizar
         parametros: Parametros adicionales para la conversion
+        prioridad: Clase de prioridad explicita (PRIORIDAD_*). None = segun costo.
+        cliente: Identificador del cliente. None = el de la peticion HTTP en curso.
 
     Returns:
-        ID del trabajo creado
+        ID del trabajo creado. Si el resultado ya estaba en la cache el
+        trabajo se crea directamente como 'completado'; si hay un trabajo
+        identico pendiente o en proceso, el nuevo se acopla a el y comparte
+        su progreso y resultado.
     """
     # Serializar parametros
     parametros_json = json.dumps(parametros) if parametros else None
 
+    archivo = models.obtener_archivo(archivo_id) if archivo_id else None
+
+    # Cache de resultados: solo para trabajos sobre un archivo con hash conocido
+    clave = None
+    en_cache = None
+    if config.RESULT_CACHE_MAX_MB > 0 and archivo and archivo.get('hash_archivo'):
+        clave = clave_cache(archivo['hash_archivo'], tipo_conversion, parametros)
+        en_cache = _buscar_en_cache(clave)
+
+    # El costo solo se calcula si el trabajo va a entrar en la cola: no para
+    # un resultado en cache ni para uno que se acopla a un trabajo identico en curso
+    acoplado = bool(clave) and not en_cache and models.hay_trabajo_en_curso(clave)
+    costo = 0.0 if en_cache or acoplado else _estimar_costo(archivo, tipo_conversion, parametros)
+    prioridad_explicita = prioridad is not None
+    if not prioridad_explicita:
+        prioridad = clasificar_prioridad(costo)
+
     # Crear registro en BD
     trabajo_id = models.crear_trabajo(
         archivo_id=archivo_id,
         tipo_conversion=tipo_conversion,
-        parametros=parametros_json
+        parametros=parametros_json,
+        prioridad=prioridad,
+        costo_estimado=round(costo, 2),
+        cliente=cliente or cliente_actual(),
+        clave_cache=clave,
+        resultado_cache=en_cache
     )
 
-    # Agregar a la cola
-    cola_trabajos.put(trabajo_id)
-    logger.info(f"Trabajo encolado: {trabajo_id} ({tipo_conversion})")
+    if en_cache:
+        logger.info(f"Trabajo resuelto desde cache: {trabajo_id} ({tipo_conversion})")
+        return trabajo_id
+
+    # Single-flight: si ya hay uno identico en curso, este solo lo acompania
+    if clave:
+        lider_id = models.obtener_trabajo(trabajo_id).get('lider_id')
+        if lider_id:
+            logger.info(f"Trabajo acoplado a {lider_id}: {trabajo_id} ({tipo_conversion})")
+            return trabajo_id
+
+    if acoplado:
+        # El trabajo identico termino antes del INSERT: este si se ejecuta
+        costo = _estimar_costo(archivo, tipo_conversion, parametros)
+        if not prioridad_explicita:
+            prioridad = clasificar_prioridad(costo)
+        models.actualizar_costo_trabajo(trabajo_id, prioridad, round(costo, 2))
+
+    # El registro 'pendiente' ya es la entrada en la cola: despertar a los workers
+    _hay_trabajo.set()
+    logger.info(f"Trabajo encolado: {trabajo_id} ({tipo_conversion}, prioridad {prioridad})")
 
     return trabajo_id
 
 
-def procesar_trabajo(trabajo_id: str):
+def notificar_cambio(trabajo_id: str):
     """
-    Procesa un trabajo individual.
-
-    Args:
-        trabajo_id: ID del trabajo a procesar
+    Publica el estado actual del trabajo a los streams de progreso que lo
+    observan (no consulta la BD si no hay ninguno).
     """
-    trabajo = models.obtener_trabajo(trabajo_id)
+    if eventos.observado(trabajo_id):
+        eventos.publicar_trabajo(models.obtener_trabajo(trabajo_id))
 
-    if not trabajo:
-        logger.error(f"Trabajo no encontrado: {trabajo_id}")
-        return
 
-    if trabajo['estado'] == 'cancelado':
-        logger.info(f"Trabajo cancelado, omitiendo: {trabajo_id}")
-        return
+def procesar_trabajo(trabajo: dict):
+    """
+    Procesa un trabajo individual ya reclamado de la cola (estado 'procesando').
 
+    Args:
+        trabajo: Registro del trabajo devuelto por models.reclamar_trabajo
+    """
+    trabajo_id = trabajo['id']
     tipo = trabajo['tipo_conversion']
 
     if tipo not in procesadores:
-        models.actualizar_trabajo(
-            trabajo_id,
+        models.finalizar_trabajo(
+            trabajo_id, trabajo.get('worker_id'),
             estado='error',
             mensaje=f"Tipo de conversion no soportado: {tipo}"
         )
+        notificar_cambio(trabajo_id)
         logger.error(f"Procesador no encontrado: {tipo}")
+        _liberar_cupo(trabajo_id, tipo)
         return
 
-    # Marcar como procesando
-    models.actualizar_trabajo(trabajo_id, estado='procesando', progreso=0)
-    logger.info(f"Iniciando trabajo: {trabajo_id} ({tipo})")
+    intento = f" (intento {trabajo['intentos']})" if (trabajo.get('intentos') or 0) > 1 else ''
+    logger.info(f"Iniciando trabajo: {trabajo_id} ({tipo}){intento}")
+    eventos.publicar_trabajo(trabajo)
 
     try:
         # Parsear parametros
         parametros = json.loads(trabajo['parametros']) if trabajo['parametros'] else {}
 
-        # Ejecutar procesador
+        # Ejecutar procesador (en proceso hijo si es CPU-bound)
         procesador = procesadores[tipo]
-        resultado = procesador(
-            trabajo_id=trabajo_id,
-            archivo_id=trabajo['archivo_id'],
-            parametros=parametros
-        )
-
-        # Marcar como completado
-        models.actualizar_trabajo(
-            trabajo_id,
+        if config.JOB_PROCESS_BACKEND and tipo in tipos_en_proceso:
+            resultado = _ejecutar_en_proceso(
+                procesador, trabajo_id, trabajo['archivo_id'], parametros,
+                timeout_seg=timeouts_por_tipo.get(tipo, config.JOB_TIMEOUT_SEG)
+            )
+        else:
+            resultado = procesador(
+                trabajo_id=trabajo_id,
+                archivo_id=trabajo['archivo_id'],
+                parametros=parametros
+            )
+
+        # ETag de la descarga (reanudable con Range/If-Range)
+        resultado['hash_resultado'] = etag_resultado(trabajo_id, resultado.get('ruta_resultado'))
+
+        # Marcar como completado, solo si el trabajo sigue siendo de este worker
+        if not models.finalizar_trabajo(
+            trabajo_id, trabajo.get('worker_id'),
             estado='completado',
-            progreso=100,
             ruta_resultado=resultado.get('ruta_resultado'),
-            mensaje=resultado.get('mensaje', 'Conversion completada')
-        )
+            mensaje=resultado.get('mensaje', 'Conversion completada'),
+            hash_resultado=resultado['hash_resultado']
+        ):
+            logger.warning(f"Trabajo {trabajo_id} ya no pertenece a este worker "
+                           f"(reintentado en otro o cancelado): resultado descartado")
+            _descartar_resultado(trabajo_id, resultado.get('ruta_resultado'))
+            return
+        _guardar_en_cache(trabajo, resultado, parametros)
+        notificar_cambio(trabajo_id)
         logger.info(f"Trabajo completado: {trabajo_id}")
 
+    except TrabajoCancelado:
+        # El estado 'cancelado' ya fue registrado por quien cancelo
+        logger.info(f"Trabajo cancelado durante la ejecucion: {trabajo_id}")
+
     except Exception as e:
-        # Marcar como error
-        models.actualizar_trabajo(
-            trabajo_id,
-            estado='error',
-            mensaje=str(e)
-        )
+        # Marcar como error (mismo control de pertenencia que al completar)
+        if models.finalizar_trabajo(trabajo_id, trabajo.get('worker_id'),
+                                    estado='error', mensaje=str(e)):
+            notificar_cambio(trabajo_id)
         logger.error(f"Error en trabajo {trabajo_id}: {e}")
 
     finally:
+        _descartar_progreso(trabajo_id)
+        _liberar_cupo(trabajo_id, tipo)
         # Liberar memoria del procesador y devolver paginas al SO.
         # Se ejecuta siempre: exito, error o cancelacion.
         liberar_memoria()
 
 
+def _descartar_resultado(trabajo_id: str, ruta: str):
+    """
+    Elimina la salida de una ejecucion cuyo resultado no se registro. Se
+    conserva si el trabajo la usa (otro intento escribio el mismo archivo y
+    termino) o si otro intento sigue en curso y la esta escribiendo.
+    """
+    if not ruta:
+        return
+    actual = models.obtener_trabajo(trabajo_id)
+    if actual and (actual['estado'] == 'procesando' or actual.get('ruta_resultado') == ruta):
+        return
+    file_manager.eliminar_resultado(ruta, trabajo_id)
+
+
 def actualizar_progreso(trabajo_id: str, progreso: int, mensaje: str = None):
     """
     Actualiza el progreso de un trabajo en ejecucion.
     Llamado por los procesadores durante la conversion.
 
+    Dentro de un proceso hijo el progreso se envia al padre, que es quien
+    lo registra (ver _ejecutar_en_proceso).
+
     Args:
         trabajo_id: ID del trabajo
         progreso: Porcentaje de progreso (0-100)
         mensaje: Mensaje de estado opcional
     """
-    models.actualizar_trabajo(trabajo_id, progreso=progreso, mensaje=mensaje)
+    if _canal_progreso is not None:
+        _canal_progreso.put(('progreso', progreso, mensaje))
+        return
+
+    eventos.publicar(trabajo_id, 'procesando', progreso, mensaje)
+
+    if _thread_flush is None or not _thread_flush.is_alive():
+        models.actualizar_trabajo(trabajo_id, progreso=progreso, mensaje=mensaje)
+        return
+    with _lock_progreso:
+        anterior = _progreso_pendiente.get(trabajo_id)
+        if mensaje is None and anterior:
+            mensaje = anterior[1]
+        _progreso_pendiente[trabajo_id] = (progreso, mensaje)
+
+
+def _descartar_progreso(trabajo_id: str):
+    """Olvida el progreso no escrito de un trabajo que paso a un estado final."""
+    with _lock_progreso:
+        _progreso_pendiente.pop(trabajo_id, None)
+
+
+def _volcar_progreso():
+    """Escribe en un solo lote el progreso acumulado de todos los trabajos."""
+    with _lock_progreso:
+        if not _progreso_pendiente:
+            return
+        lote = dict(_progreso_pendiente)
+        _progreso_pendiente.clear()
+    try:
+        models.actualizar_progresos(lote)
+    except Exception as e:
+        logger.error(f"Error escribiendo progreso de {len(lote)} trabajos: {e}")
+
+
+def flush_progreso_worker():
+    """Thread que vuelca el progreso acumulado cada config.PROGRESS_FLUSH_MS."""
+    intervalo = config.PROGRESS_FLUSH_MS / 1000
+    while not detener_worker.wait(intervalo):
+        _volcar_progreso()
+    _volcar_progreso()
+
+
+# =============================================================================
+# Backend de ejecucion en proceso hijo
+# =============================================================================
+
+def en_proceso_hijo() -> bool:
+    """True si el codigo se esta ejecutando dentro del proceso hijo de un trabajo."""
+    return _canal_progreso is not None
+
+
+def _obtener_contexto_mp():
+    """
+    Contexto de multiprocessing para los procesos hijo.
+
+    forkserver (POSIX) evita hacer fork del proceso Flask con sus threads y
+    precarga los modulos de los procesadores, asi cada trabajo arranca rapido.
+    En Windows se usa spawn.
+    """
+    global _contexto_mp
+    if _contexto_mp is None:
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            _contexto_mp = multiprocessing.get_context('forkserver')
+            modulos = sorted({procesadores[t].__module__ for t in tipos_en_proceso})
+            _contexto_mp.set_forkserver_preload(modulos)
+        else:
+            _contexto_mp = multiprocessing.get_context('spawn')
+    return _contexto_mp
+
+
+def _vigilar_padre(padre):
+    """Termina el proceso hijo en cuanto termina el proceso padre."""
+    padre.join()
+    os._exit(1)
+
+
+def _entrada_proceso_hijo(procesador: Callable, trabajo_id: str, archivo_id: str,
+                          parametros: dict, canal):
+    """
+    Punto de entrada del proceso hijo: ejecuta el procesador y envia
+    progreso, resultado o error al padre por el canal.
+    """
+    global _canal_progreso
+    _canal_progreso = canal
+
+    # Grupo de procesos propio: al terminar el trabajo por limite se terminan
+    # tambien los subprocesos que haya lanzado (ghostscript, tesseract, etc.)
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+    # Si el proceso padre muere su lease vence y el trabajo se reintenta en
+    # otro worker: este hijo no debe seguir consumiendo recursos
+    padre = multiprocessing.parent_process()
+    if padre is not None:
+        threading.Thread(target=_vigilar_padre, args=(padre,), daemon=True).start()
+
+    logging.basicConfig(
+        level=logging.DEBUG if config.DEBUG else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    try:
+        resultado = procesador(
+            trabajo_id=trabajo_id,
+            archivo_id=archivo_id,
+            parametros=parametros
+        )
+        canal.put(('resultado', resultado))
+    except Exception as e:
+        logger.error(f"Error en proceso hijo del trabajo {trabajo_id}: {e}")
+        canal.put(('error', str(e)))
+
+
+def _pids_descendientes(pid: int) -> List[int]:
+    """PIDs de los descendientes de un proceso (Linux, via /proc). Vacio si no disponible."""
+    descendientes = []
+    pendientes = [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        try:
+            for tarea in os.listdir(f'/proc/{actual}/task'):
+                with open(f'/proc/{actual}/task/{tarea}/children') as f:
+                    hijos = [int(h) for h in f.read().split()]
+                descendientes.extend(hijos)
+                pendientes.extend(hijos)
+        except OSError:
+            continue
+    return descendientes
+
+
+def _rss_arbol_mb(pid: int):
+    """
+    Memoria residente (MB) de un proceso mas sus descendientes, leida de /proc.
+    Retorna None si /proc no esta disponible (Windows, macOS).
+    """
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    total_paginas = 0
+    for p in [pid] + _pids_descendientes(pid):
+        try:
+            with open(f'/proc/{p}/statm') as f:
+                total_paginas += int(f.read().split()[1])
+        except OSError:
+            continue  # el proceso termino entre el listado y la lectura
+    return total_paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _terminar_arbol(proceso):
+    """Termina un proceso hijo y todo su grupo: SIGTERM, y SIGKILL si no responde."""
+    def _senial(sig):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(proceso.pid, sig)
+                return
+        except (ProcessLookupError, PermissionError):
+            pass  # el hijo aun no creo su grupo: senial solo al proceso
+        if sig == signal.SIGTERM:
+            proceso.terminate()
+        else:
+            proceso.kill()
+
+    _senial(signal.SIGTERM)
+    proceso.join(timeout=5)
+    if proceso.is_alive():
+        _senial(getattr(signal, 'SIGKILL', signal.SIGTERM))
+        proceso.join()
+
+
+def _verificar_limites(trabajo_id: str, proceso, inicio: float, timeout_seg: int):
+    """
+    Controla tiempo, memoria y cancelacion de un trabajo en proceso hijo.
+    Lanza la excepcion correspondiente si hay que terminarlo.
+    """
+    transcurrido = time.monotonic() - inicio
+    if timeout_seg and transcurrido > timeout_seg:
+        raise RuntimeError(f"Tiempo limite excedido: la conversion supero {timeout_seg} segundos")
+
+    if config.JOB_MAX_RSS_MB:
+        rss_mb = _rss_arbol_mb(proceso.pid)
+        if rss_mb is not None and rss_mb > config.JOB_MAX_RSS_MB:
+            raise RuntimeError(
+                f"Limite de memoria excedido: la conversion uso {rss_mb:.0f} MB "
+                f"(maximo {config.JOB_MAX_RSS_MB} MB)"
+            )
+
+    trabajo = models.obtener_trabajo(trabajo_id)
+    if trabajo and trabajo['estado'] == 'cancelado':
+        raise TrabajoCancelado("Trabajo cancelado por el usuario")
+
+
+def _ejecutar_en_proceso(procesador: Callable, trabajo_id: str, archivo_id: str,
+                         parametros: dict, timeout_seg: int = None) -> dict:
+    """
+    Ejecuta un procesador en un proceso hijo y espera su resultado.
+
+    El progreso que reporta el hijo se reenvia a actualizar_progreso() en
+    este proceso. Si el hijo termina sin resultado (crash, OOM killer) se
+    lanza RuntimeError y el trabajo queda en error sin afectar al servidor.
+
+    Cada INTERVALO_CONTROL_SEG se verifican el tiempo limite, la memoria
+    (config.JOB_MAX_RSS_MB) y la cancelacion; si corresponde, el proceso y
+    sus subprocesos se terminan y se liberan sus recursos.
+    """
+    ctx = _obtener_contexto_mp()
+    canal = ctx.Queue()
+    proceso = ctx.Process(
+        target=_entrada_proceso_hijo,
+        args=(procesador, trabajo_id, archivo_id, parametros, canal),
+        name=f"trabajo-{trabajo_id[:8]}"
+    )
+    proceso.start()
+    with _lock_procesos:
+        procesos_activos[trabajo_id] = proceso
+    logger.info(f"Trabajo {trabajo_id} ejecutandose en proceso hijo pid={proceso.pid}")
+
+    inicio = time.monotonic()
+    proximo_control = inicio + INTERVALO_CONTROL_SEG
+
+    try:
+        while True:
+            try:
+                mensaje = canal.get(timeout=0.5)
+            except queue.Empty:
+                mensaje = None
+                if not proceso.is_alive():
+                    # El hijo termino: recoger lo que haya quedado en el canal
+                    try:
+                        mensaje = canal.get(timeout=0.5)
+                    except queue.Empty:
+                        proceso.join()
+                        raise RuntimeError(
+                            f"El proceso de conversion termino inesperadamente (codigo {proceso.exitcode})"
+                        )
+
+            if mensaje is not None:
+                if mensaje[0] == 'progreso':
+                    actualizar_progreso(trabajo_id, mensaje[1], mensaje[2])
+                elif mensaje[0] == 'resultado':
+                    return mensaje[1]
+                else:
+                    raise RuntimeError(mensaje[1])
+
+            ahora = time.monotonic()
+            if ahora >= proximo_control:
+                proximo_control = ahora + INTERVALO_CONTROL_SEG
+                try:
+                    _verificar_limites(trabajo_id, proceso, inicio, timeout_seg)
+                except Exception as e:
+                    logger.warning(f"Terminando proceso del trabajo {trabajo_id}: {e}")
+                    _terminar_arbol(proceso)
+                    raise
+    finally:
+        proceso.join(timeout=5)
+        if proceso.is_alive():
+            _terminar_arbol(proceso)
+        canal.close()
+        with _lock_procesos:
+            procesos_activos.pop(trabajo_id, None)
+
+
+def _terminar_procesos_activos():
+    """Termina los procesos hijo que sigan vivos al cerrar la aplicacion."""
+    with _lock_procesos:
+        procesos = list(procesos_activos.values())
+    for proceso in procesos:
+        if proceso.is_alive():
+            proceso.terminate()
+
+
+atexit.register(_terminar_procesos_activos)
 
 
 def worker_procesador():
     """
     Worker que procesa trabajos de la cola en segundo plano.
-    Se ejecuta en un thread separado.
+    Se ejecuta en un thread separado; hay JOB_WORKERS instancias en paralelo.
     """
-    logger.info("Worker de trabajos iniciado")
+    logger.info(f"Worker de trabajos iniciado: {threading.current_thread().name}")
 
     while not detener_worker.is_set():
         try:
-            # Esperar trabajo con timeout para poder verificar flag de detencion
-            trabajo_id = cola_trabajos.get(timeout=1)
-            procesar_trabajo(trabajo_id)
-            cola_trabajos.task_done()
-        except queue.Empty:
-            continue
+            trabajo = _reclamar_siguiente()
+            if trabajo:
+                procesar_trabajo(trabajo)
+                continue
+            # Cola vacia: esperar aviso de encolar_trabajo o el siguiente sondeo
+            # (los trabajos pueden llegar desde otros procesos que comparten la BD)
+            _hay_trabajo.wait(timeout=config.JOB_POLL_SEG)
+            _hay_trabajo.clear()
         except Exception as e:
             logger.error(f"Error en worker: {e}")
+            detener_worker.wait(config.JOB_POLL_SEG)
 
-    logger.info("Worker de trabajos detenido")
+    logger.info(f"Worker de trabajos detenido: {threading.current_thread().name}")
 
 
-def iniciar_worker():
-    """Inicia el thread worker para procesar trabajos."""
+def heartbeat_worker():
+    """
+    Renueva los leases de los trabajos en curso de este proceso y devuelve a
+    la cola los trabajos cuyo worker (de cualquier proceso) dejo de latir.
+    """
+    intervalo = max(1, config.JOB_LEASE_SEG // 3)
+
+    while not detener_worker.wait(intervalo):
+        try:
+            with _lock_concurrencia:
+                en_curso = list(_trabajos_en_curso)
+            models.renovar_leases(WORKER_ID, en_curso, config.JOB_LEASE_SEG)
+
+            recuperados = models.recuperar_trabajos_vencidos(
+                config.JOB_MAX_INTENTOS, config.JOB_RETRY_DELAY_SEG
+            )
+            if recuperados['reintentados']:
+                _hay_trabajo.set()
+        except Exception as e:
+            logger.error(f"Error en heartbeat de trabajos: {e}")
+
+
+def iniciar_worker(num_workers: int = None) -> List[threading.Thread]:
+    """
+    Inicia el pool de threads worker para procesar trabajos, mas el thread
+    de heartbeat que mantiene los leases.
+
+    Args:
+        num_workers: Cantidad de threads (default: config.JOB_WORKERS)
+
+    Returns:
+        Lista de threads iniciados
+    """
+    num_workers = num_workers or config.JOB_WORKERS
     detener_worker.clear()
-    thread = threading.Thread(target=worker_procesador, daemon=True)
-    thread.start()
-    logger.info("Thread worker iniciado")
-    return thread
+    threads_worker.clear()
+
+    for i in range(num_workers):
+        thread = threading.Thread(
+            target=worker_procesador,
+            name=f"worker-trabajos-{i + 1}",
+            daemon=True
+        )
+        thread.start()
+        threads_worker.append(thread)
+
+    threading.Thread(target=heartbeat_worker, name="heartbeat-trabajos", daemon=True).start()
+
+    global _thread_flush
+    if config.PROGRESS_FLUSH_MS > 0 and (_thread_flush is None or not _thread_flush.is_alive()):
+        _thread_flush = threading.Thread(target=flush_progreso_worker, name="flush-progreso",
+                                         daemon=True)
+        _thread_flush.start()
+
+    logger.info(f"Pool de workers iniciado: {num_workers} threads (worker_id={WORKER_ID})")
+    return threads_worker
 
 
 def detener_worker_graceful():
-    """Detiene el worker de forma graceful."""
+    """Detiene los workers de forma graceful."""
     detener_worker.set()
-    logger.info("Senial de detencion enviada al worker")
+    _hay_trabajo.set()
+    logger.info("Senial de detencion enviada a los workers")
+
+
+def workers_activos() -> int:
+    """Cantidad de threads worker vivos en este proceso."""
+    return len([t for t in threads_worker if t.is_alive()])
+
+
+def actualizar_instantanea_estado() -> dict:
+    """
+    Recalcula el resumen de la cola y los archivos (dos consultas agregadas)
+    y lo deja en memoria para /status. Lo ejecuta el scheduler cada
+    config.STATUS_REFRESH_SEG.
+    """
+    global _instantanea_estado
+
+    por_estado: Dict[str, int] = {}
+    por_tipo: Dict[str, Dict[str, int]] = {}
+    pendiente_mas_antiguo = None
+    for grupo in models.resumen_trabajos():
+        estado, tipo, cantidad = grupo['estado'], grupo['tipo_conversion'], grupo['cantidad']
+        por_estado[estado] = por_estado.get(estado, 0) + cantidad
+        if estado in ('pendiente', 'procesando'):
+            por_tipo.setdefault(tipo, {})[estado] = cantidad
+        if estado == 'pendiente' and (pendiente_mas_antiguo is None
+                                      or grupo['mas_antiguo'] < pendiente_mas_antiguo):
+            pendiente_mas_antiguo = grupo['mas_antiguo']
+
+    espera_max = None
+    if pendiente_mas_antiguo:
+        espera_max = round((datetime.now() - datetime.fromisoformat(pendiente_mas_antiguo))
+                           .total_seconds(), 1)
+
+    _instantanea_estado = {
+        'pendientes': por_estado.get('pendiente', 0),
+        'procesando': por_estado.get('procesando', 0),
+        'completados': por_estado.get('completado', 0),
+        'errores': por_estado.get('error', 0),
+        'activos_por_tipo': por_tipo,
+        'espera_pendiente_mas_antiguo_seg': espera_max,
+        'archivos_disponibles': models.contar_archivos(),
+        'actualizado': datetime.now().isoformat(),
+        '_monotonic': time.monotonic()
+    }
+    return _instantanea_estado
+
+
+def obtener_instantanea_estado() -> dict:
+    """
+    Resumen en memoria de la cola y los archivos. Solo consulta la base si
+    todavia no se calculo o si quedo desactualizado (scheduler detenido).
+    """
+    instantanea = _instantanea_estado
+    if instantanea is None or \
+            time.monotonic() - instantanea['_monotonic'] > 3 * config.STATUS_REFRESH_SEG:
+        instantanea = actualizar_instantanea_estado()
+    return {k: v for k, v in instantanea.items() if not k.startswith('_')}
 
 
 def obtener_estado_cola() -> dict:
     """
     Obtiene el estado actual de la cola de trabajos.
 
+    Los conteos salen de la instantanea en memoria; workers y trabajos en
+    ejecucion son del proceso actual y se leen al momento.
+
     Returns:
         dict con estadisticas de la cola
     """
-    pendientes = models.listar_trabajos(estado='pendiente')
-    procesando = models.listar_trabajos(estado='procesando')
-    completados = models.listar_trabajos(estado='completado')
-    errores = models.listar_trabajos(estado='error')
+    instantanea = obtener_instantanea_estado()
+
+    with _lock_concurrencia:
+        en_ejecucion = {tipo: n for tipo, n in _en_ejecucion.items() if n}
 
     return {
-        'en_cola': cola_trabajos.qsize(),
-        'pendientes': len(pendientes),
-        'procesando': len(procesando),
-        'completados': len(completados),
-        'errores': len(errores),
+        'en_cola': instantanea['pendientes'],
+        'pendientes': instantanea['pendientes'],
+        'procesando': instantanea['procesando'],
+        'completados': instantanea['completados'],
+        'errores': instantanea['errores'],
+        'activos_por_tipo': instantanea['activos_por_tipo'],
+        'espera_pendiente_mas_antiguo_seg': instantanea['espera_pendiente_mas_antiguo_seg'],
+        'actualizado': instantanea['actualizado'],
+        'worker_id': WORKER_ID,
+        'workers': workers_activos(),
+        'en_ejecucion_por_tipo': en_ejecucion,
+        'limites_concurrencia': dict(limites_concurrencia),
         'procesadores_registrados': list(procesadores.keys())
     }
 
 
-def reencolar_trabajos_pendientes():
+def _workers_caidos_de_este_host() -> List[str]:
     """
-    Reencola trabajos que quedaron pendientes al reiniciar el servidor.
+    Workers de este host que tienen trabajos 'procesando' pero cuyo proceso ya no existe.
 
-    - Estado 'pendiente': nunca empezaron, se pueden reencolar de forma segura.
-    - Estado 'procesando': fueron interrumpidos a la fuerza (kill). El archivo
-      de salida puede estar incompleto o no existir. Se marcan como error para
-      que el usuario sepa que debe intentarlo de nuevo manualmente.
+    Un worker_id con el mismo pid que este proceso pero otro sufijo de arranque
+    es un arranque anterior (caso tipico en Docker, donde el pid es siempre 1).
     """
-    pendientes = models.listar_trabajos(estado='pendiente')
-    procesando = models.listar_trabajos(estado='procesando')
+    caidos = set()
+    for trabajo in models.listar_trabajos(estado='procesando', campos=['worker_id']):
+        worker = trabajo.get('worker_id') or ''
+        if not worker.startswith(PREFIJO_WORKER) or worker == WORKER_ID:
+            continue
+        try:
+            pid = int(worker[len(PREFIJO_WORKER):].split(':')[0])
+        except ValueError:
+            continue
+        if pid == os.getpid():
+            caidos.add(worker)
+            continue
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            caidos.add(worker)
+        except (PermissionError, OSError):
+            pass  # existe otro proceso con ese pid: esperar al vencimiento del lease
+    return sorted(caidos)
 
-    # Los que estaban procesando se marcan como error (fueron interrumpidos)
-    for trabajo in procesando:
-        models.actualizar_trabajo(
-            trabajo['id'],
-            estado='error',
-            mensaje='Proceso interrumpido por reinicio del servidor. Por favor, intente nuevamente.'
-        )
-        logger.warning(
-            f"Trabajo interrumpido marcado como error: {trabajo['id']} ({trabajo['tipo_conversion']})"
-        )
 
-    # Solo reencolar los que realmente estaban pendientes (nunca empezaron)
-    for trabajo in pendientes:
-        cola_trabajos.put(trabajo['id'])
+def reencolar_trabajos_pendientes():
+    """
+    Recupera la cola al reiniciar el servidor.
+
+    - Estado 'pendiente': siguen en la tabla y los workers los reclaman solos.
+    - Estado 'procesando': los de procesos muertos de este mismo host fueron
+      interrumpidos (kill/reinicio) y se reintentan de inmediato; el resto se
+      reintenta cuando vence su lease. Tras JOB_MAX_INTENTOS se marcan como
+      error para que el usuario sepa que debe intentarlo de nuevo.
+    """
+    models.recuperar_trabajos_vencidos(
+        config.JOB_MAX_INTENTOS, workers_caidos=_workers_caidos_de_este_host()
+    )
+    pendientes = models.contar_trabajos_por_estado().get('pendiente', 0)
 
     if pendientes:
-        logger.info(f"Reencolados {len(pendientes)} trabajos pendientes")
-    if procesando:
-        logger.info(f"Marcados como error {len(procesando)} trabajos interrumpidos")
+        logger.info(f"{pendientes} trabajos pendientes en la cola")
+    _hay_trabajo.set()
 
-    return len(pendientes)
+    return pendientes
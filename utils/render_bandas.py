@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Render por bandas de paginas muy grandes para PDFexport.
+
+Un plano A0 a 600 DPI son ~560 megapixeles: un solo pixmap RGB ocupa
+~1.7 GB, y codificarlo suma otra copia. Aqui la pagina se renderiza en
+franjas horizontales (clip sobre una display list, asi el contenido se
+interpreta una sola vez) y cada franja se codifica y escribe en el destino
+antes de renderizar la siguiente: la memoria queda acotada por
+RENDER_BANDA_MB sin importar el tamano de la pagina.
+
+- PNG: un unico stream deflate alimentado fila a fila, en chunks IDAT.
+- JPEG: cada franja (multiplo de 16 filas, el alto de un MCU 4:2:0) se
+  codifica con Pillow con las mismas tablas; los datos de entropia se
+  concatenan separados por marcadores RST, con un DRI de una franja.
+- TIFF: cada franja es una tira (strip) del TIFF, comprimida por separado
+  (G4 o deflate); el IFD con las posiciones de las tiras va al final.
+"""
+
+import io
+import logging
+import math
+import struct
+import zlib
+from typing import BinaryIO, Iterator
+
+import fitz  # PyMuPDF
+from PIL import Image as PILImage
+from PIL import ImageChops
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Alto de un MCU JPEG con submuestreo 4:2:0
+ALTO_MCU = 16
+
+# Dimension maxima de un JPEG
+MAXIMO_JPEG = 65535
+
+
+def megapixeles(pagina: fitz.Page, zoom: float) -> float:
+    """Megapixeles del render de la pagina con el zoom dado."""
+    rect = pagina.rect
+    return math.ceil(rect.width * zoom) * math.ceil(rect.height * zoom) / 1e6
+
+
+def requiere_bandas(pagina: fitz.Page, zoom: float) -> bool:
+    """True si el render de la pagina supera RENDER_MAX_MEGAPIXELES."""
+    return megapixeles(pagina, zoom) > config.RENDER_MAX_MEGAPIXELES
+
+
+def _bandas(pagina: fitz.Page, zoom: float, alto_banda: int) -> Iterator[fitz.Pixmap]:
+    """Pixmaps RGB de franjas consecutivas de alto_banda filas (la ultima puede ser menor)."""
+    matriz = fitz.Matrix(zoom, zoom)
+    rect = pagina.rect
+    limite = (rect * matriz).irect
+    lista = pagina.get_displaylist()
+
+    for y in range(limite.y0, limite.y1, alto_banda):
+        y1 = min(y + alto_banda, limite.y1)
+        clip = fitz.Rect(rect.x0, y / zoom, rect.x1, y1 / zoom)
+        pix = lista.get_pixmap(matrix=matriz, colorspace=fitz.csRGB, alpha=False, clip=clip)
+        # El redondeo del clip puede sumar una fila en un borde: ajustar al alto exacto
+        if pix.irect.y0 != y or pix.irect.y1 != y1 or pix.width != limite.width:
+            ajustado = fitz.Pixmap(fitz.csRGB, fitz.IRect(limite.x0, y, limite.x1, y1), False)
+            ajustado.set_rect(ajustado.irect, (255, 255, 255))
+            ajustado.copy(pix, pix.irect & ajustado.irect)
+            pix = ajustado
+        yield pix
+
+
+def _alto_banda(ancho: int, multiplo: int = 1) -> int:
+    """Filas por franja para que cada una ocupe como maximo RENDER_BANDA_MB."""
+    filas = config.RENDER_BANDA_MB * 1024 * 1024 // (ancho * 3)
+    return max(multiplo, filas // multiplo * multiplo)
+
+
+# =============================================================================
+# PNG
+# =============================================================================
+
+def _chunk_png(destino: BinaryIO, tipo: bytes, datos: bytes):
+    destino.write(struct.pack('>I', len(datos)))
+    destino.write(tipo)
+    destino.write(datos)
+    destino.write(struct.pack('>I', zlib.crc32(datos, zlib.crc32(tipo))))
+
+
+def escribir_png(pagina: fitz.Page, zoom: float, destino: BinaryIO):
+    """Renderiza la pagina por franjas y la escribe en destino como PNG RGB."""
+    limite = (pagina.rect * fitz.Matrix(zoom, zoom)).irect
+    ancho, alto = limite.width, limite.height
+    fila = ancho * 3
+
+    destino.write(b'\x89PNG\r\n\x1a\n')
+    _chunk_png(destino, b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 2, 0, 0, 0))
+
+    compresor = zlib.compressobj(6)
+    for pix in _bandas(pagina, zoom, _alto_banda(ancho)):
+        muestras = pix.samples_mv
+        # Cada fila lleva delante su byte de filtro (0 = sin filtro)
+        filtradas = bytearray((fila + 1) * pix.height)
+        for i in range(pix.height):
+            inicio = i * pix.stride
+            filtradas[i * (fila + 1) + 1:(i + 1) * (fila + 1)] = muestras[inicio:inicio + fila]
+        comprimido = compresor.compress(filtradas)
+        if comprimido:
+            _chunk_png(destino, b'IDAT', comprimido)
+        del filtradas, muestras, pix
+
+    _chunk_png(destino, b'IDAT', compresor.flush())
+    _chunk_png(destino, b'IEND', b'')
+
+
+# =============================================================================
+# JPEG
+# =============================================================================
+
+def _segmentos_jpeg(datos: bytes) -> tuple:
+    """
+    Separa un JPEG baseline de Pillow en (segmentos previos a SOS, cabecera
+    SOS, datos de entropia). Los segmentos son (marcador, bytes completos).
+    """
+    segmentos = []
+    pos = 2  # SOI
+    while True:
+        marcador = datos[pos + 1]
+        largo = struct.unpack('>H', datos[pos + 2:pos + 4])[0]
+        segmento = datos[pos:pos + 2 + largo]
+        pos += 2 + largo
+        if marcador == 0xDA:  # SOS
+            return segmentos, segmento, datos[pos:-2]  # sin EOI
+        segmentos.append((marcador, segmento))
+
+
+def escribir_jpeg(pagina: fitz.Page, zoom: float, destino: BinaryIO, calidad: int = 85):
+    """
+    Renderiza la pagina por franjas y la escribe en destino como un JPEG
+    baseline 4:2:0. Sin optimize: todas las franjas deben compartir las
+    tablas Huffman estandar.
+    """
+    limite = (pagina.rect * fitz.Matrix(zoom, zoom)).irect
+    ancho, alto = limite.width, limite.height
+    if ancho > MAXIMO_JPEG or alto > MAXIMO_JPEG:
+        raise ValueError(f"La pagina ({ancho}x{alto} px) supera el maximo de JPEG "
+                         f"({MAXIMO_JPEG} px por lado); use PNG o menos DPI")
+
+    # El intervalo de reinicio (DRI) cuenta MCUs en 16 bits: limita el alto de la franja
+    mcus_por_fila = math.ceil(ancho / ALTO_MCU)
+    filas_mcu = min(_alto_banda(ancho, ALTO_MCU) // ALTO_MCU, MAXIMO_JPEG // mcus_por_fila)
+    alto_banda = filas_mcu * ALTO_MCU
+
+    tablas = None
+    for n, pix in enumerate(_bandas(pagina, zoom, alto_banda)):
+        img = PILImage.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv,
+                                  "raw", "RGB", pix.stride, 1)
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=calidad, subsampling=2)
+        del img, pix
+        segmentos, sos, entropia = _segmentos_jpeg(buffer.getvalue())
+        buffer.close()
+
+        actuales = [s for m, s in segmentos if m in (0xDB, 0xC4)]  # DQT, DHT
+        if tablas is None:
+            tablas = actuales
+            destino.write(b'\xff\xd8')
+            for marcador, segmento in segmentos:
+                if marcador == 0xC0:  # SOF0: alto total de la pagina
+                    segmento = segmento[:5] + struct.pack('>H', alto) + segmento[7:]
+                destino.write(segmento)
+            destino.write(b'\xff\xdd\x00\x04' + struct.pack('>H', mcus_por_fila * filas_mcu))
+            destino.write(sos)
+        else:
+            if actuales != tablas:
+                raise RuntimeError("Las franjas JPEG no comparten tablas de codificacion")
+            destino.write(bytes((0xFF, 0xD0 + (n - 1) % 8)))  # RSTn
+        destino.write(entropia)
+
+    destino.write(b'\xff\xd9')
+
+
+# =============================================================================
+# TIFF
+# =============================================================================
+
+# Etiquetas del TIFF de la primera franja que se copian al de la pagina
+# (BitsPerSample, Compression, Photometric, SamplesPerPixel; todas SHORT)
+ETIQUETAS_FORMATO_TIFF = (258, 259, 262, 277)
+
+# Tipos de las entradas del IFD: SHORT, LONG y RATIONAL
+_FORMATOS_IFD = {3: '<H', 4: '<I', 5: '<II'}
+
+
+def es_gris(pagina: fitz.Page, zoom: float) -> bool:
+    """True si ningun pixel del render tiene color (R == G == B), revisado por franjas."""
+    ancho = (pagina.rect * fitz.Matrix(zoom, zoom)).irect.width
+    for pix in _bandas(pagina, zoom, _alto_banda(ancho)):
+        r, g, b = PILImage.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv,
+                                      "raw", "RGB", pix.stride, 1).split()
+        if ImageChops.difference(r, g).getbbox() is not None or \
+                ImageChops.difference(g, b).getbbox() is not None:
+            return False
+    return True
+
+
+def _ifd_tiff(entradas: list, posicion: int) -> bytes:
+    """
+    IFD little-endian (sin IFD siguiente) para escribir en posicion, con
+    entradas (etiqueta, tipo, valores) en orden de etiqueta. Los valores que
+    no entran en los 4 bytes de la entrada van a continuacion del IFD.
+    """
+    posicion_extra = posicion + 2 + 12 * len(entradas) + 4
+    ifd, extra = [struct.pack('<H', len(entradas))], []
+    for etiqueta, tipo, valores in entradas:
+        datos = b''.join(struct.pack(_FORMATOS_IFD[tipo], *(v if tipo == 5 else (v,)))
+                         for v in valores)
+        if len(datos) <= 4:
+            campo = datos.ljust(4, b'\x00')
+        else:
+            campo = struct.pack('<I', posicion_extra)
+            posicion_extra += len(datos)
+            extra.append(datos)
+        ifd.append(struct.pack('<HHI', etiqueta, tipo, len(valores)) + campo)
+    return b''.join(ifd) + b'\x00\x00\x00\x00' + b''.join(extra)
+
+
+def escribir_tiff(pagina: fitz.Page, zoom: float, destino: BinaryIO, modo: str = 'RGB'):
+    """
+    Renderiza la pagina por franjas y la escribe en destino como un TIFF de
+    una pagina con una tira por franja: G4 para modo '1' (umbral fijo al
+    50%), deflate para 'L' y 'RGB'. destino debe admitir seek (el
+    AppendingTiffWriter del TIFF multipagina lo hace).
+    """
+    limite = (pagina.rect * fitz.Matrix(zoom, zoom)).irect
+    ancho, alto = limite.width, limite.height
+    alto_banda = _alto_banda(ancho)
+    compresion = 'group4' if modo == '1' else 'tiff_adobe_deflate'
+
+    destino.write(b'II*\x00\x00\x00\x00\x00')  # la posicion del IFD se completa al final
+    posiciones, longitudes = [], []
+    etiquetas = None
+    for pix in _bandas(pagina, zoom, alto_banda):
+        img = PILImage.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv,
+                                  "raw", "RGB", pix.stride, 1)
+        img = img.convert('L').convert('1', dither=PILImage.Dither.NONE) if modo == '1' \
+            else img.convert(modo)
+        buffer = io.BytesIO()
+        # strip_size: toda la franja en una sola tira
+        img.save(buffer, 'TIFF', compression=compresion, strip_size=ancho * 3 * alto_banda)
+        del img, pix
+
+        franja = PILImage.open(buffer)
+        if etiquetas is None:
+            etiquetas = {t: franja.tag_v2[t] for t in ETIQUETAS_FORMATO_TIFF
+                         if t in franja.tag_v2}
+        (inicio,), (longitud,) = franja.tag_v2[273], franja.tag_v2[279]
+        posiciones.append(destino.tell())
+        longitudes.append(longitud)
+        destino.write(buffer.getbuffer()[inicio:inicio + longitud])
+        franja.close()
+        buffer.close()
+
+    # El IFD debe empezar en una posicion par
+    if destino.tell() % 2:
+        destino.write(b'\x00')
+    posicion_ifd = destino.tell()
+
+    dpi = (round(zoom * 72), 1)
+    entradas = [(256, 4, (ancho,)), (257, 4, (alto,))]
+    entradas += [(etiqueta, 3, valor if isinstance(valor, tuple) else (valor,))
+                 for etiqueta, valor in etiquetas.items()]
+    entradas += [(273, 4, posiciones), (278, 4, (alto_banda,)), (279, 4, longitudes),
+                 (282, 5, (dpi,)), (283, 5, (dpi,)), (296, 3, (2,))]  # resolucion en pulgadas
+    destino.write(_ifd_tiff(sorted(entradas), posicion_ifd))
+
+    fin = destino.tell()
+    destino.seek(4)
+    destino.write(struct.pack('<I', posicion_ifd))
+    destino.seek(fin)
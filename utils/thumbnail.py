@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Miniaturas de paginas PDF para PDFexport.
+
+Las miniaturas se guardan en dos niveles, por (hash del archivo, pagina, DPI):
+una LRU en memoria (THUMBNAIL_MEMORY_MB) y una cache en disco
+(THUMBNAIL_CACHE_FOLDER, limitada a THUMBNAIL_CACHE_MAX_MB). Al estar
+indexadas por contenido, un mismo PDF subido con otro nombre reutiliza
+las miniaturas ya generadas.
+
+Los lotes (grillas de rotate, split, etc.) se resuelven abriendo el
+documento una sola vez, y tras cada subida se pregeneran en segundo plano
+las primeras THUMBNAIL_PREGENERATE paginas.
+"""
+
+import io
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Rango de DPI aceptado para miniaturas
+DPI_MINIMO = 24
+DPI_MAXIMO = 150
+
+# Maximo de miniaturas por pedido de lote
+MAX_POR_LOTE = 200
+
+# Tamano maximo de un sprite: por encima las celdas se reducen (los
+# navegadores moviles no decodifican imagenes mucho mas grandes, y el
+# sprite se arma en memoria del proceso web)
+SPRITE_MAX_MEGAPIXELES = 16
+
+# Valores: bytes PNG de una miniatura, o (bytes PNG, posiciones) de un sprite
+_memoria: "OrderedDict[tuple, object]" = OrderedDict()
+_bytes_en_memoria = 0
+_lock_memoria = threading.Lock()
+
+# Un solo thread de pregeneracion: las subidas se atienden en orden y el
+# render no compite con las peticiones por mas de un core
+_pregenerador = ThreadPoolExecutor(max_workers=1, thread_name_prefix='miniaturas')
+
+
+def _clave(archivo: dict, pagina: int, dpi: int) -> tuple:
+    return (archivo.get('hash_archivo') or archivo['id'], pagina, dpi)
+
+
+def _ruta_cache(clave: tuple) -> Path:
+    identificador, pagina, dpi = clave
+    return config.THUMBNAIL_CACHE_FOLDER / f"{identificador}_{dpi}_{pagina}.png"
+
+
+def renderizar_pagina(doc: fitz.Document, pagina: int, dpi: int = None) -> bytes:
+    """Renderiza una pagina (0-indexed) de un documento abierto como PNG."""
+    zoom = (dpi or config.THUMBNAIL_DPI) / 72
+    pix = doc[pagina].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+    # Convertir a RGB si el espacio de color no es compatible con PNG
+    # (CMYK, alpha extra, etc.) — frecuente en PDFs de imprenta en Linux
+    if pix.n > 4 or (pix.n == 4 and not pix.alpha):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    return pix.tobytes("png")
+
+
+# =============================================================================
+# Cache en memoria y en disco
+# =============================================================================
+
+def _tamano(valor) -> int:
+    return len(valor if isinstance(valor, bytes) else valor[0])
+
+
+def _leer_memoria(clave: tuple):
+    with _lock_memoria:
+        valor = _memoria.get(clave)
+        if valor is not None:
+            _memoria.move_to_end(clave)
+        return valor
+
+
+def _guardar_memoria(clave: tuple, valor):
+    global _bytes_en_memoria
+    limite = config.THUMBNAIL_MEMORY_MB * 1024 * 1024
+    if _tamano(valor) > limite:
+        return
+    with _lock_memoria:
+        anterior = _memoria.pop(clave, None)
+        if anterior is not None:
+            _bytes_en_memoria -= _tamano(anterior)
+        _memoria[clave] = valor
+        _bytes_en_memoria += _tamano(valor)
+        while _bytes_en_memoria > limite:
+            _, desalojado = _memoria.popitem(last=False)
+            _bytes_en_memoria -= _tamano(desalojado)
+
+
+def _leer_disco(clave: tuple) -> bytes:
+    ruta = _ruta_cache(clave)
+    try:
+        png = ruta.read_bytes()
+    except OSError:
+        return None
+    try:
+        os.utime(ruta)  # uso reciente: la limpieza desaloja por antiguedad
+    except OSError:
+        pass
+    return png
+
+
+def _guardar_disco(clave: tuple, png: bytes):
+    ruta = _ruta_cache(clave)
+    temporal = ruta.with_suffix(f'.{threading.get_ident()}.tmp')
+    try:
+        temporal.write_bytes(png)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar la miniatura {ruta.name}: {e}")
+        temporal.unlink(missing_ok=True)
+
+
+def _buscar(clave: tuple) -> bytes:
+    png = _leer_memoria(clave)
+    if png is None:
+        png = _leer_disco(clave)
+        if png is not None:
+            _guardar_memoria(clave, png)
+    return png
+
+
+# =============================================================================
+# API
+# =============================================================================
+
+def obtener_miniaturas(archivo: dict, paginas: List[int], dpi: int = None,
+                       solo_disco: bool = False) -> Dict[int, bytes]:
+    """
+    Miniaturas PNG de varias paginas (0-indexed). Las que no estan en cache
+    se renderizan abriendo el documento una sola vez.
+
+    Args:
+        archivo: Registro del archivo (ruta_archivo, hash_archivo)
+        paginas: Paginas pedidas (0-indexed, validas)
+        dpi: Resolucion (default THUMBNAIL_DPI)
+        solo_disco: Guardar solo en disco (pregeneracion, sin ocupar memoria)
+
+    Returns:
+        dict pagina -> bytes PNG
+    """
+    dpi = dpi or config.THUMBNAIL_DPI
+    resultado = {}
+    faltantes = []
+    for pagina in paginas:
+        png = _buscar(_clave(archivo, pagina, dpi))
+        if png is None:
+            faltantes.append(pagina)
+        else:
+            resultado[pagina] = png
+
+    if faltantes:
+        doc = fitz.open(archivo['ruta_archivo'])
+        try:
+            for pagina in faltantes:
+                clave = _clave(archivo, pagina, dpi)
+                png = renderizar_pagina(doc, pagina, dpi)
+                _guardar_disco(clave, png)
+                if not solo_disco:
+                    _guardar_memoria(clave, png)
+                resultado[pagina] = png
+        finally:
+            doc.close()
+
+    return resultado
+
+
+def obtener_miniatura(archivo: dict, pagina: int, dpi: int = None) -> bytes:
+    """Miniatura PNG de una pagina (0-indexed), desde cache si esta."""
+    return obtener_miniaturas(archivo, [pagina], dpi)[pagina]
+
+
+def etag_miniatura(archivo: dict, pagina: int, dpi: int = None) -> str:
+    """ETag estable de una miniatura: depende solo del contenido, pagina y DPI."""
+    identificador, pagina, dpi = _clave(archivo, pagina, dpi or config.THUMBNAIL_DPI)
+    return f"{identificador}-{pagina}-{dpi}"
+
+
+def componer_sprite(miniaturas: Dict[int, bytes], columnas: int = None) -> Tuple[bytes, list]:
+    """
+    Une varias miniaturas en una sola imagen PNG (grilla de celdas del
+    tamano de la miniatura mas grande, cada una arriba a la izquierda).
+    Si la grilla supera SPRITE_MAX_MEGAPIXELES, todas las miniaturas se
+    reducen en la misma proporcion.
+
+    Returns:
+        (bytes PNG, lista [pagina, x, y, ancho, alto] de cada miniatura)
+    """
+    # Image.open solo lee la cabecera: el tamano se conoce sin decodificar
+    imagenes = [(pagina, Image.open(io.BytesIO(png))) for pagina, png in sorted(miniaturas.items())]
+    columnas = columnas or math.ceil(math.sqrt(len(imagenes)))
+    filas = math.ceil(len(imagenes) / columnas)
+    ancho_max = max(img.width for _, img in imagenes)
+    alto_max = max(img.height for _, img in imagenes)
+
+    escala = min(1.0, math.sqrt(SPRITE_MAX_MEGAPIXELES * 1e6
+                                / (ancho_max * columnas * alto_max * filas)))
+    ancho_celda = max(1, int(ancho_max * escala))
+    alto_celda = max(1, int(alto_max * escala))
+
+    sprite = Image.new('RGB', (ancho_celda * columnas, alto_celda * filas), 'white')
+    posiciones = []
+    for i, (pagina, img) in enumerate(imagenes):
+        x, y = (i % columnas) * ancho_celda, (i // columnas) * alto_celda
+        rgba = img.convert('RGBA')
+        img.close()
+        if escala < 1.0:
+            rgba = rgba.resize((min(ancho_celda, max(1, round(rgba.width * escala))),
+                                min(alto_celda, max(1, round(rgba.height * escala)))),
+                               Image.Resampling.LANCZOS)
+        sprite.paste(rgba, (x, y), rgba)
+        posiciones.append([pagina, x, y, rgba.width, rgba.height])
+        del rgba
+
+    salida = io.BytesIO()
+    sprite.save(salida, 'PNG', compress_level=1)
+    return salida.getvalue(), posiciones
+
+
+def obtener_sprite(archivo: dict, paginas: List[int], dpi: int = None) -> Tuple[bytes, list]:
+    """Sprite de las paginas pedidas; los ya compuestos se sirven desde memoria."""
+    dpi = dpi or config.THUMBNAIL_DPI
+    clave = ('sprite', archivo.get('hash_archivo') or archivo['id'], tuple(paginas), dpi)
+    sprite = _leer_memoria(clave)
+    if sprite is None:
+        sprite = componer_sprite(obtener_miniaturas(archivo, paginas, dpi))
+        _guardar_memoria(clave, sprite)
+    return sprite
+
+
+def pregenerar(archivo: dict):
+    """Programa en segundo plano las miniaturas de las primeras paginas de un PDF."""
+    total = min(archivo.get('num_paginas') or 0, config.THUMBNAIL_PREGENERATE)
+    if total <= 0:
+        return
+
+    def tarea():
+        try:
+            obtener_miniaturas(archivo, list(range(total)), solo_disco=True)
+        except Exception as e:
+            logger.warning(f"No se pudieron pregenerar miniaturas de {archivo['id']}: {e}")
+
+    _pregenerador.submit(tarea)
+
+
+def limpiar_cache() -> int:
+    """
+    Desaloja miniaturas en disco sin uso durante FILE_RETENTION_HOURS y, de
+    la menos a la mas recientemente usada, las que excedan THUMBNAIL_CACHE_MAX_MB.
+
+    Returns:
+        Cantidad de miniaturas eliminadas
+    """
+    entradas = []
+    for ruta in config.THUMBNAIL_CACHE_FOLDER.iterdir():
+        try:
+            estado = ruta.stat()
+        except OSError:
+            continue
+        entradas.append((estado.st_mtime, estado.st_size, ruta))
+    entradas.sort()
+
+    limite_bytes = config.THUMBNAIL_CACHE_MAX_MB * 1024 * 1024
+    fecha_limite = (datetime.now() - timedelta(hours=config.FILE_RETENTION_HOURS)).timestamp()
+    total_bytes = sum(tamano for _, tamano, _ in entradas)
+    eliminadas = 0
+
+    for mtime, tamano, ruta in entradas:
+        if mtime >= fecha_limite and total_bytes <= limite_bytes:
+            break
+        try:
+            ruta.unlink()
+            total_bytes -= tamano
+            eliminadas += 1
+        except OSError as e:
+            logger.error(f"Error eliminando miniatura {ruta}: {e}")
+
+    if eliminadas:
+        logger.info(f"Cache de miniaturas: {eliminadas} eliminadas")
+    return eliminadas
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura directa de resultados ZIP para PDFexport.
+
+Los procesadores escriben cada parte (pagina, corte, hoja) directamente en
+el ZIP final en lugar de guardarla en OUTPUT_FOLDER y comprimirla despues.
+Los contenidos ya comprimidos (PNG, JPEG, PDF con streams comprimidos...)
+se guardan sin recomprimir (STORED); el resto usa un nivel de DEFLATE
+rapido (ZIP_COMPRESSLEVEL).
+
+La compresion de cada miembro (DEFLATE y CRC32, que liberan el GIL) se
+reparte entre ZIP_THREADS threads mientras el procesador sigue generando
+partes; los miembros se escriben en el orden en que se agregaron. Como
+zipfile no admite miembros ya comprimidos, el ZIP (con ZIP64 cuando hace
+falta) se arma aqui.
+"""
+
+import io
+import logging
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Formatos que ya vienen comprimidos: recomprimirlos solo gasta CPU
+EXTENSIONES_COMPRIMIDAS = {
+    'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'jp2', 'jpx', 'jb2',
+    'zip', 'gz', 'docx', 'xlsx', 'pptx', 'epub', 'mp3', 'mp4', 'm4a',
+}
+
+# Para el resto se prueba DEFLATE sobre una muestra: si no reduce al menos
+# un 5% (un PDF con sus streams ya comprimidos, un TIFF con LZW) va STORED
+MUESTRA_BYTES = 64 * 1024
+MUESTRA_MINIMA = 4 * 1024
+RATIO_SIN_GANANCIA = 0.95
+
+# Archivos en disco mas grandes que esto se agregan como stream (sin
+# cargarlos en memoria ni comprimirlos en paralelo)
+MAX_MIEMBRO_EN_MEMORIA = 64 * 1024 * 1024
+
+# Miembros en compresion por thread antes de bloquear al productor
+PENDIENTES_POR_THREAD = 2
+
+_LIMITE_32 = 0xFFFFFFFF
+_LIMITE_16 = 0xFFFF
+_FLAG_UTF8 = 0x800
+_VERSION_ZIP64 = 45
+_VERSION_DEFLATE = 20
+_SISTEMA_UNIX = 3 << 8
+_ATRIBUTOS_ARCHIVO = 0o644 << 16
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def elegir_compresion(nombre: str, muestra: bytes) -> int:
+    """
+    Metodo de compresion para un miembro segun su extension y una muestra
+    de su contenido.
+
+    Returns:
+        zipfile.ZIP_STORED o zipfile.ZIP_DEFLATED
+    """
+    extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+    if extension in EXTENSIONES_COMPRIMIDAS:
+        return zipfile.ZIP_STORED
+
+    muestra = muestra[:MUESTRA_BYTES]
+    if len(muestra) >= MUESTRA_MINIMA:
+        if len(zlib.compress(muestra, 1)) > len(muestra) * RATIO_SIN_GANANCIA:
+            return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _obtener_pool():
+    """Pool de compresion compartido por proceso (None si ZIP_THREADS <= 1)."""
+    global _pool
+    if config.ZIP_THREADS <= 1:
+        return None
+    with _lock_pool:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=config.ZIP_THREADS,
+                                       thread_name_prefix='zip')
+        return _pool
+
+
+def _comprimir(datos: bytes, metodo: int, nivel: int) -> tuple:
+    """CRC32 y contenido comprimido (DEFLATE crudo, como lo guarda ZIP)."""
+    crc = zlib.crc32(datos)
+    if metodo == zipfile.ZIP_DEFLATED:
+        compresor = zlib.compressobj(nivel, zlib.DEFLATED, -15)
+        datos = compresor.compress(datos) + compresor.flush()
+    return crc, datos
+
+
+class _Hecho:
+    """Resultado ya calculado con la interfaz minima de un Future."""
+
+    def __init__(self, valor):
+        self._valor = valor
+
+    def done(self) -> bool:
+        return True
+
+    def result(self):
+        return self._valor
+
+
+def _fecha_dos(instante: float) -> tuple:
+    t = time.localtime(instante)
+    fecha = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    hora = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return hora, fecha
+
+
+class _Entrada:
+    """Datos de un miembro escrito, para el directorio central."""
+
+    __slots__ = ('nombre', 'flags', 'metodo', 'hora', 'fecha', 'crc',
+                 'tamano_comprimido', 'tamano', 'offset')
+
+    def __init__(self, nombre: bytes, flags: int, metodo: int, hora: int, fecha: int, offset: int):
+        self.nombre = nombre
+        self.flags = flags
+        self.metodo = metodo
+        self.hora = hora
+        self.fecha = fecha
+        self.offset = offset
+        self.crc = 0
+        self.tamano_comprimido = 0
+        self.tamano = 0
+
+
+class _MiembroStream(io.RawIOBase):
+    """Miembro escrito por partes: comprime a medida y completa su cabecera al cerrar."""
+
+    def __init__(self, zip_salida: 'ZipSalida', entrada: _Entrada):
+        super().__init__()
+        self._zs = zip_salida
+        self._entrada = entrada
+        self._compresor = zlib.compressobj(config.ZIP_COMPRESSLEVEL, zlib.DEFLATED, -15) \
+            if entrada.metodo == zipfile.ZIP_DEFLATED else None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self._entrada.crc = zlib.crc32(datos, self._entrada.crc)
+        self._entrada.tamano += len(datos)
+        salida = self._compresor.compress(datos) if self._compresor else datos
+        self._zs._archivo.write(salida)
+        self._entrada.tamano_comprimido += len(salida)
+        return len(datos)
+
+    def close(self):
+        if self.closed:
+            return
+        if self._compresor:
+            salida = self._compresor.flush()
+            self._zs._archivo.write(salida)
+            self._entrada.tamano_comprimido += len(salida)
+        super().close()
+        self._zs._cerrar_stream(self._entrada)
+
+
+class ZipSalida:
+    """
+    ZIP de resultado que se escribe a medida que se generan sus partes.
+
+    Uso:
+        with ZipSalida(config.OUTPUT_FOLDER / nombre_zip) as zs:
+            zs.escribir('pagina 1.png', png_bytes)
+
+    Si el bloque termina con una excepcion el ZIP parcial se elimina.
+    """
+
+    def __init__(self, ruta_zip: Path):
+        self.ruta = Path(ruta_zip)
+        self.miembros = 0
+        self._archivo = open(self.ruta, 'wb')
+        self._entradas = []
+        self._pendientes = deque()
+        self._stream_abierto = False
+        self._pool = _obtener_pool()
+        self._max_pendientes = max(config.ZIP_THREADS, 1) * PENDIENTES_POR_THREAD
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_exc, exc, tb):
+        if tipo_exc is None:
+            self.cerrar()
+        else:
+            self.descartar()
+        return False
+
+    # -------------------------------------------------------------------------
+    # Agregar miembros
+    # -------------------------------------------------------------------------
+
+    def escribir(self, nombre: str, datos: bytes):
+        """Agrega un miembro con el contenido indicado (se comprime en paralelo)."""
+        if self._stream_abierto:
+            raise RuntimeError("Hay un miembro abierto como stream")
+        metodo = elegir_compresion(nombre, datos[:MUESTRA_BYTES])
+        if self._pool is not None:
+            resultado = self._pool.submit(_comprimir, datos, metodo, config.ZIP_COMPRESSLEVEL)
+        else:
+            resultado = _Hecho(_comprimir(datos, metodo, config.ZIP_COMPRESSLEVEL))
+        self._pendientes.append((nombre, metodo, len(datos), time.time(), resultado))
+        self.miembros += 1
+        self._volcar(hasta=self._max_pendientes)
+
+    def agregar_archivo(self, ruta: Path, nombre: str):
+        """Agrega un archivo existente en disco como miembro."""
+        ruta = Path(ruta)
+        if ruta.stat().st_size <= MAX_MIEMBRO_EN_MEMORIA:
+            self.escribir(nombre, ruta.read_bytes())
+            return
+        with open(ruta, 'rb') as f:
+            muestra = f.read(MUESTRA_BYTES)
+            f.seek(0)
+            with self._abrir_binario(nombre, elegir_compresion(nombre, muestra)) as destino:
+                while True:
+                    bloque = f.read(1024 * 1024)
+                    if not bloque:
+                        break
+                    destino.write(bloque)
+
+    def abrir(self, nombre: str, encoding: str = None):
+        """
+        Abre un miembro para escribirlo como stream (por ejemplo un CSV
+        grande). Con encoding se obtiene un stream de texto. Hasta cerrarlo
+        no se pueden agregar otros miembros.
+        """
+        extension = nombre.rsplit('.', 1)[-1].lower() if '.' in nombre else ''
+        metodo = zipfile.ZIP_STORED if extension in EXTENSIONES_COMPRIMIDAS \
+            else zipfile.ZIP_DEFLATED
+        stream = io.BufferedWriter(self._abrir_binario(nombre, metodo), 1024 * 1024)
+        if encoding:
+            return io.TextIOWrapper(stream, encoding=encoding, newline='')
+        return stream
+
+    def _abrir_binario(self, nombre: str, metodo: int) -> _MiembroStream:
+        if self._stream_abierto:
+            raise RuntimeError("Hay un miembro abierto como stream")
+        self._volcar()
+        entrada = self._nueva_entrada(nombre, metodo, time.time())
+        # Tamanos desconocidos: ZIP64 en la cabecera local, se completa al cerrar
+        self._escribir_cabecera_local(entrada, zip64=True)
+        self._stream_abierto = True
+        self.miembros += 1
+        return _MiembroStream(self, entrada)
+
+    def _cerrar_stream(self, entrada: _Entrada):
+        fin = self._archivo.tell()
+        self._archivo.seek(entrada.offset)
+        self._escribir_cabecera_local(entrada, zip64=True)
+        self._archivo.seek(fin)
+        self._entradas.append(entrada)
+        self._stream_abierto = False
+
+    # -------------------------------------------------------------------------
+    # Formato ZIP
+    # -------------------------------------------------------------------------
+
+    def _nueva_entrada(self, nombre: str, metodo: int, instante: float) -> _Entrada:
+        try:
+            nombre_bytes, flags = nombre.encode('ascii'), 0
+        except UnicodeEncodeError:
+            nombre_bytes, flags = nombre.encode('utf-8'), _FLAG_UTF8
+        hora, fecha = _fecha_dos(instante)
+        return _Entrada(nombre_bytes, flags, metodo, hora, fecha, self._archivo.tell())
+
+    def _escribir_cabecera_local(self, entrada: _Entrada, zip64: bool):
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, entrada.tamano, entrada.tamano_comprimido)
+            tamano, comprimido, version = _LIMITE_32, _LIMITE_32, _VERSION_ZIP64
+        else:
+            extra = b''
+            tamano, comprimido, version = entrada.tamano, entrada.tamano_comprimido, _VERSION_DEFLATE
+        self._archivo.write(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, entrada.flags, entrada.metodo,
+            entrada.hora, entrada.fecha, entrada.crc, comprimido, tamano,
+            len(entrada.nombre), len(extra)))
+        self._archivo.write(entrada.nombre)
+        self._archivo.write(extra)
+
+    def _volcar(self, hasta: int = 0):
+        """
+        Escribe los miembros ya comprimidos, en orden. Espera al mas antiguo
+        mientras haya mas de 'hasta' pendientes (hasta=0 los escribe todos).
+        """
+        while self._pendientes and (len(self._pendientes) > hasta
+                                    or self._pendientes[0][4].done()):
+            nombre, metodo, tamano, instante, resultado = self._pendientes.popleft()
+            crc, datos = resultado.result()
+            entrada = self._nueva_entrada(nombre, metodo, instante)
+            entrada.crc = crc
+            entrada.tamano = tamano
+            entrada.tamano_comprimido = len(datos)
+            zip64 = tamano >= _LIMITE_32 or len(datos) >= _LIMITE_32
+            self._escribir_cabecera_local(entrada, zip64)
+            self._archivo.write(datos)
+            self._entradas.append(entrada)
+
+    def _escribir_directorio_central(self):
+        inicio = self._archivo.tell()
+        for entrada in self._entradas:
+            extra_zip64 = []
+            tamano, comprimido, offset = entrada.tamano, entrada.tamano_comprimido, entrada.offset
+            if tamano >= _LIMITE_32:
+                extra_zip64.append(tamano)
+                tamano = _LIMITE_32
+            if comprimido >= _LIMITE_32:
+                extra_zip64.append(comprimido)
+                comprimido = _LIMITE_32
+            if offset >= _LIMITE_32:
+                extra_zip64.append(offset)
+                offset = _LIMITE_32
+            extra = struct.pack(f'<HH{len(extra_zip64)}Q', 1, 8 * len(extra_zip64),
+                                *extra_zip64) if extra_zip64 else b''
+            version = _VERSION_ZIP64 if extra_zip64 else _VERSION_DEFLATE
+            self._archivo.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, _SISTEMA_UNIX | version, version,
+                entrada.flags, entrada.metodo, entrada.hora, entrada.fecha, entrada.crc,
+                comprimido, tamano, len(entrada.nombre), len(extra), 0, 0, 0,
+                _ATRIBUTOS_ARCHIVO, offset))
+            self._archivo.write(entrada.nombre)
+            self._archivo.write(extra)
+
+        fin = self._archivo.tell()
+        cantidad, tamano_directorio = len(self._entradas), fin - inicio
+        if cantidad >= _LIMITE_16 or inicio >= _LIMITE_32 or tamano_directorio >= _LIMITE_32:
+            self._archivo.write(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, _VERSION_ZIP64, _VERSION_ZIP64, 0, 0,
+                cantidad, cantidad, tamano_directorio, inicio))
+            self._archivo.write(struct.pack('<IIQI', 0x07064b50, 0, fin, 1))
+        self._archivo.write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, min(cantidad, _LIMITE_16), min(cantidad, _LIMITE_16),
+            min(tamano_directorio, _LIMITE_32), min(inicio, _LIMITE_32), 0))
+
+    # -------------------------------------------------------------------------
+    # Cierre
+    # -------------------------------------------------------------------------
+
+    def cerrar(self) -> Path:
+        """Escribe los miembros pendientes y el directorio central; retorna la ruta."""
+        if self._stream_abierto:
+            raise RuntimeError("Hay un miembro abierto como stream")
+        self._volcar()
+        self._escribir_directorio_central()
+        self._archivo.close()
+        logger.info(f"ZIP creado: {self.ruta} ({self.miembros} archivos, "
+                    f"{self.ruta.stat().st_size} bytes)")
+        return self.ruta
+
+    def descartar(self):
+        """Cierra y elimina un ZIP incompleto."""
+        for *_, resultado in self._pendientes:
+            if hasattr(resultado, 'cancel'):
+                resultado.cancel()
+        self._pendientes.clear()
+        self._archivo.close()
+        self.ruta.unlink(missing_ok=True)